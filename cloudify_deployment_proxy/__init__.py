@@ -13,23 +13,27 @@
 # limitations under the License.
 
 import sys
-import time
 import os
+import copy
 
 from cloudify import ctx
 from cloudify import manager
 from cloudify.utils import exception_to_error_cause
 from cloudify.exceptions import NonRecoverableError
 from cloudify_rest_client.client import CloudifyClient
+from cloudify_rest_client.constants import VisibilityState
 from cloudify_rest_client.exceptions import CloudifyClientError
 from cloudify_common_sdk._compat import text_type, urlparse
 
 from .constants import (
     EXECUTIONS_TIMEOUT,
     POLLING_INTERVAL,
+    LOGS_PAGE_SIZE,
     EXTERNAL_RESOURCE,
     SECRETS_CREATE,
     SECRETS_DELETE,
+    SECRETS_IMPORT,
+    SECRETS_WORKERS,
     PLUGIN_UPLOAD,
     PLUGIN_DELETE,
     BP_UPLOAD,
@@ -41,19 +45,24 @@ from .constants import (
     NIP,
     NIP_TYPE,
     DEP_TYPE,
+    UPLOAD_WORKERS,
+    CHILDREN_WORKERS,
 )
 from .polling import (
-    any_bp_by_id,
-    any_dep_by_id,
+    any_resource_by_id,
     poll_with_timeout,
     poll_workflow_after_execute,
-    dep_system_workflows_finished
+    dep_system_workflows_finished,
+    dep_deleted,
+    iter_node_instances
 )
 from .utils import (
     get_desired_value,
     update_attributes,
-    get_local_path,
-    zip_files
+    zip_sources,
+    run_in_threads,
+    value_hash,
+    project_paths
 )
 
 
@@ -119,6 +128,10 @@ class DeploymentProxyBase(object):
         self.deployment_outputs = self.deployment.get('outputs')
         self.deployment_all_outputs = self.deployment.get('all_outputs', True)
         self.deployment_logs = self.deployment.get('logs', {})
+        # create several deployments from the same blueprint
+        self.deployment_children = self.deployment.get('children') or []
+        self.children_concurrency = self.deployment.get(
+            'children_concurrency', CHILDREN_WORKERS)
 
         # Node-instance-related properties
         self.node_instance_proxy = self.config.get('node_instance')
@@ -145,6 +158,10 @@ class DeploymentProxyBase(object):
         # successfully
         self.execution_id = None
 
+        # (resource type, resource id) -> resource exists, checked in
+        # current operation
+        self._resources_exist = {}
+
     def dp_get_client_response(self,
                                _client,
                                _client_attr,
@@ -165,6 +182,47 @@ class DeploymentProxyBase(object):
         else:
             return response
 
+    def _resource_exists(self, resource_type, resource_id):
+        key = (resource_type, resource_id)
+        if key not in self._resources_exist:
+            self._resources_exist[key] = any_resource_by_id(
+                self.client, resource_id, resource_type)
+        return self._resources_exist[key]
+
+    def _children(self):
+        """Proxies for child deployments, share client and blueprint."""
+        children = []
+        for index, child in enumerate(self.deployment_children):
+            child_proxy = copy.copy(self)
+            child_proxy.deployment_id = child.get('id') or \
+                '{0}-{1}'.format(self.deployment_id, index)
+            child_proxy.deployment_inputs = dict(self.deployment_inputs)
+            child_proxy.deployment_inputs.update(child.get('inputs') or {})
+            child_proxy.deployment_children = []
+            child_proxy.execution_id = None
+            children.append(child_proxy)
+        return children
+
+    def _fan_out(self, action, children, method):
+        """Run method for each child deployment in parallel.
+
+        :returns: list of method results in order of children
+        """
+        results = run_in_threads(
+            lambda child: getattr(child, method)(),
+            children,
+            min(self.children_concurrency, len(children)))
+        failed = []
+        for child, (_, error) in zip(children, results):
+            if error:
+                failed.append(child.deployment_id)
+                ctx.logger.error('Failed to {0} deployment {1}: {2}'.format(
+                    action, repr(child.deployment_id), text_type(error)))
+        if failed:
+            raise NonRecoverableError(
+                'Failed to {0} deployments: {1}'.format(action, repr(failed)))
+        return [result for result, _ in results]
+
     def upload_blueprint(self):
 
         if 'blueprint' not in ctx.instance.runtime_properties:
@@ -176,7 +234,7 @@ class DeploymentProxyBase(object):
         update_attributes(
             'blueprint', 'application_file_name', self.blueprint_file_name)
 
-        blueprint_is = any_bp_by_id(self.client, self.blueprint_id)
+        blueprint_is = self._resource_exists('blueprints', self.blueprint_id)
 
         if self.blueprint.get(EXTERNAL_RESOURCE) and not blueprint_is:
             raise NonRecoverableError(
@@ -215,9 +273,23 @@ class DeploymentProxyBase(object):
                  archive_location=self.blueprint_archive,
                  application_file_name=self.blueprint_file_name)
 
-        return self.dp_get_client_response('blueprints',
-                                           BP_UPLOAD,
-                                           client_args)
+        response = self.dp_get_client_response('blueprints',
+                                               BP_UPLOAD,
+                                               client_args)
+        self._resources_exist[('blueprints', self.blueprint_id)] = True
+        return response
+
+    def _upload_plugin(self, plugin):
+        zip_path = None
+        try:
+            zip_path = zip_sources([plugin['wagon_path'],
+                                    plugin['plugin_yaml_path']])
+            # upload plugin
+            return self.dp_get_client_response(
+                'plugins', PLUGIN_UPLOAD, {'plugin_path': zip_path})
+        finally:
+            if zip_path:
+                os.remove(zip_path)
 
     def _upload_plugins(self):
         # plugins
@@ -228,68 +300,159 @@ class DeploymentProxyBase(object):
             if isinstance(self.plugins, list):
                 plugins_list = self.plugins
             elif isinstance(self.plugins, dict):
-                plugins_list = self.plugins.values()
+                plugins_list = list(self.plugins.values())
             else:
                 raise NonRecoverableError(
                     'Wrong type in plugins: {}'.format(repr(self.plugins)))
             for plugin in plugins_list:
-                ctx.logger.info('Creating plugin zip archive..')
-                wagon_path = None
-                yaml_path = None
-                zip_path = None
-                try:
-                    if not plugin.get('wagon_path') or \
-                            not plugin.get('plugin_yaml_path'):
-                        raise NonRecoverableError(
-                            'You should provide both values wagon_path: {}'
-                            ' and plugin_yaml_path: {}'
-                            .format(repr(plugin.get('wagon_path')),
-                                    repr(plugin.get('plugin_yaml_path'))))
-                    wagon_path = get_local_path(plugin['wagon_path'],
-                                                create_temp=True)
-                    yaml_path = get_local_path(plugin['plugin_yaml_path'],
-                                               create_temp=True)
-                    zip_path = zip_files([wagon_path, yaml_path])
-                    # upload plugin
-                    plugin = self.dp_get_client_response(
-                        'plugins', PLUGIN_UPLOAD, {'plugin_path': zip_path})
-                    ctx.instance.runtime_properties['plugins'].append(
-                        plugin.id)
-                    ctx.logger.info('Uploaded {0}'.format(repr(plugin.id)))
-                finally:
-                    if wagon_path:
-                        os.remove(wagon_path)
-                    if yaml_path:
-                        os.remove(yaml_path)
-                    if zip_path:
-                        os.remove(zip_path)
+                if not plugin.get('wagon_path') or \
+                        not plugin.get('plugin_yaml_path'):
+                    raise NonRecoverableError(
+                        'You should provide both values wagon_path: {}'
+                        ' and plugin_yaml_path: {}'
+                        .format(repr(plugin.get('wagon_path')),
+                                repr(plugin.get('plugin_yaml_path'))))
+
+            ctx.logger.info('Creating plugin zip archives..')
+            results = run_in_threads(self._upload_plugin, plugins_list,
+                                     min(UPLOAD_WORKERS, len(plugins_list)))
+            errors = []
+            for plugin, error in results:
+                if error:
+                    errors.append(error)
+                    continue
+                ctx.instance.runtime_properties['plugins'].append(plugin.id)
+                ctx.logger.info('Uploaded {0}'.format(repr(plugin.id)))
+            if errors:
+                for error in errors[1:]:
+                    ctx.logger.error('Plugin upload failed: {0}'
+                                     .format(text_type(error)))
+                raise errors[0]
+
+    @staticmethod
+    def _secrets_report(action, keys, errors):
+        failed = []
+        for key, error in zip(keys, errors):
+            if error:
+                failed.append(key)
+                ctx.logger.error('Failed to {0} secret {1}: {2}'.format(
+                    action, repr(key), text_type(error)))
+            else:
+                ctx.logger.info('{0}d secret {1}'.format(
+                    action.capitalize(), repr(key)))
+        if failed:
+            raise NonRecoverableError(
+                'Failed to {0} secrets: {1}'.format(action, repr(failed)))
+
+    def _secrets_in_threads(self, action, client_attr, keys, client_args):
+        results = run_in_threads(
+            lambda key: self.dp_get_client_response(
+                'secrets', client_attr, client_args(key)),
+            keys,
+            min(SECRETS_WORKERS, len(keys)))
+        self._secrets_report(action, keys, [error for _, error in results])
+
+    def _import_secrets(self, keys):
+        """Create all secrets with single request.
+
+        :returns: list of keys which were not imported or None if manager
+                  does not support secrets import or user is not allowed
+                  to import secrets
+        """
+        if self.client_config:
+            tenant_name = self.client_config.get('tenant') or ctx.tenant_name
+        else:
+            tenant_name = ctx.tenant_name
+        secrets_list = [{
+            'key': key,
+            'value': self.secrets[key],
+            # same defaults as in secrets.create
+            'visibility': VisibilityState.TENANT,
+            'tenant_name': tenant_name,
+            'is_hidden_value': False,
+            'encrypted': False,
+        } for key in keys]
+        try:
+            response = getattr(self.client.secrets, SECRETS_IMPORT)(
+                secrets_list=secrets_list)
+        except AttributeError:
+            return None
+        except CloudifyClientError as ex:
+            # import requires more permissions than create, so use
+            # create for each secret on permissions errors also
+            if ex.status_code in (401, 403, 404, 405):
+                ctx.logger.debug('Secrets import is not available: {0}'
+                                 .format(text_type(ex)))
+                return None
+            raise NonRecoverableError(
+                'Client action {0} failed: {1}.'.format(SECRETS_IMPORT,
+                                                        text_type(ex)))
+
+        errors = response.get('secrets_errors')
+        if errors:
+            # invalid secrets list is not imported at all
+            ctx.logger.debug('Secrets import failed: {0}'.format(
+                repr(errors)))
+            return list(keys)
+        collisions = response.get('colliding_secrets') or []
+        if isinstance(collisions, dict):
+            collisions = [key for tenant_keys in collisions.values()
+                          for key in tenant_keys]
+        if collisions:
+            # existing secrets are not changed by import
+            ctx.logger.debug('Secrets already exist: {0}'.format(
+                repr(collisions)))
+        return [key for key in keys if key in collisions]
 
     def _set_secrets(self):
         # secrets set
         if self.secrets:
-            for secret_name in self.secrets:
-                self.dp_get_client_response('secrets', SECRETS_CREATE, {
-                    'key': secret_name,
-                    'value': self.secrets[secret_name],
-                })
-                ctx.logger.info('Created secret {0}'.format(repr(secret_name)))
+            keys = list(self.secrets)
+            # import all secrets with one request if manager supports it
+            if len(keys) > 1:
+                not_imported = self._import_secrets(keys)
+                if not_imported is not None:
+                    imported = [key for key in keys
+                                if key not in not_imported]
+                    self._secrets_report('create', imported,
+                                         [None] * len(imported))
+                    keys = not_imported
+            # secrets not imported are created one by one, so create
+            # reports own error for each of them
+            if keys:
+                self._secrets_in_threads(
+                    'create', SECRETS_CREATE, keys,
+                    lambda key: {'key': key, 'value': self.secrets[key]})
 
     def create_deployment(self):
 
         self._set_secrets()
         self._upload_plugins()
 
-        client_args = \
-            dict(blueprint_id=self.blueprint_id,
-                 deployment_id=self.deployment_id,
-                 inputs=self.deployment_inputs)
-
         if 'deployment' not in ctx.instance.runtime_properties:
             ctx.instance.runtime_properties['deployment'] = dict()
 
         update_attributes('deployment', 'id', self.deployment_id)
 
-        deployment_is = any_dep_by_id(self.client, self.deployment_id)
+        if self.deployment_children:
+            children = self._children()
+            update_attributes('deployment', 'children',
+                              [child.deployment_id for child in children])
+            # same as for single deployment, False if nothing is created
+            return any(self._fan_out('create', children,
+                                     '_create_deployment'))
+
+        return self._create_deployment()
+
+    def _create_deployment(self):
+
+        client_args = \
+            dict(blueprint_id=self.blueprint_id,
+                 deployment_id=self.deployment_id,
+                 inputs=self.deployment_inputs)
+
+        deployment_is = self._resource_exists('deployments',
+                                              self.deployment_id)
 
         if self.deployment.get(EXTERNAL_RESOURCE) and deployment_is:
             ctx.logger.info("Used external deployment.")
@@ -313,6 +476,7 @@ class DeploymentProxyBase(object):
         ctx.logger.info("Create deployment {0}."
                         .format(self.deployment_id))
         self.dp_get_client_response('deployments', DEP_CREATE, client_args)
+        self._resources_exist[('deployments', self.deployment_id)] = True
 
         # In order to set the ``self.execution_id`` need to get the
         # ``execution_id`` of current deployment ``self.deployment_id``
@@ -356,13 +520,11 @@ class DeploymentProxyBase(object):
             ctx.logger.info('Removed plugin {0}'.format(repr(plugin_id)))
 
     def _delete_secrets(self):
-        # secrets delete
+        # secrets delete, manager has no bulk delete for secrets
         if self.secrets:
-            for secret_name in self.secrets:
-                self.dp_get_client_response('secrets', SECRETS_DELETE, {
-                    'key': secret_name,
-                })
-                ctx.logger.info('Removed secret {0}'.format(repr(secret_name)))
+            self._secrets_in_threads(
+                'remove', SECRETS_DELETE, list(self.secrets),
+                lambda key: {'key': key})
 
     @staticmethod
     def _delete_properties():
@@ -378,6 +540,26 @@ class DeploymentProxyBase(object):
 
     def delete_deployment(self):
 
+        if self.deployment_children:
+            poll_result = all(self._fan_out('delete', self._children(),
+                                            '_delete_deployment'))
+        else:
+            poll_result = self._delete_deployment()
+
+        if not self.blueprint.get(EXTERNAL_RESOURCE):
+            ctx.logger.info("Delete blueprint {0}.".format(self.blueprint_id))
+            client_args = dict(blueprint_id=self.blueprint_id)
+            self.dp_get_client_response('blueprints', BP_DELETE, client_args)
+            self._resources_exist.pop(('blueprints', self.blueprint_id), None)
+
+        self._delete_plugins()
+        self._delete_secrets()
+        self._delete_properties()
+
+        return poll_result
+
+    def _delete_deployment(self):
+
         client_args = dict(deployment_id=self.deployment_id)
 
         poll_result = True
@@ -393,11 +575,15 @@ class DeploymentProxyBase(object):
             poll_with_timeout(
                 dep_system_workflows_finished,
                 timeout=self.timeout,
+                interval=self.interval,
                 pollster_args=pollster_args,
-                expected_result=True)
+                expected_result=True,
+                final_probe=True)
 
             ctx.logger.info("Delete deployment {0}".format(self.deployment_id))
             self.dp_get_client_response('deployments', DEP_DELETE, client_args)
+            self._resources_exist.pop(('deployments', self.deployment_id),
+                                      None)
 
             ctx.logger.info("Wait for deployment delete.")
 
@@ -406,30 +592,12 @@ class DeploymentProxyBase(object):
                      _dep_id=self.deployment_id)
 
             poll_result = poll_with_timeout(
-                any_dep_by_id,
+                dep_deleted,
                 timeout=self.timeout,
+                interval=self.interval,
                 pollster_args=pollster_args,
-                expected_result=False)
-
-        ctx.logger.info("Little wait internal cleanup services.")
-        time.sleep(POLLING_INTERVAL)
-        ctx.logger.info("Wait for stop all system workflows.")
-        pollster_args = \
-            dict(_client=self.client)
-        poll_with_timeout(
-            dep_system_workflows_finished,
-            timeout=self.timeout,
-            pollster_args=pollster_args,
-            expected_result=True)
-
-        if not self.blueprint.get(EXTERNAL_RESOURCE):
-            ctx.logger.info("Delete blueprint {0}.".format(self.blueprint_id))
-            client_args = dict(blueprint_id=self.blueprint_id)
-            self.dp_get_client_response('blueprints', BP_DELETE, client_args)
-
-        self._delete_plugins()
-        self._delete_secrets()
-        self._delete_properties()
+                expected_result=True,
+                final_probe=True)
 
         return poll_result
 
@@ -440,39 +608,26 @@ class DeploymentProxyBase(object):
 
         update_attributes('executions', 'workflow_id', self.workflow_id)
 
-        # Wait for the deployment to finish any executions
-        pollster_args = \
-            dict(_client=self.client,
-                 _check_all_in_deployment=self.deployment_id)
+        children = self._children()
 
-        if not poll_with_timeout(dep_system_workflows_finished,
-                                 timeout=self.timeout,
-                                 pollster_args=pollster_args,
-                                 expected_result=True):
+        # Wait for the deployment to finish any executions, all children
+        # must be ready before any execution is started
+        if children:
+            ready = all(self._fan_out('check', children,
+                                      '_ready_for_execution'))
+        else:
+            ready = self._ready_for_execution()
+        if not ready:
             return ctx.operation.retry(
                 'The deployment is not ready for execution.')
 
         # we must to run some execution
         if not self.deployment.get(EXTERNAL_RESOURCE) or \
                 self.deployment.get(EXTERNAL_RESOURCE) and self.reexecute:
-
-            execution_args = self.config.get('executions_start_args', {})
-            client_args = \
-                dict(deployment_id=self.deployment_id,
-                     workflow_id=self.workflow_id,
-                     **execution_args)
-            response = self.dp_get_client_response('executions',
-                                                   EXEC_START, client_args)
-
-            # Set the execution_id for the last execution process created
-            self.execution_id = response['id']
-            ctx.logger.debug('Executions start response: {0}'.format(response))
-
-            # Poll for execution success.
-            if not self.verify_execution_successful():
-                ctx.logger.error('Deployment error.')
-
-            ctx.logger.debug('Polling execution succeeded')
+            if children:
+                self._fan_out('execute', children, '_start_execution')
+            else:
+                self._start_execution()
 
         if NIP_TYPE in ctx.node.type_hierarchy:
             ctx.logger.info('Start post execute node proxy')
@@ -485,35 +640,84 @@ class DeploymentProxyBase(object):
         raise NonRecoverableError(
             'Unsupported node type provided {0}'.format(ctx.node.type))
 
-    def post_execute_node_instance_proxy(self):
+    def _ready_for_execution(self):
+        pollster_args = \
+            dict(_client=self.client,
+                 _check_all_in_deployment=self.deployment_id)
 
-        node_instance_id = self.node_instance_proxy.get('id')
-        node_instance_proxy = \
-            ctx.instance.runtime_properties.get(NIP, dict())
+        return poll_with_timeout(dep_system_workflows_finished,
+                                 timeout=self.timeout,
+                                 interval=self.interval,
+                                 pollster_args=pollster_args,
+                                 expected_result=True,
+                                 final_probe=True)
+
+    def _start_execution(self):
+        execution_args = self.config.get('executions_start_args', {})
         client_args = \
+            dict(deployment_id=self.deployment_id,
+                 workflow_id=self.workflow_id,
+                 **execution_args)
+        response = self.dp_get_client_response('executions',
+                                               EXEC_START, client_args)
+
+        # Set the execution_id for the last execution process created
+        self.execution_id = response['id']
+        ctx.logger.debug('Executions start response: {0}'.format(response))
+
+        # Poll for execution success.
+        if not self.verify_execution_successful():
+            ctx.logger.error('Deployment error.')
+
+        ctx.logger.debug('Polling execution succeeded')
+
+    def _node_instances_proxy(self):
+        node_instance_id = self.node_instance_proxy.get('id')
+        # only selected runtime properties are copied if paths are set
+        paths = [path.split('.') for path in
+                 self.node_instance_proxy.get('runtime_properties') or []]
+        node_instance_proxy = dict()
+        list_args = \
             dict(deployment_id=self.deployment_id,
                  node_id=self.node_instance_proxy.get('node', {}).get('id'))
-        node_instances = \
-            self.dp_get_client_response('node_instances', 'list', client_args)
-        ctx.logger.debug(
-            'Received these node instances: {0}'.format(node_instances))
-        for node_instance in node_instances:
+        if node_instance_id:
+            list_args['id'] = node_instance_id
+        for node_instance in iter_node_instances(
+                self.client,
+                _include=['id', 'runtime_properties'],
+                **list_args):
+            # recheck in case of filter unsupported by manager
             if node_instance_id and \
                     node_instance_id != node_instance.get('id'):
                 continue
-            node_instance_proxy[node_instance.get('id')] = \
-                node_instance.get('runtime_properties')
+            runtime_properties = node_instance.get('runtime_properties')
+            if paths:
+                runtime_properties = project_paths(runtime_properties or {},
+                                                   paths)
+            node_instance_proxy[node_instance.get('id')] = runtime_properties
+        ctx.logger.debug(
+            'Received {0} node instances'.format(len(node_instance_proxy)))
+        return node_instance_proxy
+
+    def post_execute_node_instance_proxy(self):
+
+        node_instance_proxy = \
+            ctx.instance.runtime_properties.get(NIP, dict())
+        if self.deployment_children:
+            # node instance ids are unique between deployments
+            for child_proxy in self._fan_out('get node instances of',
+                                             self._children(),
+                                             '_node_instances_proxy'):
+                node_instance_proxy.update(child_proxy)
+        else:
+            node_instance_proxy.update(self._node_instances_proxy())
         ctx.instance.runtime_properties[NIP] = node_instance_proxy
         return True
 
-    def post_execute_deployment_proxy(self):
-        runtime_prop = ctx.instance.runtime_properties['deployment']
-        ctx.logger.debug(
-            'Runtime deployment properties: {0}'.format(runtime_prop))
-
-        if 'outputs' not in runtime_prop:
-            update_attributes('deployment', 'outputs', dict())
-            ctx.logger.debug('No deployment proxy outputs exist.')
+    def _deployment_outputs(self):
+        if not self.deployment_outputs and not self.deployment_all_outputs:
+            # nothing to expose, so outputs are not requested
+            return {}
 
         try:
             ctx.logger.debug('Deployment ID is {0}'.format(self.deployment_id))
@@ -526,18 +730,47 @@ class DeploymentProxyBase(object):
                 'Failed to query deployment outputs: {0}'.format(
                     self.deployment_id),
                 causes=[exception_to_error_cause(ex, tb)])
+
+        dep_outputs = response.get('outputs')
+        ctx.logger.debug('Deployment outputs: {0}'.format(dep_outputs))
+        if self.deployment_outputs:
+            output_mapping = self.deployment_outputs
+        elif self.deployment_all_outputs:
+            output_mapping = {key: key for key, _ in dep_outputs.items()}
         else:
-            dep_outputs = response.get('outputs')
-            ctx.logger.debug('Deployment outputs: {0}'.format(dep_outputs))
-            if self.deployment_outputs:
-                output_mapping = self.deployment_outputs
-            elif self.deployment_all_outputs:
-                output_mapping = {key: key for key, _ in dep_outputs.items()}
-            else:
-                output_mapping = {}
-            for key, val in output_mapping.items():
-                ctx.instance.runtime_properties['deployment']['outputs'][val] \
-                    = dep_outputs.get(key, '')
+            output_mapping = {}
+        return dict((val, dep_outputs.get(key, ''))
+                    for key, val in output_mapping.items())
+
+    def post_execute_deployment_proxy(self):
+        runtime_prop = ctx.instance.runtime_properties['deployment']
+        ctx.logger.debug(
+            'Runtime deployment properties: {0}'.format(runtime_prop))
+
+        if self.deployment_children:
+            # outputs of each child are stored under child deployment id
+            children = self._children()
+            projection = dict(zip(
+                [child.deployment_id for child in children],
+                self._fan_out('get outputs of', children,
+                              '_deployment_outputs')))
+        else:
+            projection = self._deployment_outputs()
+
+        # runtime properties are stored only if mapped outputs are changed
+        outputs_hash = value_hash(projection)
+        if 'outputs' in runtime_prop and \
+                runtime_prop.get('outputs_hash') == outputs_hash:
+            ctx.logger.debug('Deployment outputs are not changed.')
+            return True
+
+        if 'outputs' not in runtime_prop:
+            ctx.logger.debug('No deployment proxy outputs exist.')
+        runtime_prop = dict(runtime_prop)
+        runtime_prop['outputs'] = dict(runtime_prop.get('outputs') or {})
+        runtime_prop['outputs'].update(projection)
+        runtime_prop['outputs_hash'] = outputs_hash
+        ctx.instance.runtime_properties['deployment'] = runtime_prop
         return True
 
     def verify_execution_successful(self):
@@ -549,4 +782,7 @@ class DeploymentProxyBase(object):
             self.workflow_state,
             self.workflow_id,
             self.execution_id,
-            _log_redirect=self.deployment_logs.get('redirect', True))
+            _log_redirect=self.deployment_logs.get('redirect', True),
+            _final_probe=True,
+            _log_page_size=self.deployment_logs.get('page_size',
+                                                    LOGS_PAGE_SIZE))
@@ -15,16 +15,34 @@
 DEPLOYMENTS_TIMEOUT = 120
 EXECUTIONS_TIMEOUT = 1800
 POLLING_INTERVAL = 10
+POLLING_FIRST_INTERVAL = 1
+POLLING_BACKOFF = 2
+POLLING_JITTER = 0.2
+EXECUTION_END_STATES = ['terminated', 'completed', 'failed', 'cancelled']
+EXECUTION_ACTIVE_STATES = ['pending', 'started', 'cancelling',
+                           'force_cancelling', 'kill_cancelling', 'queued',
+                           'scheduled']
+EXECUTIONS_IDS_CHUNK_SIZE = 100
+LOGS_PAGE_SIZE = 250
+LOGS_CHECKPOINT_INTERVAL = 30
+UPLOAD_WORKERS = 5
+SECRETS_WORKERS = 10
+CHILDREN_WORKERS = 10
+DOWNLOAD_CACHE_DIR = 'cloudify_download_cache'
+DOWNLOAD_CACHE_SIZE = 1024 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 EXTERNAL_RESOURCE = 'external_resource'
 
 PLUGIN_UPLOAD = 'upload'
 PLUGIN_DELETE = 'delete'
 SECRETS_CREATE = 'create'
 SECRETS_DELETE = 'delete'
+SECRETS_IMPORT = 'import_secrets'
 BP_UPLOAD = '_upload'
 BP_DELETE = 'delete'
 DEP_CREATE = 'create'
 DEP_DELETE = 'delete'
+DEP_DELETE_WORKFLOW = 'delete_deployment_environment'
 EXEC_START = 'start'
 EXEC_LIST = 'list'
 
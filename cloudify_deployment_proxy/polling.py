@@ -14,15 +14,53 @@
 
 from os import getenv
 import time
+import random
+import hashlib
 import logging
+import itertools
+import threading
 
 from cloudify_common_sdk._compat import text_type
 
 from cloudify import ctx
+from cloudify.constants import (
+    CLOUDIFY_AUTHENTICATION_HEADER,
+    CLOUDIFY_EXECUTION_TOKEN_HEADER,
+    CLOUDIFY_TOKEN_AUTHENTICATION_HEADER,
+)
 from cloudify.exceptions import NonRecoverableError
 from cloudify_rest_client.exceptions import CloudifyClientError
 
-from .constants import POLLING_INTERVAL
+from .constants import (
+    POLLING_INTERVAL,
+    POLLING_FIRST_INTERVAL,
+    POLLING_BACKOFF,
+    POLLING_JITTER,
+    EXECUTION_END_STATES,
+    EXECUTION_ACTIVE_STATES,
+    EXECUTIONS_IDS_CHUNK_SIZE,
+    LOGS_PAGE_SIZE,
+    LOGS_CHECKPOINT_INTERVAL,
+    DEP_DELETE_WORKFLOW,
+)
+
+LOGS_CURSOR = 'logs_cursor'
+# event counters saved by previous versions
+COUNT_EVENTS = 'received_events'
+
+# (instance id, execution id) -> cursor of events already relayed
+_logs_cursors = {}
+_logs_cursors_lock = threading.Lock()
+# runtime properties of instance are saved by one thread at the same time
+_logs_cursors_save_lock = threading.Lock()
+# level name -> logging level
+_event_levels = {}
+# headers with credentials of rest client
+_AUTH_HEADERS = (
+    CLOUDIFY_AUTHENTICATION_HEADER,
+    CLOUDIFY_EXECUTION_TOKEN_HEADER,
+    CLOUDIFY_TOKEN_AUTHENTICATION_HEADER,
+)
 
 
 def any_bp_by_id(_client, _bp_id):
@@ -54,11 +92,13 @@ def all_resource_by_id(_client, _resource_id, _resource_type):
 def resource_by_id(_client, _id, _type):
     _resources_client = getattr(_client, _type)
     try:
-        _resources = _resources_client.list(_include=['id'])
+        # filter on server side, so only matching resource is returned
+        _resources = _resources_client.list(id=_id, _include=['id'])
     except CloudifyClientError as ex:
         raise NonRecoverableError(
             '{0} list failed {1}.'.format(_type, text_type(ex)))
     else:
+        # recheck in case of filter unsupported by manager
         return [text_type(_r['id']) == _id for _r in _resources]
 
 
@@ -66,98 +106,223 @@ def poll_with_timeout(pollster,
                       timeout,
                       interval=POLLING_INTERVAL,
                       pollster_args=None,
-                      expected_result=True):
+                      expected_result=True,
+                      first_interval=POLLING_FIRST_INTERVAL,
+                      final_probe=False):
 
     pollster_args = pollster_args or dict()
     # Check if timeout value is -1 that allows infinite timeout
     # If timeout value is not -1 then it is a finite timeout
     timeout = float('infinity') if timeout == -1 else timeout
-    current_time = time.time()
+    deadline = time.time() + timeout
+    # first probes are fast, later delay grows up to interval
+    delay = min(first_interval, interval)
 
     ctx.logger.debug('Timeout value is {0}'.format(timeout))
 
-    while time.time() <= current_time + timeout:
-        if pollster(**pollster_args) != expected_result:
-            ctx.logger.debug('Polling...')
-            time.sleep(interval)
-        else:
+    while True:
+        if pollster(**pollster_args) == expected_result:
             ctx.logger.debug('Polling succeeded!')
             return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        # jitter spreads probes of proxies started at the same time
+        sleep_time = delay * random.uniform(1 - POLLING_JITTER, 1)
+        if sleep_time >= remaining:
+            # no more probes before deadline, so wait only for final
+            # probe on deadline
+            if not final_probe:
+                break
+            sleep_time = remaining
+        ctx.logger.debug('Polling...')
+        time.sleep(sleep_time)
+        delay = min(delay * POLLING_BACKOFF, interval)
 
     ctx.logger.error('Polling timed out!')
     return False
 
 
-def dep_logs_redirect(_client, execution_id):
-    COUNT_EVENTS = "received_events"
-
-    if not ctx.instance.runtime_properties.get(COUNT_EVENTS):
-        ctx.instance.runtime_properties[COUNT_EVENTS] = {}
-
-    last_event = int(ctx.instance.runtime_properties[COUNT_EVENTS].get(
-        execution_id, 0
-    ))
-
-    full_count = last_event + 100
-
-    while full_count > last_event:
-        events, full_count = _client.events.get(execution_id, last_event,
-                                                250, True)
-        for event in events:
-            ctx.logger.debug(
-                'Event {0} for execution_id {1}'.format(event, execution_id))
-            instance_prompt = event.get('node_instance_id', "")
-            if instance_prompt:
-                if event.get('operation'):
-                    instance_prompt += (
-                        "." + event.get('operation').split('.')[-1]
-                    )
-
-            if instance_prompt:
-                instance_prompt = "[" + instance_prompt + "] "
-
-            message = "%s %s%s" % (
-                event.get('reported_timestamp', ""),
-                instance_prompt if instance_prompt else "",
-                event.get('message', "")
-            )
-            message = text_type(message)
-
+def _event_level(level):
+    # If the event dict had a 'level' key, then the value is
+    # a string. In that case, convert it to uppercase and get
+    # the matching Python logging constant.
+    if isinstance(level, int):
+        return level
+    if level not in _event_levels:
+        log_level = logging.INFO
+        if isinstance(level, text_type):
+            log_level = logging.getLevelName(level.upper())
+        # In the (very) odd case that the level is still not an int
+        # (can happen if the original level value wasn't recognized
+        # by Python's logging library), then use 'INFO'.
+        if not isinstance(log_level, int):
+            log_level = logging.INFO
+        _event_levels[level] = log_level
+    return _event_levels[level]
+
+
+def _event_message(event):
+    instance_prompt = event.get('node_instance_id') or ""
+    if instance_prompt:
+        if event.get('operation'):
+            instance_prompt = "{0}.{1}".format(
+                instance_prompt, event.get('operation').split('.')[-1])
+        instance_prompt = "[{0}] ".format(instance_prompt)
+
+    return text_type("{0} {1}{2}").format(
+        event.get('reported_timestamp', ""),
+        instance_prompt,
+        event.get('message', ""))
+
+
+def _relay_events(events):
+    # events with same level in a row are saved as one log message
+    for level, level_events in itertools.groupby(
+            events, key=lambda event: _event_level(
+                event.get('level', logging.INFO))):
+        ctx.logger.log(level, "\n".join(
+            _event_message(event) for event in level_events))
+
+
+def _get_logs_cursor(execution_id):
+    key = (ctx.instance.id, execution_id)
+    with _logs_cursors_lock:
+        if key in _logs_cursors:
+            return _logs_cursors[key]
+    # restore cursor after restart of operation
+    cursor = (ctx.instance.runtime_properties.get(LOGS_CURSOR) or {}).get(
+        execution_id)
+    if cursor:
+        since = cursor.get('since')
+        skip = int(cursor.get('skip', 0))
+    else:
+        since = None
+        skip = int((ctx.instance.runtime_properties.get(COUNT_EVENTS) or {})
+                   .get(execution_id, 0))
+    cursor = {
+        'execution_id': execution_id,
+        'since': since,
+        'skip': skip,
+        # position restored from runtime properties or last saved
+        'saved': (since, skip),
+        'saved_at': time.time(),
+        # execution is in end state and all events are relayed
+        'finished': False,
+    }
+    with _logs_cursors_lock:
+        return _logs_cursors.setdefault(key, cursor)
+
+
+def _move_logs_cursor(cursor, events):
+    # cursor is timestamp of last event and count of events with such
+    # timestamp, so next request does not depend on count of all events
+    for event in events:
+        timestamp = event.get('timestamp')
+        if timestamp and timestamp != cursor['since']:
+            cursor['since'] = timestamp
+            cursor['skip'] = 1
+        else:
+            cursor['skip'] += 1
+
+
+def _save_logs_cursor(cursor, force=False):
+    now = time.time()
+    if not force and now - cursor['saved_at'] < LOGS_CHECKPOINT_INTERVAL:
+        return
+    cursor['saved_at'] = now
+    position = (cursor['since'], cursor['skip'])
+    if position == cursor['saved']:
+        # nothing new from last save
+        return
+    # executions of child deployments are followed by parallel threads,
+    # each thread saves only own cursor and only one thread updates
+    # instance at the same time
+    with _logs_cursors_save_lock:
+        cursors = dict(
+            ctx.instance.runtime_properties.get(LOGS_CURSOR) or {})
+        cursors[cursor['execution_id']] = {
+            'since': cursor['since'],
+            'skip': cursor['skip'],
+        }
+        # new dict, so change is tracked by runtime properties
+        ctx.instance.runtime_properties[LOGS_CURSOR] = cursors
+        cursor['saved'] = position
+        try:
+            ctx.instance.update()
+        except CloudifyClientError as ex:
+            # will be saved on the end of operation
             ctx.logger.debug(
-                'Message {0} for Event {1} for execution_id {1}'.format(
-                    message, event))
-
-            level = event.get('level', logging.INFO)
-
-            # If the event dict had a 'level' key, then the value is
-            # a string. In that case, convert it to uppercase and get
-            # the matching Python logging constant.
-            if isinstance(level, text_type):
-                level = logging.getLevelName(level.upper())
+                'Logs cursor checkpoint failed {0}.'.format(text_type(ex)))
+
+
+def _remove_logs_cursor(execution_id):
+    with _logs_cursors_save_lock:
+        cursors = ctx.instance.runtime_properties.get(LOGS_CURSOR) or {}
+        if execution_id not in cursors:
+            return
+        cursors = dict(cursors)
+        del cursors[execution_id]
+        # saved on the end of operation
+        if cursors:
+            ctx.instance.runtime_properties[LOGS_CURSOR] = cursors
+        else:
+            del ctx.instance.runtime_properties[LOGS_CURSOR]
+
+
+def dep_logs_redirect_finish(execution_id):
+    key = (ctx.instance.id, execution_id)
+    with _logs_cursors_lock:
+        cursor = _logs_cursors.pop(key, None)
+    if not cursor:
+        return
+    if cursor['finished']:
+        # cursor is not required anymore, remove checkpoint if any
+        _remove_logs_cursor(execution_id)
+    else:
+        # wait is stopped before end of execution, keep cursor for
+        # next run of operation
+        _save_logs_cursor(cursor, force=True)
 
-            # In the (very) odd case that the level is still not an int
-            # (can happen if the original level value wasn't recognized
-            # by Python's logging library), then use 'INFO'.
-            if not isinstance(level, int):
-                level = logging.INFO
 
-            ctx.logger.log(level, message)
+def dep_logs_redirect(_client, execution_id, page_size=LOGS_PAGE_SIZE,
+                      finished=False):
+    cursor = _get_logs_cursor(execution_id)
 
-        last_event += len(events)
-        # returned infinite count
-        if full_count < 0:
-            full_count = last_event + 100
+    while True:
+        list_kwargs = {}
+        if cursor['since']:
+            list_kwargs['from_datetime'] = cursor['since']
+        events = _client.events.list(execution_id=execution_id,
+                                     include_logs=True,
+                                     sort='@timestamp',
+                                     _offset=cursor['skip'],
+                                     _size=page_size,
+                                     **list_kwargs)
         # returned nothing, let's do it next time
-        if len(events) == 0:
+        if not len(events):
             ctx.logger.log(20, "Waiting for log messages "
                                "(execution: {0})...".format(execution_id))
             break
 
-    ctx.instance.runtime_properties[COUNT_EVENTS][execution_id] = last_event
+        ctx.logger.debug('Received {0} events for execution_id {1}'
+                         .format(len(events), execution_id))
+        _relay_events(events)
+        _move_logs_cursor(cursor, events)
+
+        if len(events) < page_size:
+            break
 
+    if finished:
+        # no more events, checkpoint is not required
+        cursor['finished'] = True
+    else:
+        _save_logs_cursor(cursor)
 
-def dep_system_workflows_finished(_client, _check_all_in_deployment=False):
 
+def _active_executions(_client, **list_kwargs):
+    # only not finished executions are requested, so count of requests
+    # depends on active executions instead of full history
     _offset = int(getenv('_PAGINATION_OFFSET', 0))
     _size = int(getenv('_PAGINATION_SIZE', 1000))
 
@@ -166,52 +331,224 @@ def dep_system_workflows_finished(_client, _check_all_in_deployment=False):
         try:
             _execs = _client.executions.list(
                 include_system_workflows=True,
+                status=EXECUTION_ACTIVE_STATES,
+                _include=['id', 'status', 'deployment_id',
+                          'is_system_workflow'],
                 _offset=_offset,
-                _size=_size)
+                _size=_size,
+                **list_kwargs)
         except CloudifyClientError as ex:
             raise NonRecoverableError(
                 'Executions list failed {0}.'.format(text_type(ex)))
 
         for _exec in _execs:
+            # recheck in case of filter unsupported by manager
+            if _exec.get('status') not in EXECUTION_END_STATES:
+                yield _exec
 
-            if _exec.get('is_system_workflow'):
-                if _exec.get('status') not in ('terminated',
-                                               'completed',
-                                               'failed',
-                                               'cancelled'):
-                    return False
-
-            if _check_all_in_deployment:
-                if _check_all_in_deployment == _exec.get('deployment_id'):
-                    if _exec.get('status') not in ('terminated',
-                                                   'completed',
-                                                   'failed',
-                                                   'cancelled'):
-                        return False
-
-        if _execs.metadata.pagination.total <= \
-                _execs.metadata.pagination.offset:
+        if len(_execs) < _size:
             break
 
         _offset = _offset + _size
 
+
+def iter_node_instances(_client, _include=None, **list_kwargs):
+    """Node instances requested page by page."""
+    _offset = int(getenv('_PAGINATION_OFFSET', 0))
+    _size = int(getenv('_PAGINATION_SIZE', 1000))
+
+    while True:
+
+        try:
+            _node_instances = _client.node_instances.list(
+                _include=_include,
+                _offset=_offset,
+                _size=_size,
+                **list_kwargs)
+        except CloudifyClientError as ex:
+            raise NonRecoverableError(
+                'Node instances list failed {0}.'.format(text_type(ex)))
+
+        for _node_instance in _node_instances:
+            yield _node_instance
+
+        if len(_node_instances) < _size:
+            break
+
+        _offset = _offset + _size
+
+
+def dep_system_workflows_finished(_client, _check_all_in_deployment=False):
+
+    if _check_all_in_deployment:
+        # any active execution of deployment blocks
+        for _exec in _active_executions(
+                _client, deployment_id=_check_all_in_deployment):
+            if _check_all_in_deployment == _exec.get('deployment_id'):
+                return False
+
+    for _exec in _active_executions(_client):
+        if _exec.get('is_system_workflow'):
+            return False
+
     return True
 
 
+def dep_deleted(_client, _dep_id):
+    """Check that deployment is removed, fail fast if delete execution of
+    deployment has failed.
+    """
+    try:
+        _client.deployments.get(_dep_id, _include=['id'])
+    except CloudifyClientError as ex:
+        if ex.status_code == 404:
+            return True
+        raise NonRecoverableError(
+            'Deployment get failed {0}.'.format(text_type(ex)))
+
+    try:
+        _execs = _client.executions.list(
+            deployment_id=_dep_id,
+            workflow_id=DEP_DELETE_WORKFLOW,
+            include_system_workflows=True,
+            sort='created_at',
+            is_descending=True,
+            _include=['id', 'status', 'error'],
+            _size=1)
+    except CloudifyClientError as ex:
+        raise NonRecoverableError(
+            'Executions list failed {0}.'.format(text_type(ex)))
+
+    for _exec in _execs:
+        if _exec.get('status') in ['failed', 'cancelled']:
+            raise NonRecoverableError(
+                'Delete of deployment {0} {1}: {2}'.format(
+                    _dep_id, _exec.get('status'), _exec.get('error')))
+    return False
+
+
+class ExecutionStatusPoller(object):
+    """Shared cache of execution statuses for all operations in process.
+
+    Statuses of all watched executions of the same manager and tenant are
+    requested by one `executions.list` call, results are reused by other
+    operations until `tick` seconds pass.
+    """
+
+    def __init__(self, tick=POLLING_FIRST_INTERVAL,
+                 chunk_size=EXECUTIONS_IDS_CHUNK_SIZE):
+        self.tick = tick
+        # ids are part of query string, so count of ids in one request is
+        # limited
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        # client key -> lock for single request at the same time
+        self._refresh_locks = {}
+        # client key -> watched execution ids
+        self._watched = {}
+        # (client key, execution id) -> (received time, execution)
+        self._executions = {}
+
+    @staticmethod
+    def _client_key(_client):
+        # clients are created by each operation, so use manager, tenant
+        # and credentials, statuses visible for one user are not shared
+        # with other users
+        api = getattr(_client, '_client', None)
+        host = getattr(api, 'host', None)
+        if not host:
+            return id(_client)
+        headers = getattr(api, 'headers', None) or {}
+        # keep only hash of credentials in key
+        credentials = hashlib.sha256(repr(
+            [headers.get(name) for name in _AUTH_HEADERS]
+        ).encode('utf-8')).hexdigest()
+        return (host, getattr(api, 'port', None), headers.get('Tenant'),
+                credentials)
+
+    def _get_cached(self, key, execution_id):
+        cached = self._executions.get((key, execution_id))
+        if cached and time.time() - cached[0] < self.tick:
+            return cached[1]
+        return None
+
+    def watch(self, _client, execution_id):
+        key = self._client_key(_client)
+        with self._lock:
+            self._watched.setdefault(key, set()).add(execution_id)
+
+    def unwatch(self, _client, execution_id):
+        key = self._client_key(_client)
+        with self._lock:
+            watched = self._watched.get(key, set())
+            watched.discard(execution_id)
+            if not watched:
+                self._watched.pop(key, None)
+                self._refresh_locks.pop(key, None)
+            self._executions.pop((key, execution_id), None)
+
+    def get(self, _client, execution_id, _include):
+        key = self._client_key(_client)
+        with self._lock:
+            _exec = self._get_cached(key, execution_id)
+            if _exec:
+                return _exec
+            refresh_lock = self._refresh_locks.setdefault(
+                key, threading.Lock())
+
+        with refresh_lock:
+            with self._lock:
+                # other operation could update statuses while we waited
+                _exec = self._get_cached(key, execution_id)
+                if _exec:
+                    return _exec
+                execution_ids = list(
+                    self._watched.get(key, set()) | set([execution_id]))
+
+            for start in range(0, len(execution_ids), self.chunk_size):
+                chunk = execution_ids[start:start + self.chunk_size]
+                _execs = _client.executions.list(id=chunk,
+                                                 _include=_include,
+                                                 _get_all_results=True)
+                received = time.time()
+                with self._lock:
+                    for _exec in _execs:
+                        if _exec.get('id') in chunk:
+                            self._executions[(key, _exec.get('id'))] = \
+                                (received, _exec)
+            with self._lock:
+                _exec = self._get_cached(key, execution_id)
+
+        if not _exec:
+            # not returned by list, get will raise correct error
+            _exec = _client.executions.get(execution_id=execution_id,
+                                           _include=_include)
+        return _exec
+
+
+_execution_status_poller = ExecutionStatusPoller()
+
+
 def dep_workflow_in_state_pollster(_client,
                                    _dep_id,
                                    _state,
                                    _workflow_id=None,
                                    _log_redirect=False,
-                                   _execution_id=None):
+                                   _execution_id=None,
+                                   _log_page_size=LOGS_PAGE_SIZE):
 
     exec_get_fields = \
         ['status', 'workflow_id', 'created_at', 'id']
 
     try:
-        _exec = \
-            _client.executions.get(execution_id=_execution_id,
-                                   _include=exec_get_fields)
+        if _execution_id:
+            _exec = _execution_status_poller.get(_client,
+                                                 _execution_id,
+                                                 exec_get_fields)
+        else:
+            _exec = \
+                _client.executions.get(execution_id=_execution_id,
+                                       _include=exec_get_fields)
 
         ctx.logger.debug(
             'The exec get response form {0} is {1}'.format(_dep_id, _exec))
@@ -223,7 +560,9 @@ def dep_workflow_in_state_pollster(_client,
     if _log_redirect and _exec.get('id'):
         ctx.logger.debug(
             '_exec info for _log_redirect is {0}'.format(_exec))
-        dep_logs_redirect(_client, _exec.get('id'))
+        dep_logs_redirect(
+            _client, _exec.get('id'), _log_page_size,
+            finished=_exec.get('status') in EXECUTION_END_STATES)
 
     if _exec.get('status') == _state:
         ctx.logger.debug(
@@ -245,7 +584,9 @@ def poll_workflow_after_execute(_timeout,
                                 _state,
                                 _workflow_id,
                                 _execution_id,
-                                _log_redirect=False):
+                                _log_redirect=False,
+                                _final_probe=False,
+                                _log_page_size=LOGS_PAGE_SIZE):
 
     pollster_args = {
         '_client': _client,
@@ -254,16 +595,26 @@ def poll_workflow_after_execute(_timeout,
         '_workflow_id': _workflow_id,
         '_log_redirect': _log_redirect,
         '_execution_id': _execution_id,
+        '_log_page_size': _log_page_size,
     }
 
     ctx.logger.debug('Polling: {0}'.format(pollster_args))
 
-    success = \
-        poll_with_timeout(
-            dep_workflow_in_state_pollster,
-            timeout=_timeout,
-            interval=_interval,
-            pollster_args=pollster_args)
+    if _execution_id:
+        _execution_status_poller.watch(_client, _execution_id)
+    try:
+        success = \
+            poll_with_timeout(
+                dep_workflow_in_state_pollster,
+                timeout=_timeout,
+                interval=_interval,
+                pollster_args=pollster_args,
+                final_probe=_final_probe)
+    finally:
+        if _execution_id:
+            _execution_status_poller.unwatch(_client, _execution_id)
+        if _log_redirect and _execution_id:
+            dep_logs_redirect_finish(_execution_id)
 
     if not success:
         raise NonRecoverableError(
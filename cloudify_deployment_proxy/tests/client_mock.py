@@ -15,6 +15,7 @@
 import datetime
 from mock import MagicMock
 
+from cloudify_rest_client.exceptions import CloudifyClientError
 from cloudify_rest_client.responses import ListResponse
 
 
@@ -68,6 +69,10 @@ class MockDeploymentsClient(BaseMockClient):
         del args
         return MagicMock(_return_value)
 
+    def get(self, *args, **_):
+        del args
+        raise CloudifyClientError('Deployment not found', status_code=404)
+
     def delete(self, *args, **_):
         return
 
@@ -110,6 +115,10 @@ class MockEventsClient(BaseMockClient):
     def get(self, *_, **__):
         return self.list_events, self.count
 
+    def list(self, _offset=0, _size=1000, **_):
+        return ListResponse(self.list_events[_offset:_offset + _size],
+                            metadata={})
+
 
 class MockCloudifyRestClient(object):
 
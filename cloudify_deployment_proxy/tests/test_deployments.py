@@ -86,8 +86,6 @@ class TestDeployment(DeploymentProxyTestBase):
         _ctx = self.get_mock_ctx(test_name)
         current_ctx.set(_ctx)
 
-        get_local_path = mock.Mock(return_value="some_path")
-
         with mock.patch('cloudify.manager.get_rest_client') as mock_client:
             plugin = mock.Mock()
             plugin.id = "CustomPlugin"
@@ -95,64 +93,81 @@ class TestDeployment(DeploymentProxyTestBase):
             cfy_mock_client = MockCloudifyRestClient()
             cfy_mock_client.plugins.upload = mock.Mock(return_value=plugin)
             mock_client.return_value = cfy_mock_client
+            zip_sources = mock.Mock(return_value="_zip")
             with mock.patch(
-                'cloudify_deployment_proxy.get_local_path',
-                get_local_path
+                'cloudify_deployment_proxy.zip_sources',
+                zip_sources
             ):
-                zip_files = mock.Mock(return_value="_zip")
-                with mock.patch(
-                    'cloudify_deployment_proxy.zip_files',
-                    zip_files
-                ):
-                    # empty plugins
-                    deployment = DeploymentProxyBase({'plugins': []})
+                # empty plugins
+                deployment = DeploymentProxyBase({'plugins': []})
+                deployment._upload_plugins()
+                zip_sources.assert_not_called()
+
+                # dist of plugins
+                deployment = DeploymentProxyBase({'plugins': {
+                    'base_plugin': {
+                        'wagon_path': '_wagon_path',
+                        'plugin_yaml_path': '_plugin_yaml_path'}}})
+                os_mock = mock.Mock()
+                with mock.patch('cloudify_deployment_proxy.os', os_mock):
                     deployment._upload_plugins()
-                    zip_files.assert_not_called()
-                    get_local_path.assert_not_called()
-
-                    # dist of plugins
-                    deployment = DeploymentProxyBase({'plugins': {
-                        'base_plugin': {
-                            'wagon_path': '_wagon_path',
-                            'plugin_yaml_path': '_plugin_yaml_path'}}})
-                    os_mock = mock.Mock()
-                    with mock.patch('cloudify_deployment_proxy.os', os_mock):
-                        deployment._upload_plugins()
-                    zip_files.assert_called_with(["some_path", "some_path"])
-                    get_local_path.assert_has_calls([
-                        mock.call('_wagon_path', create_temp=True),
-                        mock.call('_plugin_yaml_path', create_temp=True)])
-                    os_mock.remove.assert_has_calls([
-                        mock.call('some_path'),
-                        mock.call('some_path'),
-                        mock.call('_zip')])
-
-            get_local_path = mock.Mock(return_value="some_path")
-            # zip_files = mock.Mock(return_value="_zip")
-            with mock.patch(
-                'cloudify_deployment_proxy.get_local_path',
-                get_local_path
-            ):
-                zip_files = mock.Mock(return_value="_zip")
-                with mock.patch(
-                    'cloudify_deployment_proxy.zip_files',
-                    zip_files
-                ):
-                    # list of plugins
-                    deployment = DeploymentProxyBase({'plugins': [{
-                            'wagon_path': '_wagon_path',
-                            'plugin_yaml_path': '_plugin_yaml_path'}]})
-                    os_mock = mock.Mock()
-                    with mock.patch('cloudify_deployment_proxy.os', os_mock):
-                        deployment._upload_plugins()
-                    zip_files.assert_called_with(["some_path", "some_path"])
-                    get_local_path.assert_has_calls([
-                        mock.call('_wagon_path', create_temp=True),
-                        mock.call('_plugin_yaml_path', create_temp=True)])
-                    os_mock.remove.assert_has_calls([
-                        mock.call('some_path'),
-                        mock.call('some_path'),
-                        mock.call('_zip')])
+                zip_sources.assert_called_with(
+                    ['_wagon_path', '_plugin_yaml_path'])
+                cfy_mock_client.plugins.upload.assert_called_with(
+                    plugin_path='_zip')
+                os_mock.remove.assert_called_once_with('_zip')
+
+                # list of plugins
+                deployment = DeploymentProxyBase({'plugins': [{
+                        'wagon_path': '_wagon_path',
+                        'plugin_yaml_path': '_plugin_yaml_path'}]})
+                os_mock = mock.Mock()
+                with mock.patch('cloudify_deployment_proxy.os', os_mock):
+                    deployment._upload_plugins()
+                zip_sources.assert_called_with(
+                    ['_wagon_path', '_plugin_yaml_path'])
+                os_mock.remove.assert_called_once_with('_zip')
+                self.assertEqual(
+                    _ctx.instance.runtime_properties['plugins'],
+                    ['CustomPlugin', 'CustomPlugin'])
+
+            # plugins are uploaded in parallel, failed upload does not
+            # stop other uploads and all archives are removed
+            _ctx.instance.runtime_properties['plugins'] = []
+            plugins = [{'wagon_path': '_wagon_{0}'.format(index),
+                        'plugin_yaml_path': '_yaml_{0}'.format(index)}
+                       for index in range(10)]
+
+            def _zip_sources(sources):
+                if sources[0] == '_wagon_3':
+                    raise NonRecoverableError('Failed to download _wagon_3')
+                return sources[0] + '.zip'
+
+            def _upload(plugin_path):
+                if plugin_path == '_wagon_5.zip':
+                    raise CloudifyClientError('Upload failed')
+                uploaded = mock.Mock()
+                uploaded.id = plugin_path[:-len('.zip')]
+                return uploaded
+
+            cfy_mock_client.plugins.upload = mock.Mock(side_effect=_upload)
+            deployment = DeploymentProxyBase({'plugins': plugins})
+            os_mock = mock.Mock()
+            with mock.patch('cloudify_deployment_proxy.zip_sources',
+                            _zip_sources):
+                with mock.patch('cloudify_deployment_proxy.os', os_mock):
+                    error = self.assertRaises(NonRecoverableError,
+                                              deployment._upload_plugins)
+            self.assertIn('Failed to download _wagon_3', text_type(error))
+            self.assertEqual(
+                _ctx.instance.runtime_properties['plugins'],
+                ['_wagon_{0}'.format(index) for index in range(10)
+                 if index not in (3, 5)])
+            self.assertEqual(
+                sorted(remove_call[0][0]
+                       for remove_call in os_mock.remove.call_args_list),
+                sorted('_wagon_{0}.zip'.format(index) for index in range(10)
+                       if index != 3))
 
             # raise error if wrong plugins list
             deployment = DeploymentProxyBase({'plugins': True})
@@ -170,6 +185,253 @@ class TestDeployment(DeploymentProxyTestBase):
             self.assertIn("You should provide both values wagon_path: '' "
                           "and plugin_yaml_path: ''", text_type(error))
 
+    def test_set_secrets(self):
+        _ctx = self.get_mock_ctx('test_set_secrets')
+        current_ctx.set(_ctx)
+        secrets = dict(('key{0}'.format(index), 'value{0}'.format(index))
+                       for index in range(5))
+
+        with mock.patch('cloudify.manager.get_rest_client') as mock_client:
+            cfy_mock_client = MockCloudifyRestClient()
+            mock_client.return_value = cfy_mock_client
+            deployment = DeploymentProxyBase({'secrets': secrets})
+
+            # secrets are imported with one request
+            cfy_mock_client.secrets.import_secrets = mock.Mock(
+                return_value={'overridden_secrets': [],
+                              'colliding_secrets': {},
+                              'secrets_errors': {}})
+            cfy_mock_client.secrets.create = mock.Mock()
+            deployment._set_secrets()
+            secrets_list = cfy_mock_client.secrets.import_secrets.call_args[
+                1]['secrets_list']
+            self.assertEqual(
+                dict((secret['key'], secret['value'])
+                     for secret in secrets_list), secrets)
+            self.assertEqual(
+                set(secret['visibility'] for secret in secrets_list),
+                set(['tenant']))
+            cfy_mock_client.secrets.create.assert_not_called()
+
+            # existing secrets are created one by one, so create raises
+            # same error as without import
+            cfy_mock_client.secrets.import_secrets.return_value = {
+                'overridden_secrets': [],
+                'colliding_secrets': {_ctx.tenant_name: ['key1']},
+                'secrets_errors': {}}
+            cfy_mock_client.secrets.create = mock.Mock(
+                side_effect=CloudifyClientError('Already exists',
+                                                status_code=409))
+            error = self.assertRaises(NonRecoverableError,
+                                      deployment._set_secrets)
+            self.assertIn("Failed to create secrets: ['key1']",
+                          text_type(error))
+            cfy_mock_client.secrets.create.assert_called_once_with(
+                key='key1', value='value1')
+
+            # nothing is imported with errors in secrets list
+            cfy_mock_client.secrets.import_secrets.return_value = {
+                'overridden_secrets': [],
+                'colliding_secrets': {},
+                'secrets_errors': {'3': {'value': 'is empty'}}}
+            cfy_mock_client.secrets.create = mock.Mock()
+            deployment._set_secrets()
+            self.assertEqual(
+                sorted(create_call[1]['key'] for create_call in
+                       cfy_mock_client.secrets.create.call_args_list),
+                sorted(secrets))
+
+            # secrets are created in parallel on old managers and for
+            # users without permissions for import
+            def _create(key, value):
+                if key == 'key2':
+                    raise CloudifyClientError('Already exists')
+
+            for status_code in [401, 403, 404, 405]:
+                cfy_mock_client.secrets.import_secrets.side_effect = \
+                    CloudifyClientError('Failed', status_code=status_code)
+                cfy_mock_client.secrets.create = mock.Mock(
+                    side_effect=_create)
+                error = self.assertRaises(NonRecoverableError,
+                                          deployment._set_secrets)
+                self.assertIn("Failed to create secrets: ['key2']",
+                              text_type(error))
+                self.assertEqual(
+                    sorted(create_call[1]['key'] for create_call in
+                           cfy_mock_client.secrets.create.call_args_list),
+                    sorted(secrets))
+
+            # other import errors are raised
+            cfy_mock_client.secrets.import_secrets.side_effect = \
+                CloudifyClientError('Internal error', status_code=500)
+            error = self.assertRaises(NonRecoverableError,
+                                      deployment._set_secrets)
+            self.assertIn(
+                'Client action import_secrets failed: 500: Internal error',
+                text_type(error))
+
+    def test_delete_secrets(self):
+        _ctx = self.get_mock_ctx('test_delete_secrets')
+        current_ctx.set(_ctx)
+        secrets = dict(('key{0}'.format(index), 'value{0}'.format(index))
+                       for index in range(5))
+
+        with mock.patch('cloudify.manager.get_rest_client') as mock_client:
+            cfy_mock_client = MockCloudifyRestClient()
+            mock_client.return_value = cfy_mock_client
+
+            def _delete(key):
+                if key == 'key4':
+                    raise CloudifyClientError('Not found')
+
+            cfy_mock_client.secrets.delete = mock.Mock(side_effect=_delete)
+            deployment = DeploymentProxyBase({'secrets': secrets})
+            error = self.assertRaises(NonRecoverableError,
+                                      deployment._delete_secrets)
+            self.assertIn("Failed to remove secrets: ['key4']",
+                          text_type(error))
+            self.assertEqual(
+                sorted(delete_call[1]['key'] for delete_call in
+                       cfy_mock_client.secrets.delete.call_args_list),
+                sorted(secrets))
+
+    def test_resource_exists_memo(self):
+        _ctx = self.get_mock_ctx('test_resource_exists_memo')
+        current_ctx.set(_ctx)
+
+        with mock.patch('cloudify.manager.get_rest_client') as mock_client:
+            cfy_mock_client = MockCloudifyRestClient()
+            cfy_mock_client.deployments.list = mock.Mock(return_value=[])
+            cfy_mock_client.blueprints.list = mock.Mock(
+                return_value=[{'id': 'bp'}])
+            mock_client.return_value = cfy_mock_client
+            deployment = DeploymentProxyBase({})
+
+            for _ in range(3):
+                self.assertTrue(deployment._resource_exists('blueprints',
+                                                            'bp'))
+                self.assertFalse(deployment._resource_exists('deployments',
+                                                             'dep'))
+            self.assertEqual(cfy_mock_client.blueprints.list.call_count, 1)
+            self.assertEqual(cfy_mock_client.deployments.list.call_count, 1)
+
+            # each operation checks resources again
+            deployment = DeploymentProxyBase({})
+            self.assertTrue(deployment._resource_exists('blueprints', 'bp'))
+            self.assertEqual(cfy_mock_client.blueprints.list.call_count, 2)
+
+    def test_fan_out_deployments(self):
+        _ctx = self.get_mock_ctx('test_fan_out_deployments')
+        current_ctx.set(_ctx)
+        resource_config = {
+            'blueprint': {'id': 'bp', 'blueprint_archive': 'URL'},
+            'deployment': {
+                'id': 'env',
+                'inputs': {'region': 'eu', 'size': 1},
+                'outputs': {'ip': 'address'},
+                'children': [{'inputs': {'size': index}}
+                             for index in range(4)] + [{'id': 'last'}],
+                'children_concurrency': 2,
+            }
+        }
+        child_ids = ['env-0', 'env-1', 'env-2', 'env-3', 'last']
+
+        with mock.patch('cloudify.manager.get_rest_client') as mock_client:
+            cfy_mock_client = MockCloudifyRestClient()
+            mock_client.return_value = cfy_mock_client
+            cfy_mock_client.deployments.list = mock.Mock(return_value=[])
+            cfy_mock_client.deployments.create = mock.Mock()
+
+            def _list_executions(**kwargs):
+                if 'id' in kwargs:
+                    # shared status poller
+                    return [{'id': execution_id, 'status': 'terminated'}
+                            for execution_id in kwargs['id']]
+                if 'deployment_id' in kwargs and 'status' not in kwargs:
+                    return [{
+                        'id': 'create-' + kwargs['deployment_id'],
+                        'workflow_id': 'create_deployment_environment'}]
+                return []
+
+            cfy_mock_client.executions.list = mock.Mock(
+                side_effect=_list_executions)
+
+            # one deployment for each child
+            deployment = DeploymentProxyBase(
+                {'resource_config': resource_config})
+            self.assertTrue(deployment.create_deployment())
+            created = dict(
+                (create_call[1]['deployment_id'], create_call[1])
+                for create_call in
+                cfy_mock_client.deployments.create.call_args_list)
+            self.assertEqual(sorted(created), child_ids)
+            self.assertEqual(created['env-2']['inputs'],
+                             {'region': 'eu', 'size': 2})
+            self.assertEqual(created['last']['inputs'],
+                             {'region': 'eu', 'size': 1})
+            self.assertEqual(created['last']['blueprint_id'], 'bp')
+            self.assertEqual(
+                _ctx.instance.runtime_properties['deployment'],
+                {'id': 'env', 'children': child_ids})
+
+            # all children exist, nothing is created
+            cfy_mock_client.deployments.create.reset_mock()
+            self.assertFalse(deployment.create_deployment())
+            cfy_mock_client.deployments.create.assert_not_called()
+
+            # workflow is started on each child, outputs are aggregated
+            cfy_mock_client.executions.start = mock.Mock(
+                side_effect=lambda deployment_id, **_: {
+                    'id': 'install-' + deployment_id})
+            cfy_mock_client.deployments.outputs.get = mock.Mock(
+                side_effect=lambda deployment_id: {
+                    'outputs': {'ip': deployment_id + '-ip'}})
+            deployment = DeploymentProxyBase(
+                {'resource_config': resource_config,
+                 'workflow_id': 'install'})
+            self.assertTrue(deployment.execute_workflow())
+            self.assertEqual(
+                sorted(start_call[1]['deployment_id'] for start_call in
+                       cfy_mock_client.executions.start.call_args_list),
+                child_ids)
+            self.assertEqual(
+                _ctx.instance.runtime_properties['deployment']['outputs'],
+                dict((child_id, {'address': child_id + '-ip'})
+                     for child_id in child_ids))
+
+            # failed child fails operation
+            def _failed_executions(**kwargs):
+                if 'id' in kwargs:
+                    return [{'id': execution_id,
+                             'status': 'failed' if 'env-1' in execution_id
+                             else 'terminated'}
+                            for execution_id in kwargs['id']]
+                return []
+
+            cfy_mock_client.executions.list.side_effect = _failed_executions
+            deployment = DeploymentProxyBase(
+                {'resource_config': resource_config,
+                 'workflow_id': 'install'})
+            error = self.assertRaises(NonRecoverableError,
+                                      deployment.execute_workflow)
+            self.assertIn("Failed to execute deployments: ['env-1']",
+                          text_type(error))
+
+            # all children are removed
+            cfy_mock_client.executions.list.side_effect = None
+            cfy_mock_client.executions.list.return_value = []
+            cfy_mock_client.deployments.delete = mock.Mock()
+            cfy_mock_client.blueprints.delete = mock.Mock()
+            deployment = DeploymentProxyBase(
+                {'resource_config': resource_config})
+            self.assertTrue(deployment.delete_deployment())
+            self.assertEqual(
+                sorted(delete_call[1]['deployment_id'] for delete_call in
+                       cfy_mock_client.deployments.delete.call_args_list),
+                child_ids)
+            cfy_mock_client.blueprints.delete.assert_called_once_with(
+                blueprint_id='bp')
+
     def test_delete_deployment_success(self):
         # Tests that deployments delete succeeds
 
@@ -12,9 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import mock
 
 from cloudify.state import current_ctx
+from cloudify.manager import DirtyTrackingDict
 from cloudify.exceptions import NonRecoverableError
 from cloudify_rest_client.exceptions import CloudifyClientError
 
@@ -337,3 +339,111 @@ class TestExecute(DeploymentProxyTestBase):
                 'key2': 'value2'
             }
         )
+
+    def test_post_execute_deployment_proxy_no_outputs(self):
+        _ctx = self.get_mock_ctx('test_post_execute_deployment_proxy',
+                                 node_type=DEP_TYPE)
+        _ctx.node.properties['resource_config']['deployment']['outputs'] = {}
+        _ctx.node.properties['resource_config']['deployment']['all_outputs'] =\
+            False
+        _ctx.instance.runtime_properties['deployment'] = {}
+
+        cfy_mock_client = MockCloudifyRestClient()
+        cfy_mock_client.deployments.outputs.get = mock.MagicMock()
+
+        with mock.patch('cloudify.manager.get_rest_client') as mock_client:
+            mock_client.return_value = cfy_mock_client
+            current_ctx.set(_ctx)
+            self.addCleanup(current_ctx.clear)
+            d = DeploymentProxyBase({})
+            d.post_execute_deployment_proxy()
+            cfy_mock_client.deployments.outputs.get.assert_not_called()
+            self.assertEqual(
+                {}, _ctx.instance.runtime_properties['deployment']['outputs'])
+
+    def test_post_execute_deployment_proxy_unchanged_outputs(self):
+        _ctx = self.get_mock_ctx('test_post_execute_deployment_proxy',
+                                 node_type=DEP_TYPE)
+        _ctx.node.properties['resource_config']['deployment']['outputs'] = \
+            {'key1': 'key1'}
+        _ctx.instance._runtime_properties = DirtyTrackingDict(
+            {'deployment': {'id': 'dep'}})
+
+        cfy_mock_client = MockCloudifyRestClient()
+        cfy_mock_client.deployments.outputs.get = mock.MagicMock(
+            return_value={'outputs': {'key1': 'value1', 'key2': 'value2'}})
+
+        with mock.patch('cloudify.manager.get_rest_client') as mock_client:
+            mock_client.return_value = cfy_mock_client
+            current_ctx.set(_ctx)
+            self.addCleanup(current_ctx.clear)
+
+            # first outputs are stored
+            DeploymentProxyBase({}).post_execute_deployment_proxy()
+            self.assertTrue(_ctx.instance.runtime_properties.dirty)
+            self.assertEqual(
+                {'key1': 'value1'},
+                _ctx.instance.runtime_properties['deployment']['outputs'])
+
+            # same outputs, runtime properties are not changed
+            _ctx.instance.runtime_properties.dirty = False
+            DeploymentProxyBase({}).post_execute_deployment_proxy()
+            self.assertFalse(_ctx.instance.runtime_properties.dirty)
+
+            # changes in not mapped outputs are ignored
+            cfy_mock_client.deployments.outputs.get.return_value = {
+                'outputs': {'key1': 'value1', 'key2': 'changed'}}
+            DeploymentProxyBase({}).post_execute_deployment_proxy()
+            self.assertFalse(_ctx.instance.runtime_properties.dirty)
+
+            # changed output is stored
+            cfy_mock_client.deployments.outputs.get.return_value = {
+                'outputs': {'key1': 'changed'}}
+            DeploymentProxyBase({}).post_execute_deployment_proxy()
+            self.assertTrue(_ctx.instance.runtime_properties.dirty)
+            self.assertEqual(
+                {'id': 'dep', 'outputs': {'key1': 'changed'}},
+                dict((key, value) for key, value in
+                     _ctx.instance.runtime_properties['deployment'].items()
+                     if key != 'outputs_hash'))
+
+    def test_post_execute_node_instance_proxy_paths(self):
+        _ctx = self.get_mock_ctx('test_post_execute_node_instance_proxy',
+                                 node_type=NIP_TYPE)
+        _ctx.node.properties['resource_config']['node_instance'] = {
+            'node': {'id': 'vm'},
+            'runtime_properties': ['ip', 'network.name']}
+        _ctx.instance.runtime_properties['deployment'] = {}
+
+        node_instances = [{
+            'id': 'vm_{0}'.format(index),
+            'runtime_properties': {
+                'ip': '10.0.0.{0}'.format(index),
+                'network': {'name': 'net', 'id': index},
+                'huge': 'x' * 1000}} for index in range(5)]
+
+        def _list(_offset, _size, **_):
+            return node_instances[_offset:_offset + _size]
+
+        cfy_mock_client = MockCloudifyRestClient()
+        cfy_mock_client.node_instances.list = mock.Mock(side_effect=_list)
+
+        with mock.patch('cloudify.manager.get_rest_client') as mock_client, \
+                mock.patch.dict(os.environ):
+            mock_client.return_value = cfy_mock_client
+            current_ctx.set(_ctx)
+            self.addCleanup(current_ctx.clear)
+            d = DeploymentProxyBase({'pagination_size': 2})
+            self.assertTrue(d.post_execute_node_instance_proxy())
+
+        self.assertEqual(
+            _ctx.instance.runtime_properties['NodeInstanceProxy'],
+            dict(('vm_{0}'.format(index),
+                  {'ip': '10.0.0.{0}'.format(index),
+                   'network': {'name': 'net'}}) for index in range(5)))
+        # requested by pages with only required fields
+        self.assertEqual(cfy_mock_client.node_instances.list.call_count, 3)
+        cfy_mock_client.node_instances.list.assert_called_with(
+            _include=['id', 'runtime_properties'], _offset=4, _size=2,
+            deployment_id='test_post_execute_node_instance_proxy',
+            node_id='vm')
@@ -13,7 +13,9 @@
 # limitations under the License.
 
 import json
+import time
 import mock
+import threading
 
 from cloudify.state import current_ctx
 from cloudify.exceptions import NonRecoverableError
@@ -21,6 +23,7 @@ from cloudify_rest_client.exceptions import CloudifyClientError
 
 from .base import DeploymentProxyTestBase
 from .client_mock import MockCloudifyRestClient
+from .. import polling
 from ..polling import (
     any_bp_by_id,
     any_dep_by_id,
@@ -30,7 +33,9 @@ from ..polling import (
     dep_logs_redirect,
     dep_workflow_in_state_pollster,
     dep_system_workflows_finished,
-    poll_workflow_after_execute)
+    dep_deleted,
+    poll_workflow_after_execute,
+    ExecutionStatusPoller)
 
 from cloudify_common_sdk._compat import text_type
 
@@ -49,6 +54,7 @@ class TestPolling(DeploymentProxyTestBase):
         if self.sleep_mock:
             self.sleep_mock.stop()
             self.sleep_mock = None
+        polling._logs_cursors.clear()
         super(TestPolling, self).tearDown()
 
     # test that any bp by id returns false if there are no matching
@@ -170,6 +176,27 @@ class TestPolling(DeploymentProxyTestBase):
                     'deployments')
             self.assertIn('failed', text_type(output))
 
+    # test that resource_by_id filters resources on manager side
+    def test_resource_by_id_filter(self):
+        test_name = 'test_resource_by_id_filter'
+        _ctx = self.get_mock_ctx(test_name)
+        current_ctx.set(_ctx)
+
+        cfy_mock_client = MockCloudifyRestClient()
+        cfy_mock_client.blueprints.list = mock.Mock(
+            return_value=[{'id': test_name}])
+        self.assertEqual(
+            resource_by_id(cfy_mock_client, test_name, 'blueprints'), [True])
+        cfy_mock_client.blueprints.list.assert_called_once_with(
+            id=test_name, _include=['id'])
+
+        # manager without id filter returns all resources
+        cfy_mock_client.blueprints.list.return_value = [
+            {'id': 'other'}, {'id': test_name}]
+        self.assertTrue(any_bp_by_id(cfy_mock_client, test_name))
+        cfy_mock_client.blueprints.list.return_value = [{'id': 'other'}]
+        self.assertFalse(any_bp_by_id(cfy_mock_client, test_name))
+
     # Test that failed polling raises an error
     def test_poll_with_timeout_timeout(self):
         test_name = 'test_poll_with_timeout'
@@ -209,6 +236,72 @@ class TestPolling(DeploymentProxyTestBase):
                 True)
         self.assertTrue(output)
 
+    def _fake_clock(self):
+        clock = {'now': 0, 'sleeps': []}
+
+        def _sleep(seconds):
+            clock['sleeps'].append(seconds)
+            clock['now'] += seconds
+
+        fake_time = mock.MagicMock()
+        fake_time.time = mock.MagicMock(side_effect=lambda: clock['now'])
+        fake_time.sleep = _sleep
+        return clock, fake_time
+
+    # Test that delay between probes grows up to interval
+    def test_poll_with_timeout_backoff(self):
+        test_name = 'test_poll_with_timeout_backoff'
+        _ctx = self.get_mock_ctx(test_name)
+        current_ctx.set(_ctx)
+
+        clock, fake_time = self._fake_clock()
+        mock_pollster = mock.MagicMock(side_effect=[False] * 6 + [True])
+        with mock.patch('cloudify_deployment_proxy.polling.time', fake_time):
+            with mock.patch(
+                'cloudify_deployment_proxy.polling.random.uniform',
+                mock.MagicMock(return_value=1)
+            ):
+                output = poll_with_timeout(mock_pollster, -1, 10)
+        self.assertTrue(output)
+        self.assertEqual(clock['sleeps'], [1, 2, 4, 8, 10, 10])
+
+        # jitter only decrease delay
+        clock, fake_time = self._fake_clock()
+        mock_pollster = mock.MagicMock(side_effect=[False] * 20 + [True])
+        with mock.patch('cloudify_deployment_proxy.polling.time', fake_time):
+            output = poll_with_timeout(mock_pollster, -1, 10)
+        self.assertTrue(output)
+        self.assertEqual(len(clock['sleeps']), 20)
+        self.assertTrue(all(8 <= sleep_time <= 10
+                            for sleep_time in clock['sleeps'][4:]))
+
+    # Test that last sleep is limited by deadline and final probe is done
+    def test_poll_with_timeout_final_probe(self):
+        test_name = 'test_poll_with_timeout_final_probe'
+        _ctx = self.get_mock_ctx(test_name)
+        current_ctx.set(_ctx)
+
+        for final_probe, expected, sleeps in [(False, False, [2]),
+                                              (True, True, [2, 3])]:
+            clock, fake_time = self._fake_clock()
+
+            def mock_pollster():
+                # ready only on deadline
+                return clock['now'] >= 5
+
+            with mock.patch('cloudify_deployment_proxy.polling.time',
+                            fake_time):
+                with mock.patch(
+                    'cloudify_deployment_proxy.polling.random.uniform',
+                    mock.MagicMock(return_value=1)
+                ):
+                    output = poll_with_timeout(mock_pollster, 5, 10,
+                                               first_interval=2,
+                                               final_probe=final_probe)
+            self.assertEqual(output, expected)
+            # no sleep after deadline
+            self.assertEqual(clock['sleeps'], sleeps)
+
     # Test that no matching executions returns False
     def test_dep_system_workflows_finished_no_executions(self):
         test_name = 'test_dep_system_workflows_finished_no_executions'
@@ -257,6 +350,59 @@ class TestPolling(DeploymentProxyTestBase):
                     cfy_mock_client)
             self.assertTrue(output)
 
+    # Test that only active executions are requested
+    def test_dep_system_workflows_finished_active_only(self):
+        test_name = 'test_dep_system_workflows_finished_active_only'
+        _ctx = self.get_mock_ctx(test_name)
+        current_ctx.set(_ctx)
+
+        cfy_mock_client = MockCloudifyRestClient()
+        active_states = ['pending', 'started', 'cancelling',
+                         'force_cancelling', 'kill_cancelling', 'queued',
+                         'scheduled']
+        include = ['id', 'status', 'deployment_id', 'is_system_workflow']
+
+        # deployment has active execution, stop on first request
+        cfy_mock_client.executions.list = mock.MagicMock(return_value=[{
+            'id': 'a', 'deployment_id': test_name, 'status': 'started',
+            'is_system_workflow': False}])
+        self.assertFalse(dep_system_workflows_finished(
+            cfy_mock_client, _check_all_in_deployment=test_name))
+        cfy_mock_client.executions.list.assert_called_once_with(
+            include_system_workflows=True, status=active_states,
+            _include=include, _offset=0, _size=1000,
+            deployment_id=test_name)
+
+        # active system workflow on second page
+        with mock.patch.dict('os.environ', {'_PAGINATION_SIZE': '2'}):
+            cfy_mock_client.executions.list = mock.MagicMock(side_effect=[
+                [],
+                [{'id': 'a', 'status': 'started',
+                  'is_system_workflow': False},
+                 {'id': 'b', 'status': 'terminated',
+                  'is_system_workflow': True}],
+                [{'id': 'c', 'status': 'started',
+                  'is_system_workflow': True},
+                 {'id': 'd', 'status': 'started',
+                  'is_system_workflow': True}],
+            ])
+            self.assertFalse(dep_system_workflows_finished(
+                cfy_mock_client, _check_all_in_deployment=test_name))
+        cfy_mock_client.executions.list.assert_has_calls([
+            mock.call(include_system_workflows=True, status=active_states,
+                      _include=include, _offset=0, _size=2,
+                      deployment_id=test_name),
+            mock.call(include_system_workflows=True, status=active_states,
+                      _include=include, _offset=0, _size=2),
+            mock.call(include_system_workflows=True, status=active_states,
+                      _include=include, _offset=2, _size=2)])
+        self.assertEqual(cfy_mock_client.executions.list.call_count, 3)
+
+        # nothing active
+        cfy_mock_client.executions.list = mock.MagicMock(return_value=[])
+        self.assertTrue(dep_system_workflows_finished(cfy_mock_client))
+        self.assertEqual(cfy_mock_client.executions.list.call_count, 1)
+
     # test that raises Exception is handled.
     def test_dep_system_workflows_finished_raises(self):
         test_name = 'test_dep_system_workflows_finished_raises'
@@ -281,6 +427,45 @@ class TestPolling(DeploymentProxyTestBase):
                     cfy_mock_client)
             self.assertIn('failed', text_type(output))
 
+    def test_dep_deleted(self):
+        test_name = 'test_dep_deleted'
+        _ctx = self.get_mock_ctx(test_name)
+        current_ctx.set(_ctx)
+
+        cfy_mock_client = MockCloudifyRestClient()
+        # removed deployment
+        self.assertTrue(dep_deleted(cfy_mock_client, test_name))
+
+        # deployment is still being removed
+        cfy_mock_client.deployments.get = mock.Mock(
+            return_value={'id': test_name})
+        cfy_mock_client.executions.list = mock.Mock(
+            return_value=[{'id': 'delete', 'status': 'started'}])
+        self.assertFalse(dep_deleted(cfy_mock_client, test_name))
+        cfy_mock_client.deployments.get.assert_called_with(
+            test_name, _include=['id'])
+        self.assertEqual(
+            cfy_mock_client.executions.list.call_args[1]['workflow_id'],
+            'delete_deployment_environment')
+        self.assertEqual(
+            cfy_mock_client.executions.list.call_args[1]['deployment_id'],
+            test_name)
+
+        # failed delete is not waited
+        cfy_mock_client.executions.list.return_value = [
+            {'id': 'delete', 'status': 'failed', 'error': 'Live nodes'}]
+        output = self.assertRaises(NonRecoverableError,
+                                   dep_deleted, cfy_mock_client, test_name)
+        self.assertIn('Delete of deployment test_dep_deleted failed: '
+                      'Live nodes', text_type(output))
+
+        # other errors
+        cfy_mock_client.deployments.get.side_effect = \
+            CloudifyClientError('Mistake', status_code=500)
+        output = self.assertRaises(NonRecoverableError,
+                                   dep_deleted, cfy_mock_client, test_name)
+        self.assertIn('Deployment get failed', text_type(output))
+
     # Test that no matching executions returns False
     def test_dep_workflow_in_state_pollster_no_executions(self):
         test_name = 'test_dep_workflow_in_state_pollster_no_executions'
@@ -349,6 +534,7 @@ class TestPolling(DeploymentProxyTestBase):
 
             cfy_mock_client.executions.get = mock_return
             mock_client.return_value = cfy_mock_client
+            _ctx.instance.update = mock.MagicMock(return_value=None)
             output = \
                 dep_workflow_in_state_pollster(
                     cfy_mock_client,
@@ -357,6 +543,11 @@ class TestPolling(DeploymentProxyTestBase):
                     0,
                     True)
             self.assertTrue(output)
+            # execution is finished, cursor is not saved
+            polling.dep_logs_redirect_finish(test_name)
+            _ctx.instance.update.assert_not_called()
+            self.assertNotIn(polling.LOGS_CURSOR,
+                             _ctx.instance.runtime_properties)
 
     # Test that matching executions returns True
     def test_dep_workflow_in_state_pollster_matching_state(self):
@@ -412,6 +603,138 @@ class TestPolling(DeploymentProxyTestBase):
                     0)
             self.assertIn('failed', text_type(output))
 
+    def _gen_executions_client(self, tenant='default_tenant',
+                               token='token'):
+        client = mock.MagicMock()
+        client._client.host = 'manager'
+        client._client.port = 443
+        client._client.headers = {'Tenant': tenant,
+                                  'Authentication-Token': token}
+        client.executions.list = mock.MagicMock(side_effect=lambda **kwargs: [
+            {'id': execution_id, 'status': 'started'}
+            for execution_id in kwargs['id'] if execution_id != 'unknown'])
+        client.executions.get = mock.MagicMock(
+            side_effect=CloudifyClientError('Not found'))
+        return client
+
+    # Test that statuses of all watched executions are requested together
+    def test_execution_status_poller(self):
+        poller = ExecutionStatusPoller(tick=10)
+        include = ['status', 'id']
+        clients = [self._gen_executions_client() for _ in range(3)]
+        for execution_id, client in zip(['a', 'b', 'c'], clients):
+            poller.watch(client, execution_id)
+
+        # one request for all watched executions
+        self.assertEqual(poller.get(clients[0], 'a', include),
+                         {'id': 'a', 'status': 'started'})
+        self.assertEqual(poller.get(clients[1], 'b', include),
+                         {'id': 'b', 'status': 'started'})
+        self.assertEqual(poller.get(clients[2], 'c', include),
+                         {'id': 'c', 'status': 'started'})
+        clients[0].executions.list.assert_called_once_with(
+            id=mock.ANY, _include=include, _get_all_results=True)
+        self.assertEqual(
+            sorted(clients[0].executions.list.call_args[1]['id']),
+            ['a', 'b', 'c'])
+        clients[1].executions.list.assert_not_called()
+        clients[2].executions.list.assert_not_called()
+
+        # other tenant has own request
+        other_client = self._gen_executions_client('other_tenant')
+        poller.get(other_client, 'a', include)
+        other_client.executions.list.assert_called_once_with(
+            id=['a'], _include=include, _get_all_results=True)
+
+        # other user has own request
+        other_user_client = self._gen_executions_client(token='other')
+        poller.get(other_user_client, 'a', include)
+        other_user_client.executions.list.assert_called_once_with(
+            id=['a'], _include=include, _get_all_results=True)
+        self.assertNotEqual(poller._client_key(clients[0]),
+                            poller._client_key(other_user_client))
+        self.assertNotIn('token', repr(poller._client_key(clients[0])))
+
+        # status is requested again after tick
+        with mock.patch('cloudify_deployment_proxy.polling.time.time',
+                        mock.MagicMock(return_value=time.time() + 11)):
+            poller.get(clients[1], 'b', include)
+        self.assertEqual(clients[1].executions.list.call_count, 1)
+
+        # unknown execution is checked by get
+        self.assertRaises(CloudifyClientError,
+                          poller.get, clients[0], 'unknown', include)
+        clients[0].executions.get.assert_called_once_with(
+            execution_id='unknown', _include=include)
+
+        # finished executions are not requested anymore
+        for execution_id, client in zip(['a', 'b', 'c'], clients):
+            poller.unwatch(client, execution_id)
+        poller.unwatch(other_client, 'a')
+        poller.unwatch(other_user_client, 'a')
+        self.assertEqual(poller._watched, {})
+        self.assertEqual(poller._executions, {})
+
+    # Test that ids of watched executions are requested by chunks
+    def test_execution_status_poller_chunks(self):
+        poller = ExecutionStatusPoller(tick=10, chunk_size=2)
+        include = ['status', 'id']
+        client = self._gen_executions_client()
+        execution_ids = ['a', 'b', 'c', 'd', 'e']
+        for execution_id in execution_ids:
+            poller.watch(client, execution_id)
+
+        self.assertEqual(poller.get(client, 'c', include),
+                         {'id': 'c', 'status': 'started'})
+        self.assertEqual(client.executions.list.call_count, 3)
+        requested = [list_call[1]['id'] for list_call in
+                     client.executions.list.call_args_list]
+        self.assertEqual([len(chunk) for chunk in requested], [2, 2, 1])
+        self.assertEqual(sorted(sum(requested, [])), execution_ids)
+
+        # statuses from all chunks are cached
+        for execution_id in execution_ids:
+            self.assertEqual(poller.get(client, execution_id, include),
+                             {'id': execution_id, 'status': 'started'})
+        self.assertEqual(client.executions.list.call_count, 3)
+
+    # Test that parallel operations share one request
+    def test_execution_status_poller_threads(self):
+        poller = ExecutionStatusPoller(tick=10)
+        include = ['status', 'id']
+        clients = [self._gen_executions_client() for _ in range(50)]
+        list_calls = []
+
+        def _slow_list(**kwargs):
+            list_calls.append(kwargs)
+            time.sleep(0.05)
+            return [{'id': execution_id, 'status': 'terminated'}
+                    for execution_id in kwargs['id']]
+
+        for index, client in enumerate(clients):
+            client.executions.list = _slow_list
+            poller.watch(client, 'exec_{0}'.format(index))
+
+        results = {}
+
+        def _get_status(index):
+            results[index] = poller.get(
+                clients[index], 'exec_{0}'.format(index), include)
+
+        threads = [threading.Thread(target=_get_status, args=(index,))
+                   for index in range(len(clients))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(list_calls), 1)
+        self.assertEqual(len(list_calls[0]['id']), 50)
+        self.assertEqual(
+            results,
+            dict((index, {'id': 'exec_{0}'.format(index),
+                          'status': 'terminated'})
+                 for index in range(len(clients))))
+
     # test that success=False raises exception
     def test_poll_workflow_after_execute_failed(self):
         _ctx = self.get_mock_ctx('test_poll_workflow_after_execute_failed')
@@ -506,6 +829,148 @@ class TestPolling(DeploymentProxyTestBase):
             "2017-03-22T11:42:00.083Z [vm_ke9e2d.create] Task succeeded "
             "'cloudify_agent.installer.operations.create'")
 
+    def _gen_events(self, count, timestamps=1):
+        return [{
+            "node_instance_id": "vm_ke9e2d",
+            "timestamp": "2017-03-22T11:42:0{0}.000Z".format(
+                index * timestamps // count),
+            "reported_timestamp": "2017-03-22T11:42:00.083Z",
+            "message": "message {0}".format(index),
+            "level": "warning" if index % 4 == 3 else "info",
+        } for index in range(count)]
+
+    def test_dep_logs_redirect_cursor(self):
+        test_name = "dep_logs_redirect_cursor"
+        _ctx = self.get_mock_ctx(test_name)
+        _ctx.logger.log = mock.MagicMock(return_value=None)
+        _ctx.instance.update = mock.MagicMock(return_value=None)
+        current_ctx.set(_ctx)
+
+        cfy_mock_client = MockCloudifyRestClient()
+        events = self._gen_events(10, timestamps=2)
+        cfy_mock_client.events.list = mock.MagicMock(side_effect=[
+            events[:4], events[4:8], events[8:]])
+
+        dep_logs_redirect(cfy_mock_client, 'some_execution_id', 4)
+        # next request starts from last timestamp
+        cfy_mock_client.events.list.assert_has_calls([
+            mock.call(execution_id='some_execution_id', include_logs=True,
+                      sort='@timestamp', _offset=0, _size=4),
+            mock.call(execution_id='some_execution_id', include_logs=True,
+                      sort='@timestamp', _offset=4, _size=4,
+                      from_datetime='2017-03-22T11:42:00.000Z'),
+            mock.call(execution_id='some_execution_id', include_logs=True,
+                      sort='@timestamp', _offset=3, _size=4,
+                      from_datetime='2017-03-22T11:42:01.000Z')])
+        # events with same level are saved together
+        _ctx.logger.log.assert_has_calls([
+            mock.call(20, "2017-03-22T11:42:00.083Z [vm_ke9e2d] message 0\n"
+                          "2017-03-22T11:42:00.083Z [vm_ke9e2d] message 1\n"
+                          "2017-03-22T11:42:00.083Z [vm_ke9e2d] message 2"),
+            mock.call(30, "2017-03-22T11:42:00.083Z [vm_ke9e2d] message 3")])
+        self.assertEqual(_ctx.logger.log.call_count, 5)
+
+        # checkpoint is rate limited
+        _ctx.instance.update.assert_not_called()
+        self.assertNotIn(polling.LOGS_CURSOR, _ctx.instance.runtime_properties)
+
+        # continue from cursor on next tick
+        cfy_mock_client.events.list = mock.MagicMock(return_value=[])
+        dep_logs_redirect(cfy_mock_client, 'some_execution_id', 4)
+        cfy_mock_client.events.list.assert_called_once_with(
+            execution_id='some_execution_id', include_logs=True,
+            sort='@timestamp', _offset=5, _size=4,
+            from_datetime='2017-03-22T11:42:01.000Z')
+
+        # cursor is saved on finish
+        polling.dep_logs_redirect_finish('some_execution_id')
+        _ctx.instance.update.assert_called_once_with()
+        self.assertEqual(
+            _ctx.instance.runtime_properties[polling.LOGS_CURSOR], {
+                'some_execution_id': {
+                    'since': '2017-03-22T11:42:01.000Z',
+                    'skip': 5}})
+        self.assertEqual(polling._logs_cursors, {})
+
+        # cursor is restored from runtime properties
+        dep_logs_redirect(cfy_mock_client, 'some_execution_id', 4)
+        cfy_mock_client.events.list.assert_called_with(
+            execution_id='some_execution_id', include_logs=True,
+            sort='@timestamp', _offset=5, _size=4,
+            from_datetime='2017-03-22T11:42:01.000Z')
+
+        # counters from previous versions are used as offset
+        _ctx.instance.runtime_properties['received_events'] = {
+            'other_execution_id': 7}
+        dep_logs_redirect(cfy_mock_client, 'other_execution_id', 4)
+        cfy_mock_client.events.list.assert_called_with(
+            execution_id='other_execution_id', include_logs=True,
+            sort='@timestamp', _offset=7, _size=4)
+
+        # nothing is saved without new events
+        _ctx.instance.update.reset_mock()
+        polling.dep_logs_redirect_finish('other_execution_id')
+        _ctx.instance.update.assert_not_called()
+        self.assertEqual(
+            list(_ctx.instance.runtime_properties[polling.LOGS_CURSOR]),
+            ['some_execution_id'])
+
+        # cursor of finished execution is removed without instance update
+        dep_logs_redirect(cfy_mock_client, 'some_execution_id', 4,
+                          finished=True)
+        polling.dep_logs_redirect_finish('some_execution_id')
+        _ctx.instance.update.assert_not_called()
+        self.assertNotIn(polling.LOGS_CURSOR, _ctx.instance.runtime_properties)
+        self.assertEqual(polling._logs_cursors, {})
+
+    # Test that parallel threads save cursors of own executions
+    def test_dep_logs_redirect_finish_threads(self):
+        test_name = "dep_logs_redirect_finish_threads"
+        _ctx = self.get_mock_ctx(test_name)
+        _ctx.logger.log = mock.MagicMock(return_value=None)
+        active_updates = []
+        parallel_updates = []
+        saved = []
+
+        def _update():
+            active_updates.append(True)
+            parallel_updates.append(len(active_updates))
+            # time.sleep is mocked
+            threading.Event().wait(0.01)
+            saved.append(
+                dict(_ctx.instance.runtime_properties[polling.LOGS_CURSOR]))
+            active_updates.pop()
+
+        _ctx.instance.update = mock.MagicMock(side_effect=_update)
+        current_ctx.set(_ctx)
+
+        cfy_mock_client = MockCloudifyRestClient()
+        cfy_mock_client.events.list = mock.MagicMock(
+            return_value=self._gen_events(2))
+        execution_ids = ['execution_{0}'.format(index) for index in range(10)]
+
+        def _follow(execution_id):
+            current_ctx.set(_ctx)
+            dep_logs_redirect(cfy_mock_client, execution_id, 4)
+            polling.dep_logs_redirect_finish(execution_id)
+
+        threads = [threading.Thread(target=_follow, args=(execution_id,))
+                   for execution_id in execution_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(_ctx.instance.update.call_count, 10)
+        self.assertEqual(max(parallel_updates), 1)
+        self.assertEqual(len(saved[-1]), 10)
+        self.assertEqual(
+            _ctx.instance.runtime_properties[polling.LOGS_CURSOR],
+            dict((execution_id, {'since': '2017-03-22T11:42:00.000Z',
+                                 'skip': 2})
+                 for execution_id in execution_ids))
+        self.assertEqual(polling._logs_cursors, {})
+
     def test_dep_logs_empty_infinity(self):
         test_name = "dep_logs_redirect_predefined_level"
         _ctx = self.get_mock_ctx(test_name)
@@ -13,6 +13,11 @@
 # limitations under the License.
 
 import tempfile
+import unittest
+import zipfile
+import hashlib
+import shutil
+import mock
 import os
 
 from cloudify.state import current_ctx
@@ -22,6 +27,24 @@ import cloudify_deployment_proxy.utils as utils
 
 class TestUtils(DeploymentProxyTestBase):
 
+    def setUp(self):
+        super(TestUtils, self).setUp()
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        patcher = mock.patch.dict(
+            os.environ, {utils.AGENT_WORK_DIR_KEY: self.work_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _response(self, status_code=200, content=None, headers=None,
+                  url='https://example.com/plugins/plugin.wgn'):
+        response = mock.Mock()
+        response.status_code = status_code
+        response.url = url
+        response.headers = headers or {}
+        response.iter_content = mock.Mock(return_value=content or [])
+        return response
+
     def test_zip_files(self):
         _ctx = self.get_mock_ctx(__name__)
         current_ctx.set(_ctx)
@@ -32,6 +55,226 @@ class TestUtils(DeploymentProxyTestBase):
         os.remove(zip_file)
         os.remove(destination)
 
+    def test_zip_sources(self):
+        _ctx = self.get_mock_ctx(__name__)
+        current_ctx.set(_ctx)
+        fd, local_file = tempfile.mkstemp(suffix='.yaml')
+        os.write(fd, b'plugin yaml')
+        os.close(fd)
+        response = self._response(content=[b'wagon', b' data'])
+        with mock.patch('cloudify_deployment_proxy.utils.requests.get',
+                        mock.Mock(return_value=response)) as requests_get:
+            zip_path = utils.zip_sources([
+                'https://example.com/plugins/plugin.wgn', local_file])
+        requests_get.assert_called_with(
+            'https://example.com/plugins/plugin.wgn', stream=True,
+            headers={})
+        try:
+            with zipfile.ZipFile(zip_path) as zip_file:
+                self.assertEqual(zip_file.read('plugin.wgn'), b'wagon data')
+                self.assertEqual(
+                    zip_file.read(os.path.basename(local_file)),
+                    b'plugin yaml')
+        finally:
+            os.remove(zip_path)
+            os.remove(local_file)
+
+        # archive is removed on failure
+        created = []
+        mkstemp = tempfile.mkstemp
+
+        def _mkstemp(**kwargs):
+            created.append(mkstemp(**kwargs))
+            return created[-1]
+
+        with mock.patch('cloudify_deployment_proxy.utils.tempfile.mkstemp',
+                        _mkstemp):
+            self.assertRaises(utils.NonRecoverableError,
+                              utils.zip_sources, ['/no/such/file'])
+        self.assertEqual(len(created), 1)
+        self.assertFalse(os.path.exists(created[0][1]))
+
+    def test_cached_download(self):
+        _ctx = self.get_mock_ctx(__name__)
+        current_ctx.set(_ctx)
+        url = 'https://example.com/plugins/plugin.wgn'
+        requests_get = mock.Mock(return_value=self._response(
+            content=[b'wagon', b' data'],
+            headers={'ETag': '"v1"',
+                     'Last-Modified': 'Wed, 21 Oct 2026 07:28:00 GMT'}))
+        with mock.patch('cloudify_deployment_proxy.utils.requests.get',
+                        requests_get):
+            with utils.cached_download(url) as cached_path:
+                pass
+            requests_get.assert_called_with(url, stream=True, headers={})
+            with open(cached_path, 'rb') as cached_file:
+                self.assertEqual(cached_file.read(), b'wagon data')
+            self.assertEqual(os.path.basename(cached_path),
+                             hashlib.sha256(b'wagon data').hexdigest())
+
+            # not modified file is copied from cache
+            requests_get.return_value = self._response(status_code=304)
+            destination = utils.get_local_path(url, create_temp=True)
+            requests_get.assert_called_with(url, stream=True, headers={
+                'If-None-Match': '"v1"',
+                'If-Modified-Since': 'Wed, 21 Oct 2026 07:28:00 GMT'})
+            self.assertEqual(os.path.basename(destination), 'plugin.wgn')
+            with open(destination, 'rb') as destination_file:
+                self.assertEqual(destination_file.read(), b'wagon data')
+            # destination is a copy, changes never reach cache
+            self.assertFalse(os.path.samefile(destination, cached_path))
+            with open(destination, 'wb') as destination_file:
+                destination_file.write(b'changed')
+            with open(cached_path, 'rb') as cached_file:
+                self.assertEqual(cached_file.read(), b'wagon data')
+            os.remove(destination)
+            self.assertTrue(os.path.isfile(cached_path))
+
+            # changed file is downloaded again
+            requests_get.return_value = self._response(
+                content=[b'new wagon'], headers={'ETag': '"v2"'})
+            with utils.cached_download(url) as new_cached_path:
+                self.assertNotEqual(new_cached_path, cached_path)
+
+            # failed download is not cached
+            requests_get.return_value = self._response(status_code=404)
+            requests_get.return_value.raise_for_status.side_effect = \
+                utils.requests.exceptions.HTTPError('404 Not Found')
+            with self.assertRaises(utils.NonRecoverableError):
+                with utils.cached_download(url + '.missing'):
+                    pass
+            self.assertEqual(
+                len(os.listdir(os.path.dirname(cached_path))), 2)
+
+    def test_cached_download_private(self):
+        _ctx = self.get_mock_ctx(__name__)
+        current_ctx.set(_ctx)
+        url = 'https://example.com/plugins/plugin.wgn'
+        requests_get = mock.Mock(return_value=self._response(
+            content=[b'wagon data'], headers={'ETag': '"v1"'}))
+        with mock.patch('cloudify_deployment_proxy.utils.requests.get',
+                        requests_get):
+            with utils.cached_download(url) as cached_path:
+                pass
+            # cache is in agent work directory, only for current user
+            cache_dir = os.path.join(self.work_dir, 'cloudify_download_cache')
+            self.assertEqual(
+                os.path.dirname(os.path.dirname(cached_path)), cache_dir)
+            for path in [cache_dir, os.path.dirname(cached_path)]:
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+
+            # changed object is not used
+            os.chmod(cached_path, 0o644)
+            with open(cached_path, 'wb') as cached_file:
+                cached_file.write(b'wagon DATA')
+            requests_get.return_value = self._response(
+                content=[b'wagon data'], headers={'ETag': '"v1"'})
+            with utils.cached_download(url) as new_cached_path:
+                self.assertEqual(new_cached_path, cached_path)
+                with open(new_cached_path, 'rb') as cached_file:
+                    self.assertEqual(cached_file.read(), b'wagon data')
+            # downloaded without conditional headers
+            requests_get.assert_called_with(url, stream=True, headers={})
+            self.assertEqual(utils._download_cache_readers, {})
+
+            # directory of other user is not used
+            with mock.patch('os.getuid', mock.Mock(
+                    return_value=os.stat(cache_dir).st_uid + 1)):
+                with self.assertRaises(utils.NonRecoverableError):
+                    with utils.cached_download(url):
+                        pass
+
+    def test_cached_download_eviction(self):
+        _ctx = self.get_mock_ctx(__name__)
+        current_ctx.set(_ctx)
+        requests_get = mock.Mock()
+        with mock.patch('cloudify_deployment_proxy.utils.requests.get',
+                        requests_get):
+            with mock.patch(
+                    'cloudify_deployment_proxy.utils.DOWNLOAD_CACHE_SIZE', 8):
+                cached = {}
+                for name in ['a', 'b', 'c']:
+                    requests_get.return_value = self._response(
+                        content=[name.encode() * 4])
+                    with utils.cached_download(
+                            'https://example.com/' + name) as cached_path:
+                        cached[name] = cached_path
+                    if name == 'b':
+                        # a is used again, so b is least recently used
+                        requests_get.return_value = self._response(
+                            status_code=304)
+                        with utils.cached_download('https://example.com/a'):
+                            pass
+                self.assertTrue(os.path.isfile(cached['a']))
+                self.assertFalse(os.path.isfile(cached['b']))
+                self.assertTrue(os.path.isfile(cached['c']))
+
+                # file in use is not evicted
+                requests_get.return_value = self._response(
+                    content=[b'dddd'])
+                with utils.cached_download('https://example.com/d') as path:
+                    for name in ['e', 'f']:
+                        requests_get.return_value = self._response(
+                            content=[name.encode() * 4])
+                        with utils.cached_download(
+                                'https://example.com/' + name):
+                            pass
+                    self.assertTrue(os.path.isfile(path))
+                self.assertFalse(utils._download_cache_readers)
+                requests_get.return_value = self._response(
+                    content=[b'gggg'])
+                with utils.cached_download('https://example.com/g'):
+                    pass
+                self.assertFalse(os.path.isfile(path))
+
+    @unittest.skipIf(not utils.fcntl, 'no file locks')
+    def test_remove_cached_object_locked(self):
+        _ctx = self.get_mock_ctx(__name__)
+        current_ctx.set(_ctx)
+        requests_get = mock.Mock(return_value=self._response(
+            content=[b'wagon']))
+        with mock.patch('cloudify_deployment_proxy.utils.requests.get',
+                        requests_get):
+            with utils.cached_download('https://example.com/a') as path:
+                pass
+        sha256 = os.path.basename(path)
+        # reader in other process has shared lock
+        with open(path, 'rb') as reader:
+            utils.fcntl.flock(reader, utils.fcntl.LOCK_SH)
+            self.assertFalse(utils._remove_cached_object(sha256))
+            self.assertTrue(os.path.isfile(path))
+        self.assertTrue(utils._remove_cached_object(sha256))
+        self.assertFalse(os.path.isfile(path))
+
+    def test_project_paths(self):
+        value = {'ip': '10.0.0.1',
+                 'network': {'name': 'net', 'ports': [1, 2]},
+                 'huge': 'x' * 1000}
+        self.assertEqual(
+            utils.project_paths(value, [['ip'], ['network', 'ports'],
+                                        ['network', 'missing'],
+                                        ['ip', 'nested'], ['other']]),
+            {'ip': '10.0.0.1', 'network': {'ports': [1, 2]}})
+        self.assertEqual(utils.project_paths(value, []), {})
+
+    def test_run_in_threads(self):
+        _ctx = self.get_mock_ctx(__name__)
+        current_ctx.set(_ctx)
+
+        def _func(item):
+            # context is available in thread
+            _ctx_in_thread = current_ctx.get_ctx()
+            if item == 3:
+                raise ValueError('Wrong item')
+            return item, _ctx_in_thread
+
+        results = utils.run_in_threads(_func, range(5), 3)
+        self.assertEqual([result for result, _ in results],
+                         [(0, _ctx), (1, _ctx), (2, _ctx), None, (4, _ctx)])
+        self.assertEqual([repr(error) for _, error in results],
+                         ['None', 'None', 'None',
+                          repr(ValueError('Wrong item')), 'None'])
+
     def test_get_local_path_local(self):
         _ctx = self.get_mock_ctx(__name__)
         current_ctx.set(_ctx)
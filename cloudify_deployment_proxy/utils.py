@@ -14,20 +14,50 @@
 
 import os
 import sys
+import stat
+import time
+import json
 import shutil
+import hashlib
+import threading
 import zipfile
 import tempfile
 from shutil import copy
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
+try:
+    import fcntl
+except ImportError:
+    # no locks between processes, on windows opened file can't be removed
+    fcntl = None
+
 from cloudify import ctx
+from cloudify.constants import AGENT_WORK_DIR_KEY
+from cloudify.state import current_ctx
 from cloudify.exceptions import NonRecoverableError
 from cloudify.exceptions import OperationRetry
 from cloudify.utils import exception_to_error_cause
 
 from cloudify_common_sdk._compat import urlparse, text_type
 
+from .constants import (
+    DOWNLOAD_CACHE_DIR,
+    DOWNLOAD_CACHE_SIZE,
+    DOWNLOAD_CHUNK_SIZE,
+)
+
+
+ALLOWED_SCHEMES = ['http', 'https']
+DOWNLOAD_CACHE_INDEX = 'index.json'
+DOWNLOAD_CACHE_LOCK = 'lock'
+# serialize index updates between operations running in the same process
+_download_cache_lock = threading.Lock()
+# sha256 -> count of readers in current process
+_download_cache_readers = {}
+
 
 def generate_traceback_exception():
     _, exc_value, exc_traceback = sys.exc_info()
@@ -81,6 +111,273 @@ def proxy_operation(operation):
     return decorator
 
 
+def _download_cache_root():
+    work_dir = os.environ.get(AGENT_WORK_DIR_KEY)
+    if work_dir:
+        return os.path.join(work_dir, DOWNLOAD_CACHE_DIR)
+    # not in agent, use directory of current user
+    return os.path.join(tempfile.gettempdir(), '{0}_{1}'.format(
+        DOWNLOAD_CACHE_DIR, _getuid()))
+
+
+def _getuid():
+    return os.getuid() if hasattr(os, 'getuid') else 'user'
+
+
+def _download_cache_path(*parts):
+    return os.path.join(_download_cache_root(), *parts)
+
+
+def _private_dir(path):
+    """Create directory available only for current user, directory
+    created by other user is not used."""
+    try:
+        os.makedirs(path, 0o700)
+    except OSError:
+        # created by other operation
+        if not os.path.isdir(path):
+            raise
+    path_stat = os.lstat(path)
+    if not stat.S_ISDIR(path_stat.st_mode) or (
+            hasattr(os, 'getuid') and path_stat.st_uid != os.getuid()):
+        raise NonRecoverableError(
+            'Download cache {0} is not a directory owned by current user.'
+            .format(path))
+    if stat.S_IMODE(path_stat.st_mode) != 0o700:
+        os.chmod(path, 0o700)
+
+
+def _load_download_cache_index():
+    try:
+        with open(_download_cache_path(DOWNLOAD_CACHE_INDEX)) as index_file:
+            return json.load(index_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _save_download_cache_index(index):
+    # write to temporary file and rename, so other processes never see
+    # partially written index
+    fd, index_path = tempfile.mkstemp(dir=_download_cache_path())
+    with os.fdopen(fd, 'w') as index_file:
+        json.dump(index, index_file)
+    os.rename(index_path, _download_cache_path(DOWNLOAD_CACHE_INDEX))
+
+
+@contextmanager
+def _download_cache_locked():
+    # index and objects are shared by all operations on the host
+    with _download_cache_lock:
+        if not fcntl:
+            yield
+            return
+        with open(_download_cache_path(DOWNLOAD_CACHE_LOCK), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _remove_cached_object(sha256):
+    """Remove object if nobody reads it, returns False for object in use."""
+    if _download_cache_readers.get(sha256):
+        return False
+    object_path = _download_cache_path('objects', sha256)
+    try:
+        with open(object_path, 'rb') as object_file:
+            if fcntl:
+                # readers in other processes have shared lock
+                fcntl.flock(object_file,
+                            fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.remove(object_path)
+    except (IOError, OSError):
+        return not os.path.exists(object_path)
+    return True
+
+
+def _evict_download_cache(index, keep_url):
+    """Remove least recently used files until cache fits the size limit,
+    files in use are kept."""
+    sizes = dict((entry['sha256'], entry['size'])
+                 for entry in index.values())
+    total_size = sum(sizes.values())
+    for url in sorted(index, key=lambda url: index[url]['used']):
+        if total_size <= DOWNLOAD_CACHE_SIZE:
+            break
+        if url == keep_url:
+            continue
+        sha256 = index[url]['sha256']
+        # same content can be cached for several urls
+        if any(entry['sha256'] == sha256 for other_url, entry in
+               index.items() if other_url != url):
+            index.pop(url)
+            continue
+        if not _remove_cached_object(sha256):
+            continue
+        index.pop(url)
+        total_size -= sizes[sha256]
+
+
+def _cached_object(entry):
+    if not entry:
+        return None
+    object_path = _download_cache_path('objects', entry['sha256'])
+    if os.path.isfile(object_path) and \
+            os.path.getsize(object_path) == entry['size']:
+        return object_path
+    return None
+
+
+def _use_cached_object(sha256):
+    # called with locked cache, so object can't be evicted before lock
+    object_file = open(_download_cache_path('objects', sha256), 'rb')
+    if fcntl:
+        fcntl.flock(object_file, fcntl.LOCK_SH)
+    _download_cache_readers[sha256] = (
+        _download_cache_readers.get(sha256, 0) + 1)
+    return object_file
+
+
+def _verify_cached_object(sha256, object_file):
+    file_hash = hashlib.sha256()
+    for chunk in iter(lambda: object_file.read(DOWNLOAD_CHUNK_SIZE), b''):
+        file_hash.update(chunk)
+    object_file.seek(0)
+    if file_hash.hexdigest() == sha256:
+        return True
+    ctx.logger.warning('Cached object {0} is changed, ignored.'
+                       .format(sha256))
+    return False
+
+
+def _unuse_cached_object(sha256, object_file):
+    # called with locked cache
+    _download_cache_readers[sha256] -= 1
+    if not _download_cache_readers[sha256]:
+        del _download_cache_readers[sha256]
+    # lock is released with close
+    object_file.close()
+
+
+def _release_cached_object(sha256, object_file):
+    with _download_cache_lock:
+        _unuse_cached_object(sha256, object_file)
+
+
+@contextmanager
+def cached_download(url):
+    """Download file to the content addressed download cache.
+
+    Cached file is revalidated with ETag / Last-Modified headers of previous
+    response, so unchanged file is not downloaded again.
+
+    :param url: Location of the file to download
+    :type url: str
+    :returns: context with location of the file in cache, file is not
+              removed from cache until exit and must not be changed
+    :rtype: str
+
+    """
+    # cached files are used as blueprints and plugins, so nobody else
+    # should be able to change them
+    _private_dir(_download_cache_path())
+    objects_dir = _download_cache_path('objects')
+    _private_dir(objects_dir)
+
+    # cached version is kept while it is revalidated
+    cached_file = None
+    with _download_cache_locked():
+        entry = _load_download_cache_index().get(url)
+        if _cached_object(entry):
+            cached_sha256 = entry['sha256']
+            cached_file = _use_cached_object(cached_sha256)
+    if cached_file and not _verify_cached_object(cached_sha256, cached_file):
+        _release_cached_object(cached_sha256, cached_file)
+        cached_file = None
+
+    headers = {}
+    if cached_file:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    object_file = None
+    fd, download_path = tempfile.mkstemp(dir=objects_dir)
+    try:
+        try:
+            response = requests.get(url, stream=True, headers=headers)
+            if cached_file and response.status_code == 304:
+                ctx.logger.debug('Using cached {0}'.format(url))
+                entry['used'] = time.time()
+                sha256 = entry['sha256']
+                object_file, cached_file = cached_file, None
+            else:
+                response.raise_for_status()
+
+                final_url = response.url
+                if final_url != url:
+                    ctx.logger.debug('Redirected to {0}'.format(final_url))
+
+                ctx.logger.info('Downloading {0} to cache...'.format(url))
+                file_hash = hashlib.sha256()
+                size = 0
+                with os.fdopen(fd, 'wb') as cache_file:
+                    fd = None
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        file_hash.update(chunk)
+                        size += len(chunk)
+                        cache_file.write(chunk)
+                sha256 = file_hash.hexdigest()
+                os.chmod(download_path, 0o444)
+                entry = {
+                    'sha256': sha256,
+                    'size': size,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'used': time.time(),
+                }
+        except (requests.exceptions.RequestException, IOError) as ex:
+            raise NonRecoverableError(
+                'Failed to download {0}. ({1})'.format(url, text_type(ex)))
+
+        with _download_cache_locked():
+            if not object_file:
+                object_path = _download_cache_path('objects', sha256)
+                # same content is already cached, keep file locked by
+                # readers in place
+                if os.path.isfile(object_path):
+                    object_file = _use_cached_object(sha256)
+                    if not _verify_cached_object(sha256, object_file):
+                        _unuse_cached_object(sha256, object_file)
+                        object_file = None
+                if not object_file:
+                    os.rename(download_path, object_path)
+                    download_path = None
+                    object_file = _use_cached_object(sha256)
+            index = _load_download_cache_index()
+            index[url] = entry
+            _evict_download_cache(index, url)
+            _save_download_cache_index(index)
+    except BaseException:
+        if object_file:
+            _release_cached_object(sha256, object_file)
+        raise
+    finally:
+        if fd is not None:
+            os.close(fd)
+        if download_path:
+            os.remove(download_path)
+        if cached_file:
+            _release_cached_object(cached_sha256, cached_file)
+
+    try:
+        yield _download_cache_path('objects', sha256)
+    finally:
+        _release_cached_object(sha256, object_file)
+
+
 def download_file(url, destination=None, keep_name=False):
     """Download file.
 
@@ -94,8 +391,6 @@ def download_file(url, destination=None, keep_name=False):
     :rtype: str
 
     """
-    CHUNK_SIZE = 1024
-
     if not destination:
         if keep_name:
             path = urlparse(url).path
@@ -105,31 +400,20 @@ def download_file(url, destination=None, keep_name=False):
             fd, destination = tempfile.mkstemp()
             os.close(fd)
 
-    ctx.logger.info('Downloading {0} to {1}...'.format(url, destination))
-
-    try:
-        response = requests.get(url, stream=True)
-    except requests.exceptions.RequestException as ex:
-        raise NonRecoverableError(
-            'Failed to download {0}. ({1})'.format(url, text_type(ex)))
-
-    final_url = response.url
-    if final_url != url:
-        ctx.logger.debug('Redirected to {0}'.format(final_url))
-
-    try:
-        with open(destination, 'wb') as destination_file:
-            for chunk in response.iter_content(CHUNK_SIZE):
-                destination_file.write(chunk)
-    except IOError as ex:
-        raise NonRecoverableError(
-            'Failed to download {0}. ({1})'.format(url, text_type(ex)))
+    with cached_download(url) as cached_path:
+        ctx.logger.info('Copying {0} to {1}...'.format(url, destination))
+        try:
+            # copy, so changes of destination never change cache
+            shutil.copyfile(cached_path, destination)
+        except (IOError, OSError) as ex:
+            raise NonRecoverableError(
+                'Failed to download {0}. ({1})'.format(url, text_type(ex)))
 
     return destination
 
 
 def get_local_path(source, destination=None, create_temp=False):
-    allowed_schemes = ['http', 'https']
+    allowed_schemes = ALLOWED_SCHEMES
     if urlparse(source).scheme in allowed_schemes:
         downloaded_file = download_file(source, destination, keep_name=True)
         return downloaded_file
@@ -161,6 +445,87 @@ def zip_folder(source, destination, include_folder=True):
     return destination
 
 
+def _zip_source(zip_file, source):
+    if urlparse(source).scheme in ALLOWED_SCHEMES:
+        name = os.path.basename(urlparse(source).path)
+        with cached_download(source) as cached_path:
+            zip_file.write(cached_path, name)
+    elif os.path.isfile(source):
+        zip_file.write(source, os.path.basename(source))
+    else:
+        raise NonRecoverableError(
+            'You must provide either a path to a local file, or a remote URL '
+            'using one of the allowed schemes: {0}'.format(ALLOWED_SCHEMES))
+
+
+def zip_sources(sources):
+    """Create zip archive from local files and urls, urls are read from
+    download cache, archive is removed on failure.
+
+    :param sources: list of local paths or urls
+    :returns: path to zip archive
+    """
+    fd, destination_zip = tempfile.mkstemp(suffix='.zip')
+    os.close(fd)
+    ctx.logger.debug('Creating zip archive: {0}...'.format(destination_zip))
+    try:
+        with zipfile.ZipFile(destination_zip, 'w') as zip_file:
+            for source in sources:
+                _zip_source(zip_file, source)
+    except Exception:
+        os.remove(destination_zip)
+        raise
+    return destination_zip
+
+
+def project_paths(value, paths):
+    """Copy only values on paths from dict.
+
+    :param value: source dict
+    :param paths: list of paths, each path is list of keys
+    :returns: dict with the same structure as value
+    """
+    projection = {}
+    for path in paths:
+        current = value
+        for key in path:
+            if not isinstance(current, dict) or key not in current:
+                break
+            current = current[key]
+        else:
+            target = projection
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = current
+    return projection
+
+
+def value_hash(value):
+    """Stable hash of json compatible value."""
+    return hashlib.sha256(json.dumps(
+        value, sort_keys=True, default=text_type).encode('utf-8')).hexdigest()
+
+
+def run_in_threads(func, items, workers):
+    """Run function for each item with current operation context.
+
+    :returns: list of (result, exception) in order of items
+    """
+    _ctx = current_ctx.get_ctx()
+
+    def _run(item):
+        current_ctx.set(_ctx)
+        try:
+            return func(item), None
+        except Exception as ex:
+            return None, ex
+        finally:
+            current_ctx.clear()
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return list(executor.map(_run, items))
+
+
 def zip_files(files):
     source_folder = tempfile.mkdtemp()
     destination_zip = source_folder + '.zip'
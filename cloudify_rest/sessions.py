@@ -0,0 +1,235 @@
+# Copyright (c) 2014-2020 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import atexit
+import shutil
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import requests
+from cloudify_rest_sdk import utility
+from cloudify_common_sdk._compat import urlparse
+
+# max count of sessions (and so connections) used at the same time to
+# the same endpoint
+MAX_PER_HOST = 10
+# seconds before unused session is closed, should be less than keep-alive
+# timeout on server side
+IDLE_TIMEOUT = 30
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def _hash(value):
+    return hashlib.sha256(repr(value).encode('utf-8')).hexdigest()
+
+
+class SessionPool(object):
+    """Keep-alive sessions keyed by endpoint, tls settings and auth."""
+
+    def __init__(self, max_per_host=MAX_PER_HOST, idle_timeout=IDLE_TIMEOUT):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        # key: [(last used, session), ...], most recent at the end
+        self._idle = {}
+        # key: count of sessions in use
+        self._busy = {}
+        self._tls_dir = None
+        # copied certificate path: count of requests in progress
+        self._tls_refs = {}
+        # key: copied certificates used by sessions
+        self._tls_keys = {}
+
+    @staticmethod
+    def key(url, **kwargs):
+        parsed = urlparse(url)
+        port = parsed.port or DEFAULT_PORTS.get(parsed.scheme)
+        return (parsed.scheme, parsed.hostname, port,
+                repr(kwargs.get('verify', True)),
+                repr(kwargs.get('cert')),
+                repr(sorted((kwargs.get('proxies') or {}).items())),
+                # keep only hash of credentials in key
+                _hash(kwargs.get('auth')))
+
+    def _tls_file(self, value, paths):
+        # rest sdk saves certificates content to new temporary file for each
+        # call and connections are reused only for the same file path, so
+        # use copy of file named by content
+        if isinstance(value, (list, tuple)):
+            return tuple(self._tls_file(item, paths) for item in value)
+        if not isinstance(value, str) or not os.path.isfile(value):
+            return value
+        with open(value, 'rb') as f:
+            content = f.read()
+        with self._cond:
+            if not self._tls_dir:
+                self._tls_dir = tempfile.mkdtemp()
+            path = os.path.join(self._tls_dir,
+                                hashlib.sha256(content).hexdigest())
+            if not os.path.isfile(path):
+                fd, tmp_path = tempfile.mkstemp(dir=self._tls_dir)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(content)
+                os.rename(tmp_path, path)
+            # file is not removed while request is in progress
+            self._tls_refs[path] = self._tls_refs.get(path, 0) + 1
+        paths.append(path)
+        return path
+
+    def _release_tls_files(self, paths):
+        with self._cond:
+            for path in paths:
+                self._tls_refs[path] -= 1
+                if not self._tls_refs[path]:
+                    del self._tls_refs[path]
+            self._remove_tls_files()
+
+    def _remove_tls_files(self):
+        # certificates and keys are kept on disk only while they are used
+        # by requests in progress or by idle sessions
+        for key in list(self._tls_keys):
+            if key not in self._idle and key not in self._busy:
+                del self._tls_keys[key]
+        used = set(self._tls_refs)
+        for paths in self._tls_keys.values():
+            used.update(paths)
+        if not self._tls_dir:
+            return
+        for name in os.listdir(self._tls_dir):
+            path = os.path.join(self._tls_dir, name)
+            if path not in used:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _evict(self, now):
+        for key in list(self._idle):
+            sessions = []
+            for last_used, session in self._idle[key]:
+                if now - last_used > self.idle_timeout:
+                    session.close()
+                else:
+                    sessions.append((last_used, session))
+            if sessions:
+                self._idle[key] = sessions
+            else:
+                del self._idle[key]
+        self._remove_tls_files()
+
+    def acquire(self, key):
+        with self._cond:
+            while True:
+                self._evict(time.time())
+                if self._idle.get(key):
+                    _, session = self._idle[key].pop()
+                    self._busy[key] = self._busy.get(key, 0) + 1
+                    return session
+                if self._busy.get(key, 0) < self.max_per_host:
+                    self._busy[key] = self._busy.get(key, 0) + 1
+                    break
+                self._cond.wait()
+        return requests.Session()
+
+    def release(self, key, session):
+        # cookies are not shared between calls, same as without pool
+        session.cookies.clear()
+        with self._cond:
+            self._busy[key] -= 1
+            if not self._busy[key]:
+                del self._busy[key]
+            self._idle.setdefault(key, []).append((time.time(), session))
+            self._cond.notify()
+
+    def request(self, method, url, **kwargs):
+        paths = []
+        try:
+            for name in ['verify', 'cert']:
+                if name in kwargs:
+                    kwargs[name] = self._tls_file(kwargs[name], paths)
+            key = self.key(url, **kwargs)
+            session = self.acquire(key)
+            if paths:
+                with self._cond:
+                    self._tls_keys[key] = tuple(paths)
+            try:
+                return session.request(method=method, url=url, **kwargs)
+            finally:
+                self.release(key, session)
+        finally:
+            if paths:
+                self._release_tls_files(paths)
+
+    def clear(self):
+        with self._cond:
+            for sessions in self._idle.values():
+                for _, session in sessions:
+                    session.close()
+            self._idle = {}
+            # certificates can be still used by requests in progress
+            if self._tls_dir and not self._busy and not self._tls_refs:
+                shutil.rmtree(self._tls_dir, ignore_errors=True)
+                self._tls_dir = None
+                self._tls_keys = {}
+            else:
+                self._remove_tls_files()
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(sessions) for sessions in self._idle.values())
+
+
+pool = SessionPool()
+# copied certificates and keys are not left on disk
+atexit.register(pool.clear)
+
+_scope = threading.local()
+_install_lock = threading.Lock()
+
+
+class _PooledRequests(object):
+    """Used by rest sdk instead of requests module, pool is used only
+    inside of pooled_sessions() in the current thread."""
+
+    def __init__(self, module):
+        self._module = module
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+    def request(self, method, url, **kwargs):
+        session_pool = getattr(_scope, 'pool', None)
+        if session_pool is None:
+            return self._module.request(method, url, **kwargs)
+        return session_pool.request(method, url, **kwargs)
+
+
+@contextmanager
+def pooled_sessions(session_pool=None):
+    # rest sdk has no way to provide session, so replace requests module
+    # used by sdk with wrapper
+    with _install_lock:
+        if not isinstance(utility.requests, _PooledRequests):
+            utility.requests = _PooledRequests(utility.requests)
+    previous = getattr(_scope, 'pool', None)
+    _scope.pool = pool if session_pool is None else session_pool
+    try:
+        yield
+    finally:
+        _scope.pool = previous
@@ -14,18 +14,24 @@
 # limitations under the License.
 import logging
 import traceback
+from concurrent.futures import (ThreadPoolExecutor, wait,
+                                FIRST_COMPLETED, )
 
 from cloudify import context
 from cloudify import ctx as CloudifyContext
+from cloudify.state import current_ctx
 from cloudify.exceptions import NonRecoverableError, RecoverableError
 from cloudify.decorators import workflow
 
 from cloudify_rest_sdk import utility
+from cloudify_common_sdk._compat import text_type
 from cloudify_common_sdk.filters import (get_field_value_recursive,
                                          obfuscate_passwords, )
 
 from cloudify_terminal import operation_cleanup, rerun, workflow_get_resource
 
+from .sessions import pooled_sessions
+
 
 def _get_params_attributes(ctx, runtime_properties, params_list):
     params = {}
@@ -35,6 +41,132 @@ def _get_params_attributes(ctx, runtime_properties, params_list):
     return params
 
 
+def _execute_template(ctx, template, runtime_properties, instance_props,
+                      auth, retry_count, retry_sleep):
+    params = template.get('params', {})
+    template_file = template.get('template_file')
+    params_attributes = template.get('params_attributes')
+
+    ctx.logger.info('Processing: {template_file}'
+                    .format(template_file=repr(template_file)))
+    template_params = {}
+    if params:
+        template_params.update(params)
+    if params_attributes:
+        template_params.update(
+            _get_params_attributes(ctx,
+                                   runtime_properties,
+                                   params_attributes))
+    ctx.logger.debug(
+        'Params: {params}'.format(
+            params=repr(obfuscate_passwords(template_params))))
+    template_params["ctx"] = ctx
+    _execute(params=template_params, template_file=template_file,
+             ctx=ctx, instance_props=instance_props,
+             node_props=ctx.node.properties,
+             save_path=template.get('save_to'),
+             prerender=template.get('prerender'),
+             remove_calls=template.get('remove_calls'), auth=auth,
+             resource_callback=ctx.get_resource,
+             retry_count=retry_count,
+             retry_sleep=retry_sleep)
+
+
+def _templates_dependencies(templates):
+    """Indexes of templates that must be finished before each template.
+
+    Template without `depends_on` waits for all previous templates, unless
+    it is marked as `independent`.
+    """
+    ids = {}
+    for index, template in enumerate(templates):
+        ids[text_type(template.get('id', index))] = index
+
+    dependencies = []
+    for index, template in enumerate(templates):
+        if 'depends_on' in template:
+            depends_on = set()
+            for template_id in template['depends_on'] or []:
+                if text_type(template_id) not in ids:
+                    raise NonRecoverableError(
+                        'Unknown template in depends_on: {template_id}'
+                        .format(template_id=repr(template_id)))
+                depends_on.add(ids[text_type(template_id)])
+        elif template.get('independent') or not index:
+            depends_on = set()
+        else:
+            depends_on = set([index - 1])
+        dependencies.append(depends_on)
+
+    # results of all transitive dependencies are visible to template
+    for index in range(len(templates)):
+        stack = list(dependencies[index])
+        ancestors = set()
+        while stack:
+            parent = stack.pop()
+            if parent == index:
+                raise NonRecoverableError(
+                    'Circular dependency in template {template_id}'.format(
+                        template_id=repr(templates[index].get('id', index))))
+            if parent not in ancestors:
+                ancestors.add(parent)
+                stack.extend(dependencies[parent])
+        dependencies[index] = ancestors
+    return dependencies
+
+
+def _bunch_execute_concurrent(ctx, templates, auth, max_workers,
+                              retry_count, retry_sleep):
+    dependencies = _templates_dependencies(templates)
+    # templates read runtime properties from operation start and results of
+    # own dependencies
+    base_properties = dict(ctx.instance.runtime_properties)
+    _ctx = current_ctx.get_ctx()
+    results = {}
+    errors = {}
+
+    def _run(index):
+        current_ctx.set(_ctx)
+        try:
+            runtime_properties = dict(base_properties)
+            for parent in sorted(dependencies[index]):
+                runtime_properties.update(results[parent])
+            instance_props = {}
+            _execute_template(ctx, templates[index], runtime_properties,
+                              instance_props, auth, retry_count, retry_sleep)
+            return instance_props
+        finally:
+            current_ctx.clear()
+
+    pending = list(range(len(templates)))
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if not errors:
+                for index in list(pending):
+                    if dependencies[index].issubset(results):
+                        pending.remove(index)
+                        running[executor.submit(_run, index)] = index
+            else:
+                # failed template, wait only for already started
+                pending = []
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = running.pop(future)
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    errors[index] = e
+
+    # merge in templates order, so result does not depend on timing
+    for index in sorted(results):
+        ctx.instance.runtime_properties.update(results[index])
+    if errors:
+        raise errors[min(errors)]
+
+
 @operation_cleanup
 def bunch_execute(templates=None, **kwargs):
     # get current context
@@ -47,36 +179,19 @@ def bunch_execute(templates=None, **kwargs):
             'cloudify.nodes.rest.Requests.')
 
     auth = kwargs.get('auth')
+    max_workers = kwargs.get('max_workers') or 1
+    retry_count = kwargs.get('retry_count', 1)
+    retry_sleep = kwargs.get('retry_sleep', 15)
+
+    if templates and max_workers > 1:
+        _bunch_execute_concurrent(ctx, templates, auth, max_workers,
+                                  retry_count, retry_sleep)
+        return
 
     for template in templates or []:
-        params = template.get('params', {})
-        template_file = template.get('template_file')
-        prerender = template.get('prerender')
-        save_to = template.get('save_to')
-        params_attributes = template.get('params_attributes')
-        remove_calls = template.get('remove_calls')
-
-        ctx.logger.info('Processing: {template_file}'
-                        .format(template_file=repr(template_file)))
-        runtime_properties = {}
-        if params:
-            runtime_properties.update(params)
-        if params_attributes:
-            runtime_properties.update(
-                _get_params_attributes(ctx,
-                                       ctx.instance.runtime_properties,
-                                       params_attributes))
-        ctx.logger.debug(
-            'Params: {params}'.format(
-                params=repr(obfuscate_passwords(runtime_properties))))
-        runtime_properties["ctx"] = ctx
-        _execute(params=runtime_properties, template_file=template_file,
-                 ctx=ctx, instance_props=ctx.instance.runtime_properties,
-                 node_props=ctx.node.properties, save_path=save_to,
-                 prerender=prerender, remove_calls=remove_calls, auth=auth,
-                 resource_callback=ctx.get_resource,
-                 retry_count=kwargs.get('retry_count', 1),
-                 retry_sleep=kwargs.get('retry_sleep', 15))
+        _execute_template(ctx, template, ctx.instance.runtime_properties,
+                          ctx.instance.runtime_properties, auth,
+                          retry_count, retry_sleep)
     else:
         ctx.logger.debug('No calls.')
 
@@ -213,10 +328,12 @@ def _execute_in_retry(template, params, instance_props, node_props,
     # we have something additional to node properties for merge
     if auth:
         merged_auth.update(auth)
-    result = utility.process(merged_params, template,
-                             merged_auth,
-                             prerender=prerender,
-                             resource_callback=resource_callback)
+    # reuse connections to the same server between calls and operations
+    with pooled_sessions():
+        result = utility.process(merged_params, template,
+                                 merged_auth,
+                                 prerender=prerender,
+                                 resource_callback=resource_callback)
     if remove_calls and result:
         result = result.get('result_properties', {})
     if save_path:
@@ -0,0 +1,59 @@
+# Copyright (c) 2014-2020 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare requests with new connection per call and pooled sessions.
+
+Run: python -m cloudify_rest.tests.benchmark_sessions [count]
+"""
+
+import sys
+import time
+
+import requests
+
+from cloudify_rest import sessions
+from cloudify_rest.tests.test_sessions import StubServer
+
+
+def _run(request, server, count):
+    start = time.time()
+    for i in range(count):
+        request('GET', server.url + '/{i}'.format(i=i),
+                verify=server.cert or True, timeout=5).json()
+    return time.time() - start
+
+
+def main(count=1000):
+    pool = sessions.SessionPool()
+    results = []
+    for tls in (False, True):
+        for name, request in (('requests.request', requests.request),
+                              ('SessionPool.request', pool.request)):
+            with StubServer(tls=tls) as server:
+                spent = _run(request, server, count)
+                results.append((
+                    '{name} {scheme}'.format(
+                        name=name, scheme='https' if tls else 'http'),
+                    spent, server.connections))
+    pool.clear()
+    for name, spent, connections in results:
+        print("{name:<26} {count} calls: {spent:.3f}s, "
+              "{per_call:.3f}ms per call, {connections} connections"
+              .format(name=name, count=count, spent=spent,
+                      per_call=spent * 1000 / count,
+                      connections=connections))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -18,6 +18,7 @@ import json
 import os
 from mock import MagicMock, patch
 import logging
+import threading
 
 from cloudify_rest import tasks
 
@@ -365,3 +366,69 @@ class TestPlugin(unittest.TestCase):
             parsed_list = _ctx.instance.runtime_properties.get(
                 'calls')[0].get('payload').get('jinja_block')
             self.assertListEqual(parsed_list, custom_list)
+
+    def test_bunch_execute_concurrent(self):
+        _ctx = MockC1oudifyContext('node_name',
+                                   properties={'hosts': ['test123.test'],
+                                               'port': -1,
+                                               'ssl': False,
+                                               'verify': False})
+        _ctx.instance._runtime_properties = DirtyTrackingDict(
+            {'base': 'value'})
+        _ctx.get_resource = MagicMock(side_effect=lambda name: name)
+        current_ctx.set(_ctx)
+        # both independent templates must run at the same time
+        barriers = [threading.Barrier(2, timeout=10)]
+
+        def _process(params, template, *_, **__):
+            if template in ('first', 'second'):
+                barriers[0].wait()
+            if template == 'failed':
+                raise RecoverableError('Failed call')
+            return {'shared': template,
+                    template: params.get('previous', 'done')}
+
+        templates = [{
+            'id': 'first',
+            'template_file': 'first',
+        }, {
+            'id': 'second',
+            'template_file': 'second',
+            'independent': True,
+        }, {
+            'template_file': 'third',
+            'depends_on': ['first'],
+            'params_attributes': {'previous': ['first']},
+        }]
+        with patch("cloudify_rest.tasks.utility.process",
+                   MagicMock(side_effect=_process)):
+            tasks.bunch_execute(templates=templates, max_workers=4)
+            # dependency results are visible, results are merged in
+            # templates order
+            self.assertEqual(
+                dict((key, _ctx.instance.runtime_properties[key])
+                     for key in ['base', 'first', 'second', 'third',
+                                 'shared']),
+                {'base': 'value', 'first': 'done', 'second': 'done',
+                 'third': 'done', 'shared': 'third'})
+
+            # failed template stops dependent templates
+            _ctx.instance._runtime_properties = DirtyTrackingDict({})
+            barriers[0] = threading.Barrier(1)
+            templates[0]['template_file'] = 'failed'
+            with self.assertRaises(RecoverableError):
+                tasks.bunch_execute(templates=templates, max_workers=4,
+                                    force_rerun=True)
+            self.assertEqual(dict(_ctx.instance.runtime_properties),
+                             {'shared': 'second', 'second': 'done'})
+
+            # unknown and circular dependencies
+            templates[1]['depends_on'] = ['unknown']
+            with self.assertRaises(NonRecoverableError):
+                tasks.bunch_execute(templates=templates, max_workers=4,
+                                    force_rerun=True)
+            templates[1]['depends_on'] = ['2']
+            templates[2]['depends_on'] = ['second']
+            with self.assertRaises(NonRecoverableError):
+                tasks.bunch_execute(templates=templates, max_workers=4,
+                                    force_rerun=True)
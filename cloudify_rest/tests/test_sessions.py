@@ -0,0 +1,276 @@
+# Copyright (c) 2014-2020 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import ssl
+import json
+import shutil
+import datetime
+import tempfile
+import threading
+import unittest
+import ipaddress
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mock import Mock, patch
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from cloudify.state import current_ctx
+from cloudify.mocks import MockCloudifyContext
+from cloudify_rest_sdk import utility
+
+from cloudify_rest import sessions, tasks
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep-alive is supported only by HTTP/1.1
+    protocol_version = 'HTTP/1.1'
+    # headers and body are sent separately, without it delayed ack on
+    # client side adds ~40ms to each call on reused connection
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        body = json.dumps({'path': self.path}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _self_signed(directory):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u'127.0.0.1')])
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(
+        name
+    ).public_key(
+        key.public_key()
+    ).serial_number(
+        x509.random_serial_number()
+    ).not_valid_before(
+        now - datetime.timedelta(days=1)
+    ).not_valid_after(
+        now + datetime.timedelta(days=1)
+    ).add_extension(
+        x509.SubjectAlternativeName(
+            [x509.IPAddress(ipaddress.ip_address(u'127.0.0.1'))]),
+        critical=False
+    ).sign(key, hashes.SHA256())
+    cert_path = os.path.join(directory, 'cert.pem')
+    key_path = os.path.join(directory, 'key.pem')
+    with open(cert_path, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+class StubServer(object):
+    """Local http server, counts client connections."""
+
+    def __init__(self, tls=False):
+        self.tls = tls
+        self.cert = None
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.connections = set()
+        if self.tls:
+            self.directory = tempfile.mkdtemp()
+            self.cert, key = _self_signed(self.directory)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.cert, key)
+            self.server.socket = context.wrap_socket(
+                self.server.socket, server_side=True)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def url(self):
+        return '{scheme}://127.0.0.1:{port}'.format(
+            scheme='https' if self.tls else 'http', port=self.port)
+
+    @property
+    def connections(self):
+        return len(self.server.connections)
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.tls:
+            shutil.rmtree(self.directory)
+
+
+class TestSessions(unittest.TestCase):
+
+    def tearDown(self):
+        current_ctx.clear()
+        super(TestSessions, self).tearDown()
+
+    def test_pool_reuse_connection(self):
+        pool = sessions.SessionPool()
+        with StubServer() as server:
+            for i in range(5):
+                response = pool.request(
+                    'GET', server.url + '/{i}'.format(i=i), timeout=5)
+                self.assertEqual(response.json(), {'path': '/{i}'.format(i=i)})
+            self.assertEqual(server.connections, 1)
+            # different credentials use different session
+            pool.request('GET', server.url, auth=('user', 'pass'), timeout=5)
+            self.assertEqual(server.connections, 2)
+        self.assertEqual(len(pool), 2)
+        pool.clear()
+        self.assertEqual(len(pool), 0)
+
+    def test_pool_reuse_tls_connection(self):
+        pool = sessions.SessionPool()
+        with StubServer(tls=True) as server:
+            for _ in range(3):
+                # sdk saves certificate to new file for each call
+                with tempfile.NamedTemporaryFile() as f:
+                    with open(server.cert, 'rb') as cert:
+                        f.write(cert.read())
+                    f.flush()
+                    pool.request('GET', server.url, verify=f.name, timeout=5)
+            self.assertEqual(server.connections, 1)
+        tls_dir = pool._tls_dir
+        # copy is kept while idle session uses it
+        self.assertEqual(len(os.listdir(tls_dir)), 1)
+        pool.clear()
+        self.assertFalse(os.path.exists(tls_dir))
+
+    def test_pool_remove_tls_files(self):
+        pool = sessions.SessionPool(idle_timeout=30)
+        with StubServer(tls=True) as server:
+            with patch('time.time', Mock(return_value=100)):
+                pool.request('GET', server.url, verify=server.cert,
+                             timeout=5)
+            tls_dir = pool._tls_dir
+            self.assertEqual(len(os.listdir(tls_dir)), 1)
+            # copy is removed with evicted session
+            with patch('time.time', Mock(return_value=200)):
+                pool.request('GET', server.url, timeout=5, verify=False)
+            self.assertEqual(os.listdir(tls_dir), [])
+            self.assertEqual(pool._tls_refs, {})
+        pool.clear()
+        self.assertFalse(os.path.exists(tls_dir))
+
+        # copy is removed after failed request
+        pool = sessions.SessionPool(idle_timeout=30)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b'not a certificate')
+            f.flush()
+            with patch.object(pool, 'acquire',
+                              Mock(side_effect=RuntimeError('failed'))):
+                self.assertRaises(RuntimeError, pool.request, 'GET',
+                                  'https://127.0.0.1:1', verify=f.name)
+        self.assertEqual(os.listdir(pool._tls_dir), [])
+        pool.clear()
+
+    def test_pool_key(self):
+        key = sessions.SessionPool.key
+        self.assertEqual(key('https://a/b'), key('https://a:443/c'))
+        self.assertNotEqual(key('https://a/b'), key('http://a/b'))
+        self.assertNotEqual(key('https://a/b'),
+                            key('https://a/b', verify=False))
+        self.assertNotEqual(key('https://a/b', auth=('a', 'b')),
+                            key('https://a/b', auth=('a', 'c')))
+        self.assertNotIn('secret', repr(key('https://a/', auth=('secret',))))
+
+    def test_pool_max_per_host(self):
+        pool = sessions.SessionPool(max_per_host=1)
+        session = pool.acquire('key')
+        acquired = threading.Event()
+
+        def _acquire():
+            pool.acquire('key')
+            acquired.set()
+
+        waiter = threading.Thread(target=_acquire)
+        waiter.start()
+        self.assertFalse(acquired.wait(0.2))
+        pool.release('key', session)
+        self.assertTrue(acquired.wait(5))
+        waiter.join()
+
+    def test_pool_idle_evict(self):
+        pool = sessions.SessionPool(idle_timeout=30)
+        session = Mock()
+        with patch('time.time', Mock(return_value=100)):
+            pool.acquire('key')
+            pool.release('key', session)
+        with patch('time.time', Mock(return_value=120)):
+            self.assertIs(pool.acquire('key'), session)
+            pool.release('key', session)
+        session.close.assert_not_called()
+        with patch('time.time', Mock(return_value=151)):
+            self.assertIsNot(pool.acquire('other'), session)
+        session.close.assert_called_once_with()
+        self.assertEqual(len(pool), 0)
+
+    def test_execute_in_retry_pooled(self):
+        current_ctx.set(MockCloudifyContext())
+        pool = sessions.SessionPool()
+        template = """
+            rest_calls:
+              - path: /first
+                method: GET
+                response_format: json
+                response_translation:
+                  path: [first]
+              - path: /second
+                method: GET
+                response_format: json
+                response_translation:
+                  path: [second]
+        """
+        with StubServer() as server:
+            node_props = {'host': '127.0.0.1', 'port': server.port,
+                          'ssl': False, 'verify': False}
+            instance_props = {}
+            with patch.object(sessions, 'pool', pool):
+                for _ in range(3):
+                    tasks._execute_in_retry(
+                        template, {}, instance_props, node_props,
+                        remove_calls=True)
+            self.assertEqual(instance_props,
+                             {'first': '/first', 'second': '/second'})
+            self.assertEqual(server.connections, 1)
+            # out of operations rest sdk works as before
+            self.assertIsInstance(utility.requests, sessions._PooledRequests)
+            utility.process({}, template, node_props)
+            self.assertEqual(server.connections, 3)
+        pool.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,7 +14,7 @@
 
 import unittest
 
-from mock import Mock, patch
+from mock import Mock, patch, call
 
 from cloudify.state import current_ctx
 from cloudify.mocks import MockCloudifyContext
@@ -119,6 +119,39 @@ class TestRollbackWorkflow(unittest.TestCase):
             type_names=[])
         self.assertListEqual(unresolved_nodes, [c_instance])
 
+    def test_execute_operation_graph_dependency_order(self):
+        ctx = self._gen_ctx()
+        instance_a = self.gen_mock_instance(ctx, u"started")
+        instance_b = self.gen_mock_instance(ctx, u"started",
+                                            instance_id=u"b_id")
+        instance_c = self.gen_mock_instance(ctx, u"started",
+                                            instance_id=u"c_id")
+        # a -> b -> c, operation is executed only on a and c
+        rel_b = Mock()
+        rel_b.target_id = u"b_id"
+        rel_c = Mock()
+        rel_c.target_id = u"c_id"
+        instance_a.relationships = [rel_b]
+        instance_b.relationships = [rel_c]
+        instance_c.relationships = []
+        graph = workflows._make_execute_operation_graph.__wrapped__(
+            ctx, 'cloudify.interfaces.lifecycle.start',
+            operation_kwargs={}, allow_kwargs_override=None,
+            run_by_dependency_order=True, type_names=[], node_ids=[],
+            node_instance_ids=[u"a_id", u"c_id"], ignore_failure=False)
+        subgraphs = {
+            subgraph.instance_id: subgraph for subgraph in ctx._subgraph}
+        # stub for b and subgraphs with operation for a and c
+        self.assertEqual(
+            sorted(subgraph.instance_id for subgraph in ctx._subgraph),
+            [u"subgrapha_id", u"subgraphb_id", u"subgraphc_id"])
+        subgraphs[u"subgrapha_id"].sequence().add.assert_called_once()
+        subgraphs[u"subgraphc_id"].sequence().add.assert_called_once()
+        subgraphs[u"subgraphb_id"].sequence().add.assert_not_called()
+        graph.add_dependency.assert_has_calls([
+            call(subgraphs[u"subgrapha_id"], subgraphs[u"subgraphb_id"]),
+            call(subgraphs[u"subgraphb_id"], subgraphs[u"subgraphc_id"])])
+
     def test_rollback_call(self):
         ctx = self._gen_ctx()
         instance_a = self.gen_mock_instance(ctx, u"starting")
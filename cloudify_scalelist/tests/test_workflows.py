@@ -13,15 +13,21 @@
 # limitations under the License.
 
 import json
+import time
+import threading
 import unittest
 from mock import Mock, patch, call
 
 from cloudify.state import current_ctx
 from cloudify.mocks import MockCloudifyContext
+from cloudify.workflows import tasks
 from cloudify.workflows.workflow_api import ExecutionCancelled
+from cloudify_rest_client.exceptions import CloudifyClientError
 
 import cloudify_scalelist.workflows as workflows
 
+from cloudify_common_sdk._compat import text_type
+
 # add filter check
 import cloudify_common_sdk.filters as filters
 
@@ -149,35 +155,148 @@ class TestScaleList(unittest.TestCase):
 
     def test_update_runtime_properties(self):
         client = self._gen_rest_client()
+        client.node_instances.list = Mock(
+            return_value=[client.node_instances.get()])
         with patch(
             "cloudify_scalelist.workflows.get_rest_client",
             Mock(return_value=client)
         ):
             workflows._update_runtime_properties(
                 self._gen_ctx(),
-                'target',
-                json.loads(json.dumps({'a': 'c'}))
+                {'target': json.loads(json.dumps({'a': 'c'}))}
             )
 
+        client.node_instances.list.assert_called_with(
+            deployment_id='deployment_id',
+            id=['target'],
+            _include=['id', 'version', 'runtime_properties'],
+            _get_all_results=True)
         client.node_instances.update.assert_called_with(
             node_instance_id='target',
             runtime_properties=json.loads(json.dumps({'a': 'c', 'd': 'e'})),
             version=2)
+
+    def test_update_runtime_properties_version_conflict(self):
+        client = self._gen_rest_client()
+        client.node_instances.list = Mock(return_value=[])
+        client.node_instances.update = Mock(side_effect=[
+            CloudifyClientError('conflict', status_code=409), None])
+        _ctx = self._gen_ctx()
+        with patch(
+            "cloudify_scalelist.workflows.get_rest_client",
+            Mock(return_value=client)
+        ):
+            workflows._update_runtime_properties(
+                _ctx, {'target': {'a': 'c'}})
+        self.assertEqual(client.node_instances.update.call_count, 2)
         client.node_instances.get.assert_called_with('target')
 
+        # any other error is not retried
+        client.node_instances.update = Mock(side_effect=[
+            CloudifyClientError('not found', status_code=404), None])
+        with patch(
+            "cloudify_scalelist.workflows.get_rest_client",
+            Mock(return_value=client)
+        ):
+            with self.assertRaises(CloudifyClientError):
+                workflows._update_runtime_properties(
+                    _ctx, {'target': {'a': 'c'}})
+        self.assertEqual(client.node_instances.update.call_count, 1)
+
+    def test_update_runtime_properties_bulk(self):
+        client = self._gen_rest_client()
+        instances = []
+        for i in range(50):
+            instance = Mock()
+            instance.id = 'id_{}'.format(i)
+            instance.version = i
+            instance.runtime_properties = {'a': 'b'}
+            instances.append(instance)
+        client.node_instances.list = Mock(return_value=instances)
+        with patch(
+            "cloudify_scalelist.workflows.get_rest_client",
+            Mock(return_value=client)
+        ):
+            workflows._update_runtime_properties(
+                self._gen_ctx(),
+                {instance.id: {'c': instance.id} for instance in instances},
+                workers=5)
+        client.node_instances.list.assert_called_once()
+        client.node_instances.get.assert_not_called()
+        self.assertEqual(client.node_instances.update.call_count, 50)
+        client.node_instances.update.assert_has_calls([
+            call(node_instance_id='id_7',
+                 runtime_properties={'a': 'b', 'c': 'id_7'},
+                 version=8)], any_order=True)
+
+    def test_get_node_instances_by_ids_chunks(self):
+        client = self._gen_rest_client()
+        instance_ids = ['id_{}'.format(i) for i in range(250)]
+
+        def _list(id, **kwargs):
+            instances = []
+            for instance_id in id:
+                instance = Mock()
+                instance.id = instance_id
+                instances.append(instance)
+            return instances
+
+        client.node_instances.list = Mock(side_effect=_list)
+        instances = workflows._get_node_instances_by_ids(
+            self._gen_ctx(), client, instance_ids, ['id'])
+        self.assertEqual(sorted(instances), sorted(instance_ids))
+        client.node_instances.list.assert_has_calls([
+            call(deployment_id='deployment_id',
+                 id=instance_ids[start:start + 100],
+                 _include=['id'],
+                 _get_all_results=True)
+            for start in [0, 100, 200]])
+        self.assertEqual(client.node_instances.list.call_count, 3)
+
+        # nothing requested without ids
+        client.node_instances.list.reset_mock()
+        self.assertEqual(workflows._get_node_instances_by_ids(
+            self._gen_ctx(), client, [], ['id']), {})
+        client.node_instances.list.assert_not_called()
+
     def test_cleanup_instances(self):
         client = self._gen_rest_client()
+        client.node_instances.list = Mock(
+            return_value=[client.node_instances.get()])
         with patch(
             "cloudify_scalelist.workflows.get_rest_client",
             Mock(return_value=client)
         ):
-            workflows._cleanup_instances(
-                self._gen_ctx(), ['target']
-            )
+            workflows._cleanup_instances(self._gen_ctx(), ['target'])
+        client.node_instances.list.assert_called_with(
+            deployment_id='deployment_id',
+            id=['target'],
+            _include=['id', 'version'],
+            _get_all_results=True)
         client.node_instances.update.assert_called_with(
             node_instance_id='target', state='uninitialized',
             runtime_properties={}, version=2)
-        client.node_instances.get.assert_called_with('target')
+
+    def test_cleanup_instances_failed(self):
+        client = self._gen_rest_client()
+        client.node_instances.list = Mock(return_value=[])
+
+        def _update(node_instance_id, **kwargs):
+            if node_instance_id in ['b', 'd']:
+                raise CloudifyClientError('Mistake', status_code=500)
+
+        client.node_instances.update = Mock(side_effect=_update)
+        with patch(
+            "cloudify_scalelist.workflows.get_rest_client",
+            Mock(return_value=client)
+        ):
+            with self.assertRaisesRegex(
+                    Exception,
+                    "Cleanup failed for 2 of 5 instances: .*'b'.*Mistake"):
+                workflows._cleanup_instances(
+                    self._gen_ctx(), ['a', 'b', 'c', 'd', 'e'], workers=3)
+        # all instances are processed
+        self.assertEqual(client.node_instances.update.call_count, 5)
 
     def test_empty_scaleup_params(self):
         with self.assertRaises(ValueError):
@@ -205,7 +324,7 @@ class TestScaleList(unittest.TestCase):
             )
             client.node_instances.list.assert_called_with(
                 _include=['runtime_properties', 'node_id', 'id'],
-                _get_all_results=True,
+                _offset=0, _size=1000, sort='id',
                 deployment_id='deployment_id')
         # only first page
         client.node_instances.list = Mock(return_value=[])
@@ -221,6 +340,7 @@ class TestScaleList(unittest.TestCase):
             )
             client.node_instances.list.assert_called_with(
                 _include=['runtime_properties', 'node_id', 'id'],
+                _offset=0, _size=1000, sort='id',
                 deployment_id='deployment_id')
 
     def test_scaleup_group_to_settings(self):
@@ -333,7 +453,7 @@ class TestScaleList(unittest.TestCase):
                 json.loads(json.dumps({'one': [{'name': 'one'}]})),
                 '_transaction',
                 'transaction_value', False, False, node_sequence=None,
-                rollback_on_failure=True)
+                rollback_on_failure=True, update_workers=10)
             # can downscale without errors, ignore failure
             fake_run_scale = Mock(return_value=None)
             with patch(
@@ -353,7 +473,307 @@ class TestScaleList(unittest.TestCase):
                 json.loads(json.dumps({'one': [{'name': 'one'}]})),
                 '_transaction',
                 'transaction_value', False, True, node_sequence=None,
-                rollback_on_failure=True)
+                rollback_on_failure=True, update_workers=10)
+
+    def test_scaleuplist_waves(self):
+        _ctx = self._gen_ctx()
+        _ctx._execution_id = 'execution_id'
+
+        client = self._gen_rest_client()
+        scalable_entity_properties = {
+            'one': [{'name': 'one{}'.format(i)} for i in range(5)],
+        }
+        with patch(
+            "cloudify_scalelist.workflows.get_rest_client",
+            Mock(return_value=client)
+        ):
+            fake_run_scale = Mock(return_value=None)
+            with patch(
+                "cloudify_scalelist.workflows._run_scale_settings",
+                fake_run_scale
+            ):
+                workflows.scaleuplist(
+                    ctx=_ctx,
+                    scale_transaction_field="_transaction",
+                    scalable_entity_properties=scalable_entity_properties,
+                    wave_size=2)
+        # one modification for each wave, started from same current count
+        fake_run_scale.assert_has_calls([
+            call(_ctx, {'one_scale': {'instances': instances}},
+                 scalable_entity_properties, '_transaction', 'execution_id',
+                 False, True, node_sequence=None, rollback_on_failure=True,
+                 update_workers=10)
+            for instances in [12, 14, 15]])
+        self.assertEqual(fake_run_scale.call_count, 3)
+
+        # failed wave stops scale
+        fake_run_scale = Mock(side_effect=[None, Exception('Failed wave')])
+        with patch(
+            "cloudify_scalelist.workflows.get_rest_client",
+            Mock(return_value=client)
+        ):
+            with patch(
+                "cloudify_scalelist.workflows._run_scale_settings",
+                fake_run_scale
+            ):
+                with self.assertRaisesRegex(Exception, "Failed wave"):
+                    workflows.scaleuplist(
+                        ctx=_ctx,
+                        scale_transaction_field="_transaction",
+                        scale_transaction_value="value",
+                        scalable_entity_properties=scalable_entity_properties,
+                        wave_size=2)
+        self.assertEqual(fake_run_scale.call_count, 2)
+
+    def _gen_modification_instance(self, instance_id, node_id, modification):
+        instance = Mock()
+        instance.id = instance_id
+        instance._node_instance.id = instance_id
+        instance._node_instance.node_id = node_id
+        instance.modification = modification
+        return instance
+
+    def _gen_plan_node(self, node_id, operations, relationships=None):
+        node = Mock()
+        node.id = node_id
+        node.has_operation = lambda name: name in operations
+        node.relationships = relationships or []
+        node.instances = []
+        return node
+
+    def _gen_plan_instance(self, node, instance_id, groups=None,
+                           targets=None, host=None):
+        instance = Mock()
+        instance.id = instance_id
+        instance.node_id = node.id
+        instance.node = node
+        instance.scaling_groups = groups or []
+        instance.relationships = [
+            Mock(target_id=target_id) for target_id in targets or []]
+        instance.contained = []
+        instance.get_contained_subgraph = lambda: set([instance]).union(
+            *[child.get_contained_subgraph()
+              for child in instance.contained])
+        if host:
+            host.contained.append(instance)
+        node.instances.append(instance)
+        return instance
+
+    def _gen_plan_ctx(self):
+        _ctx = self._gen_ctx()
+        relationship = Mock()
+        relationship.source_operations = {
+            'cloudify.interfaces.relationship_lifecycle.establish': {
+                'operation': 'a.b'},
+            'cloudify.interfaces.relationship_lifecycle.unlink': {
+                'operation': 'a.c'}}
+        relationship.target_operations = {}
+        relationship.target_id = u'one'
+        one = self._gen_plan_node(u'one', [
+            'cloudify.interfaces.lifecycle.create',
+            'cloudify.interfaces.lifecycle.start',
+            'cloudify.interfaces.lifecycle.stop',
+            'cloudify.interfaces.lifecycle.delete'])
+        two = self._gen_plan_node(u'two', [
+            'cloudify.interfaces.lifecycle.start',
+            'cloudify.interfaces.lifecycle.delete'])
+        three = self._gen_plan_node(u'three', [
+            'cloudify.interfaces.lifecycle.configure'], [relationship])
+        one_1 = self._gen_plan_instance(
+            one, u'one_1', [{'name': 'one_scale', 'id': 'g1'}])
+        one_2 = self._gen_plan_instance(
+            one, u'one_2', [{'name': 'one_scale', 'id': 'g2'}])
+        self._gen_plan_instance(two, u'two_1', host=one_1)
+        self._gen_plan_instance(two, u'two_2', host=one_2)
+        self._gen_plan_instance(three, u'three_1', targets=[u'one_1'])
+        self._gen_plan_instance(three, u'three_2', targets=[u'one_2'])
+        nodes = {node.id: node for node in [one, two, three]}
+        _ctx.nodes = list(nodes.values())
+        _ctx.get_node = Mock(side_effect=nodes.get)
+        _ctx.deployment.scaling_groups = {
+            'one_scale': {
+                'members': ['one'],
+                'properties': {'current_instances': 2}}}
+        return _ctx
+
+    def test_plan_scale_settings(self):
+        _ctx = self._gen_plan_ctx()
+        plan = workflows._plan_scale_settings(
+            _ctx, {'one_scale': {'instances': 4}, 'three': {'instances': 3}},
+            {'one': [{'name': 'a1'}]},
+            scale_transaction_field=u'_transaction')
+
+        # deployment is not changed
+        _ctx.deployment.start_modification.assert_not_called()
+        # each group instance has instance of one and contained two
+        self.assertEqual(plan['instances'], {
+            'added': {u'one': 2, u'two': 2, u'three': 1},
+            'removed': [],
+            'related': 0})
+        # one: create, start; two: start; three: configure, establish
+        self.assertEqual(plan['operations'], {'install': 8, 'uninstall': 0})
+        # new three depends on new one
+        self.assertEqual(plan['graph'], {
+            'subgraphs': 5,
+            'dependencies': {'levels': 0, 'relationships': 1}})
+        self.assertEqual(plan['rest_calls'], {
+            'modification': 3,
+            'runtime_properties': 6,
+            'cleanup': 0,
+            'operations': 24})
+        self.assertEqual(sorted(plan['timings']), ['plan'])
+
+    def test_plan_scale_settings_remove(self):
+        _ctx = self._gen_plan_ctx()
+        # proposed instance is contained in second group instance
+        plan = workflows._plan_scale_settings(
+            _ctx, {'one_scale': {'instances': 1,
+                                 'removed_ids_include_hint': [u'two_2']}},
+            {})
+        _ctx.deployment.start_modification.assert_not_called()
+        self.assertEqual(plan['instances'], {
+            'added': {},
+            'removed': [u'one_2', u'two_2'],
+            'related': 1})
+        # one: stop, delete; two: delete
+        self.assertEqual(plan['operations'], {'install': 0, 'uninstall': 3})
+        # related three_2 depends on removed one_2
+        self.assertEqual(plan['graph'], {
+            'subgraphs': 3,
+            'dependencies': {'levels': 0, 'relationships': 1}})
+        self.assertEqual(plan['rest_calls'], {
+            'modification': 3,
+            'runtime_properties': 0,
+            'cleanup': 3,
+            'operations': 9})
+
+        # without proposed instances any instance is removed
+        plan = workflows._plan_scale_settings(
+            _ctx, {'three': {'instances': 1}}, {})
+        self.assertEqual(plan['instances']['removed'], [u'three_1'])
+        self.assertEqual(plan['instances']['related'], 1)
+
+    def test_plan_scale_settings_node_sequence(self):
+        _ctx = self._gen_plan_ctx()
+        # 4 new instances on each level: 4+4 dependencies by barrier
+        plan = workflows._plan_scale_settings(
+            _ctx, {'one_scale': {'instances': 6}}, {},
+            node_sequence=[u'one', u'two'])
+        self.assertEqual(plan['instances']['added'], {u'one': 4, u'two': 4})
+        self.assertEqual(plan['graph'], {
+            'subgraphs': 9,
+            'dependencies': {'levels': 8, 'relationships': 0}})
+
+        # one instance on each level: direct dependency
+        plan = workflows._plan_scale_settings(
+            _ctx, {'one_scale': {'instances': 3}}, {},
+            node_sequence=[u'one', u'two'])
+        self.assertEqual(plan['graph'], {
+            'subgraphs': 2,
+            'dependencies': {'levels': 1, 'relationships': 0}})
+
+        # same numbers as in graph created by _process_node_instances
+        graph = Mock()
+        added = (
+            [self._gen_modification_instance(
+                u'one_{}'.format(i), u'one', 'added') for i in range(4)] +
+            [self._gen_modification_instance(
+                u'two_{}'.format(i), u'two', 'added') for i in range(4)])
+        workflows._process_node_instances(
+            _ctx, graph, added, False, Mock(), [u'one', u'two'],
+            execute=False)
+        self.assertEqual(graph.subgraph.call_count, 1)
+        self.assertEqual(graph.add_dependency.call_count, 8)
+
+        # removed instances are processed in reversed order
+        plan = workflows._plan_scale_settings(
+            _ctx, {'one_scale': {'instances': 1,
+                                 'removed_ids_include_hint': [u'two_2']}},
+            {}, node_sequence=[u'one', u'two'])
+        self.assertEqual(plan['graph'], {
+            'subgraphs': 2,
+            'dependencies': {'levels': 1, 'relationships': 0}})
+
+    def test_scaleuplist_dry_run(self):
+        _ctx = self._gen_ctx()
+
+        client = self._gen_rest_client()
+        scalable_entity_properties = {
+            'one': [{'name': 'one{}'.format(i)} for i in range(5)],
+        }
+        plan = {
+            'timings': {},
+            'rest_calls': {'modification': 3, 'tasks': 30}
+        }
+        fake_plan_scale = Mock(return_value=plan)
+        fake_run_scale = Mock(return_value=None)
+        with patch(
+            "cloudify_scalelist.workflows.get_rest_client",
+            Mock(return_value=client)
+        ):
+            with patch(
+                "cloudify_scalelist.workflows._run_scale_settings",
+                fake_run_scale
+            ):
+                with patch(
+                    "cloudify_scalelist.workflows._plan_scale_settings",
+                    fake_plan_scale
+                ):
+                    result = workflows.scaleuplist(
+                        ctx=_ctx,
+                        scale_transaction_field="_transaction",
+                        scalable_entity_properties=scalable_entity_properties,
+                        wave_size=2,
+                        dry_run=True)
+        fake_run_scale.assert_not_called()
+        # full scale is checked in one modification
+        fake_plan_scale.assert_called_once_with(
+            _ctx, {'one_scale': {'instances': 15}},
+            scalable_entity_properties, '_transaction', node_sequence=None)
+        self.assertIs(result, plan)
+        # modification for each of 3 waves and scaling groups
+        self.assertEqual(result['rest_calls']['modification'], 9)
+        self.assertEqual(result['rest_calls']['total'], 40)
+        self.assertEqual(result['waves'], [
+            {'one_scale': {'instances': instances}}
+            for instances in [12, 14, 15]])
+        self.assertIn('scale_list', result['timings'])
+
+    def test_scaledownlist_dry_run(self):
+        _ctx = self._gen_ctx()
+
+        client = self._gen_rest_client()
+        plan = {
+            'timings': {},
+            'rest_calls': {'modification': 3, 'cleanup': 2}
+        }
+        fake_plan_scale = Mock(return_value=plan)
+        fake_run_scale = Mock(return_value=None)
+        with patch(
+            "cloudify_scalelist.workflows.get_rest_client",
+            Mock(return_value=client)
+        ):
+            with patch(
+                "cloudify_scalelist.workflows._run_scale_settings",
+                fake_run_scale
+            ):
+                with patch(
+                    "cloudify_scalelist.workflows._plan_scale_settings",
+                    fake_plan_scale
+                ):
+                    result = workflows.scaledownlist(
+                        ctx=_ctx,
+                        scale_transaction_field=u'_transaction',
+                        scale_node_name=u"a_type", scale_node_field=u"name",
+                        scale_node_field_value=u"value",
+                        dry_run=True)
+        fake_run_scale.assert_not_called()
+        self.assertEqual(fake_plan_scale.call_count, 1)
+        self.assertIs(result, plan)
+        # scaling groups and one page of instances
+        self.assertEqual(result['rest_calls']['scale_list'], 2)
+        self.assertEqual(result['rest_calls']['total'], 7)
+        self.assertIn('scale_list', result['timings'])
 
     def test_run_scale_settings(self):
         _ctx = self._gen_ctx()
@@ -492,7 +912,8 @@ class TestScaleList(unittest.TestCase):
                     removed=set([added_instance]),
                     related=set([related_instance]),
                     ignore_failure=False,
-                    node_sequence=None)
+                    node_sequence=None,
+                    update_workers=10)
             fake_install_node_instances.assert_called_with(
                 graph=_ctx.graph_mode(),
                 node_instances=set([added_instance]),
@@ -675,9 +1096,9 @@ class TestScaleList(unittest.TestCase):
                             scale_transaction_field='_transaction'
                         )
                     fake_update_instances.assert_called_with(
-                        _ctx, "a",
-                        json.loads(json.dumps(
-                            {'c': 'f', '_transaction': 'transaction_id'})))
+                        _ctx, {"a": json.loads(json.dumps(
+                            {'c': 'f', '_transaction': 'transaction_id'}))},
+                        workers=10)
                 fake_uninstall_instances.assert_not_called()
             fake_install_node_instances.assert_called_with(
                 graph=_ctx.graph_mode(),
@@ -734,9 +1155,9 @@ class TestScaleList(unittest.TestCase):
                             scale_transaction_value='value'
                         )
                     fake_update_instances.assert_called_with(
-                        _ctx, "a",
-                        json.loads(json.dumps(
-                            {'c': 'f', '_transaction': 'value'})))
+                        _ctx, {"a": json.loads(json.dumps(
+                            {'c': 'f', '_transaction': 'value'}))},
+                        workers=10)
                 fake_uninstall_instances.assert_not_called()
             fake_install_node_instances.assert_called_with(
                 graph=_ctx.graph_mode(),
@@ -793,7 +1214,8 @@ class TestScaleList(unittest.TestCase):
                             node_sequence=[u'a', u'b']
                         )
                     fake_update_instances.assert_called_with(
-                        _ctx, "a", {'c': 'f', '_transaction': 'value'})
+                        _ctx, {"a": {'c': 'f', '_transaction': 'value'}},
+                        workers=10)
                 fake_uninstall_instances.assert_not_called()
 
             call_func = workflows.lifecycle.install_node_instance_subgraph
@@ -838,6 +1260,103 @@ class TestScaleList(unittest.TestCase):
             call(added_instance, graph, ignore_failure=False),
             call(related_instance, graph, ignore_failure=False)])
 
+    def test_wait_for_sent_tasks_benchmark(self):
+        _ctx = self._gen_ctx()
+
+        class FakeTask(object):
+            def __init__(self, task_id, state):
+                self.id = task_id
+                self.state = state
+                self.state_calls = 0
+
+            def get_state(self):
+                self.state_calls += 1
+                return self.state
+
+        class FakeGraph(object):
+            def __init__(self, graph_tasks):
+                self.tasks = graph_tasks
+                self._tasks_wait = threading.Event()
+                self._finished_tasks = {}
+
+            def _handle_terminated_task(self, result, task):
+                task.state = tasks.TASK_SUCCEEDED
+
+            def finish(self, task):
+                self._finished_tasks[task] = 'result'
+                self._tasks_wait.set()
+
+        graph_tasks = [FakeTask('task_{}'.format(i), tasks.TASK_PENDING)
+                       for i in range(10000)]
+        sent_tasks = graph_tasks[::1000]
+        for task in sent_tasks:
+            task.state = tasks.TASK_SENT
+        graph = FakeGraph(graph_tasks)
+
+        def _finish_tasks():
+            for task in sent_tasks:
+                time.sleep(0.01)
+                graph.finish(task)
+
+        finisher = threading.Thread(target=_finish_tasks)
+        with patch(
+            "cloudify.workflows.api.has_cancel_request",
+            return_value=False
+        ):
+            start_time = time.time()
+            finisher.start()
+            workflows._wait_for_sent_tasks(_ctx, graph)
+            wait_time = time.time() - start_time
+        finisher.join()
+        _ctx.logger.debug("Waited {} seconds".format(wait_time))
+
+        # woken up by results, not by deadline
+        self.assertLess(wait_time, _ctx.wait_after_fail)
+        self.assertFalse(graph._finished_tasks)
+        for task in sent_tasks:
+            self.assertEqual(task.state, tasks.TASK_SUCCEEDED)
+        # tasks in other states are checked only once
+        self.assertTrue(all(task.state_calls == 1 for task in graph_tasks
+                            if task not in sent_tasks))
+
+    def test_process_node_instances_barrier(self):
+        _ctx = self._gen_ctx()
+
+        class FakeInstance(object):
+            def __init__(self, node_id, index):
+                self.id = '{}_{}'.format(node_id, index)
+                self._node_instance = Mock()
+                self._node_instance.node_id = node_id
+
+        for size in [3, 10, 1000]:
+            graph = Mock()
+            graph.subgraph = Mock(return_value='barrier')
+            node_instances = (
+                [FakeInstance('type_a', i) for i in range(size)] +
+                [FakeInstance('type_b', i) for i in range(size)])
+            start_time = time.time()
+            workflows._process_node_instances(
+                ctx=_ctx,
+                graph=graph,
+                ignore_failure=False,
+                node_instances=node_instances,
+                node_instance_subgraph_func=lambda instance, graph,
+                ignore_failure: instance.id,
+                node_sequence=["type_a", "type_b"])
+            _ctx.logger.debug(
+                "{0}x{0} levels: {1} dependencies instead of {2} in {3} "
+                "seconds".format(size, graph.add_dependency.call_count,
+                                 size * size, time.time() - start_time))
+            # linear count of dependencies
+            self.assertEqual(graph.add_dependency.call_count, size * 2)
+            graph.subgraph.assert_called_once_with('scale_level_type_b')
+            graph.add_dependency.assert_has_calls([
+                call('type_a_0', 'barrier'),
+                call('type_a_1', 'barrier'),
+                call('barrier', 'type_b_0'),
+                call('barrier', 'type_b_1')], any_order=True)
+            graph.execute.assert_called_once_with()
+
     def test_scaledownlist_with_anytype_and_without_transaction(self):
         _ctx = self._gen_ctx()
 
@@ -868,7 +1387,27 @@ class TestScaleList(unittest.TestCase):
                 instances_remove_ids=[u'a_id'],
                 ignore_failure=False,
                 node_sequence=None,
-                rollback_on_failure=True)
+                rollback_on_failure=True,
+                update_workers=10)
+
+    def test_scaledownlist_page_size(self):
+        _ctx = self._gen_ctx()
+        client = self._gen_rest_client()
+        client.node_instances.list = Mock(return_value=[])
+        with patch(
+            "cloudify_scalelist.workflows.get_rest_client",
+            Mock(return_value=client)
+        ):
+            for page_size in [0, -1]:
+                with self.assertRaisesRegex(ValueError, "`page_size`"):
+                    workflows.scaledownlist(
+                        ctx=_ctx,
+                        scale_node_field=u"name",
+                        scale_node_field_value=[u"value"],
+                        all_results=True,
+                        dry_run=True,
+                        page_size=page_size)
+        client.node_instances.list.assert_not_called()
 
     def test_scaledownlist(self):
         _ctx = self._gen_ctx()
@@ -930,7 +1469,8 @@ class TestScaleList(unittest.TestCase):
                     graph=_ctx.graph_mode(),
                     removed=[a_instance, b_instance],
                     related=[],
-                    ignore_failure=False, node_sequence=None)
+                    ignore_failure=False, node_sequence=None,
+                    update_workers=10)
             # function params can be different between python versions,
             # check only count of calls
             self.assertTrue(fake_run_scale.call_count == 1)
@@ -1008,6 +1548,29 @@ class TestScaleList(unittest.TestCase):
                     }
                 })
 
+    def test_get_scale_list_groups_index(self):
+        _ctx = self._gen_ctx()
+        client = self._gen_rest_client()
+        with patch(
+            "cloudify_scalelist.workflows.get_rest_client",
+            Mock(return_value=client)
+        ):
+            self.assertEqual(
+                workflows._get_scale_list(
+                    ctx=_ctx,
+                    scalable_entity_properties={
+                        'a_type': ['a_id'],
+                        'three': ['three_id']
+                    },
+                    property_type=text_type),
+                {
+                    'alfa_types': {'count': 1, 'values': ['a_id']},
+                    'three': {'count': 1, 'values': ['three_id']}
+                })
+        # groups are requested once for all nodes
+        client.deployments.get.assert_called_once_with(
+            'deployment_id', _include=['groups'])
+
     def test_scaledown_group_to_settings(self):
         # scale groups names
         _ctx = self._gen_ctx()
@@ -1095,6 +1658,60 @@ class TestScaleList(unittest.TestCase):
                     False
                 )
 
+    def test_iter_node_instances(self):
+        client = Mock()
+        pages = [[u'a', u'b'], [u'c', u'd'], [u'e']]
+        client.node_instances.list = Mock(side_effect=pages)
+        instances = workflows._iter_node_instances(
+            client, page_size=2, deployment_id=u'deployment_id',
+            _include=[u'id'])
+        # nothing requested before use
+        client.node_instances.list.assert_not_called()
+        self.assertEqual(list(instances), [u'a', u'b', u'c', u'd', u'e'])
+        client.node_instances.list.assert_has_calls([
+            call(_offset=offset, _size=2, sort='id',
+                 deployment_id=u'deployment_id', _include=[u'id'])
+            for offset in [0, 2, 4]])
+
+        # full last page, one more request for check
+        client.node_instances.list = Mock(side_effect=[[u'a', u'b'], []])
+        self.assertEqual(
+            list(workflows._iter_node_instances(client, page_size=2)),
+            [u'a', u'b'])
+        self.assertEqual(client.node_instances.list.call_count, 2)
+
+        # only first page
+        client.node_instances.list = Mock(side_effect=pages)
+        self.assertEqual(
+            list(workflows._iter_node_instances(client, page_size=2,
+                                                all_results=False)),
+            [u'a', u'b'])
+        self.assertEqual(client.node_instances.list.call_count, 1)
+
+    def test_get_transaction_instances_pages(self):
+        _ctx = self._gen_ctx()
+        client = self._gen_rest_client()
+        instances = client.node_instances.list()
+        client.node_instances.list = Mock(
+            side_effect=[instances[:2], instances[2:], []])
+        with patch(
+            "cloudify_scalelist.workflows.get_rest_client",
+            Mock(return_value=client)
+        ):
+            self.assertEqual(
+                workflows._get_transaction_instances(
+                    ctx=_ctx,
+                    all_results=True,
+                    page_size=2,
+                    scale_transaction_field=u'_transaction',
+                    scale_node_names=None,
+                    scale_node_field_path=[u"name"],
+                    scale_node_field_values=[u"value"]
+                ), ({u'a_type': [u'a_id'], u'b_type': [u'b_id']},
+                    [u'a_id', u'b_id'])
+            )
+        self.assertEqual(client.node_instances.list.call_count, 3)
+
     def test_get_transaction_instances_nosuch(self):
         _ctx = self._gen_ctx()
         client = self._gen_rest_client()
@@ -1116,7 +1733,7 @@ class TestScaleList(unittest.TestCase):
             )
             client.node_instances.list.assert_called_with(
                 _include=['runtime_properties', 'node_id', 'id'],
-                _get_all_results=True,
+                _offset=0, _size=1000, sort='id',
                 deployment_id='deployment_id')
         # get only first page
         client.node_instances.list = Mock(return_value=[])
@@ -1135,6 +1752,7 @@ class TestScaleList(unittest.TestCase):
             )
             client.node_instances.list.assert_called_with(
                 _include=['runtime_properties', 'node_id', 'id'],
+                _offset=0, _size=1000, sort='id',
                 deployment_id='deployment_id')
 
     def test_get_transaction_instances_notransaction(self):
@@ -1164,7 +1782,7 @@ class TestScaleList(unittest.TestCase):
             )
             client.node_instances.list.assert_called_with(
                 _include=['runtime_properties', 'node_id', 'id'],
-                _get_all_results=True,
+                _offset=0, _size=1000, sort='id',
                 deployment_id='deployment_id')
         # get only first page
         client.node_instances.list = Mock(return_value=[instance_a])
@@ -1182,6 +1800,7 @@ class TestScaleList(unittest.TestCase):
             )
             client.node_instances.list.assert_called_with(
                 _include=['runtime_properties', 'node_id', 'id'],
+                _offset=0, _size=1000, sort='id',
                 deployment_id='deployment_id')
 
     def test_get_transaction_instances_notransaction_field(self):
@@ -1211,7 +1830,7 @@ class TestScaleList(unittest.TestCase):
             )
             client.node_instances.list.assert_called_with(
                 _include=[u'runtime_properties', u'node_id', u'id'],
-                _get_all_results=True,
+                _offset=0, _size=1000, sort='id',
                 deployment_id=u'deployment_id')
         # get only first page
         client.node_instances.list = Mock(return_value=[instance_a])
@@ -1229,6 +1848,7 @@ class TestScaleList(unittest.TestCase):
             )
             client.node_instances.list.assert_called_with(
                 _include=[u'runtime_properties', u'node_id', u'id'],
+                _offset=0, _size=1000, sort='id',
                 deployment_id=u'deployment_id')
 
     def test_get_transaction_instances(self):
@@ -1252,6 +1872,47 @@ class TestScaleList(unittest.TestCase):
                 }, [u'a_id', u'b_id'])
             )
 
+    def test_get_transaction_instances_benchmark(self):
+        _ctx = self._gen_ctx()
+
+        class FakeInstance(object):
+            def __init__(self, index):
+                self.id = u'id_{}'.format(index)
+                self.node_id = u'type_{}'.format(index % 3)
+                self.runtime_properties = {
+                    u'name': u'value' if index % 100 == 0 else u'other',
+                    u'_transaction': u'tr_{}'.format(index // 10)
+                }
+
+        for size in [1000, 10000, 100000]:
+            client = self._gen_rest_client()
+            client.node_instances.list = Mock(
+                return_value=[FakeInstance(i) for i in range(size)])
+            with patch(
+                u"cloudify_scalelist.workflows.get_rest_client",
+                Mock(return_value=client)
+            ):
+                start_time = time.time()
+                node_instances, instance_ids = \
+                    workflows._get_transaction_instances(
+                        ctx=_ctx,
+                        scale_transaction_field=u'_transaction',
+                        scale_node_names=None,
+                        scale_node_field_path=[u"name"],
+                        scale_node_field_values=[u"value"])
+                _ctx.logger.debug("{} instances filtered in {} seconds"
+                                  .format(size, time.time() - start_time))
+            # instances are listed only once
+            self.assertEqual(client.node_instances.list.call_count, 1)
+            # every 100th instance matched with 9 transaction peers
+            self.assertEqual(len(instance_ids), size // 10)
+            self.assertEqual(len(set(instance_ids)), size // 10)
+            self.assertEqual(instance_ids[:3],
+                             [u'id_0', u'id_100', u'id_200'])
+            self.assertEqual(
+                sum(len(node_instances[k]) for k in node_instances),
+                size // 10)
+
     def test_uninstall_instances_relationships(self):
         _ctx = self._gen_ctx()
         a_instance = Mock()
@@ -1282,7 +1943,8 @@ class TestScaleList(unittest.TestCase):
                                                [c_instance],
                                                True,
                                                node_sequence=[])
-            fake_cleanup_instances.assert_called_with(_ctx, [u"a_id", u"b_id"])
+            fake_cleanup_instances.assert_called_with(
+                _ctx, [u"a_id", u"b_id"], workers=10)
         fake_uninstall_node_instances.assert_called_with(
             graph=_ctx.graph_mode(),
             node_instances=[a_instance, b_instance],
@@ -1322,7 +1984,8 @@ class TestScaleList(unittest.TestCase):
                                                [c_instance],
                                                True,
                                                node_sequence=[u'a', u'b'])
-            fake_cleanup_instances.assert_called_with(_ctx, [u"a_id", u"b_id"])
+            fake_cleanup_instances.assert_called_with(
+                _ctx, [u"a_id", u"b_id"], workers=10)
 
         call_func = workflows.lifecycle.uninstall_node_instance_subgraph
         fake_process_node_instances.assert_called_with(
@@ -1375,6 +2038,103 @@ class TestScaleList(unittest.TestCase):
                 logger, u'a', [u'1', u'a'])
         )
 
+    def test_compile_field_path(self):
+        logger = Mock()
+        for properties, path in [
+            ([u'a'], [u'0']),
+            ([u'a'], [u'1']),
+            ([u'a'], [u'a']),
+            ({u'0': u'a'}, [u'0']),
+            ({u'0': u'a'}, [u'1']),
+            ([{u'a': u'b'}], [u'0', u'a']),
+            ([{u'a': [1, 2]}], [u'-1', u'a', 1]),
+            (u'a', [u'1', u'a']),
+            ({u'a': u'b'}, []),
+            ({u'a': u'b'}, None),
+        ]:
+            self.assertEqual(
+                workflows._compile_field_path(path)(properties),
+                filters.get_field_value_recursive(logger, properties, path)
+            )
+
+    def test_compile_values_matcher(self):
+        match = workflows._compile_values_matcher(
+            [u'a', 1, {u'b': u'c'}, [u'd']])
+        self.assertTrue(match(u'a'))
+        self.assertTrue(match(1))
+        self.assertTrue(match({u'b': u'c'}))
+        self.assertTrue(match([u'd']))
+        self.assertFalse(match(u'b'))
+        self.assertFalse(match(None))
+        self.assertFalse(match({u'b': u'd'}))
+        self.assertFalse(match([]))
+        # no values at all
+        self.assertFalse(workflows._compile_values_matcher(None)(u'a'))
+
+    def test_filter_node_instances_benchmark(self):
+        _ctx = self._gen_ctx()
+        logger = Mock()
+
+        def _filter_by_recursive(nodes, node_field_path, node_field_value):
+            # previous implementation, walk path for each instance
+            result = []
+            for node in nodes:
+                for instance in node.instances:
+                    properties = instance._node_instance.runtime_properties
+                    value = filters.get_field_value_recursive(
+                        logger, properties, node_field_path)
+                    if value in node_field_value:
+                        result.append(instance)
+            return result
+
+        class FakeNodeInstance(object):
+            def __init__(self, index):
+                self.runtime_properties = {
+                    u'a': [{u'b': u'value_{}'.format(index % 1000)}]
+                }
+
+        class FakeInstance(object):
+            def __init__(self, index):
+                self.id = u'id_{}'.format(index)
+                self.state = u'started'
+                self._node_instance = FakeNodeInstance(index)
+
+        class FakeNode(object):
+            def __init__(self, index, size):
+                self.id = u'node_{}'.format(index)
+                self.operations = [u'a.b.c']
+                self.type_hierarchy = [u'a_type']
+                self.instances = [FakeInstance(index * size + i)
+                                  for i in range(size)]
+
+        node_field_path = [u'a', u'0', u'b']
+        node_field_value = [u'value_{}'.format(i) for i in range(0, 1000, 10)]
+        node_field_value.append({u'unhashable': u'value'})
+        _ctx.nodes = [FakeNode(i, 10000) for i in range(10)]
+
+        start_time = time.time()
+        expected = _filter_by_recursive(_ctx.nodes, node_field_path,
+                                        node_field_value)
+        recursive_time = time.time() - start_time
+
+        start_time = time.time()
+        filtered = workflows._filter_node_instances(
+            ctx=_ctx,
+            node_ids=[],
+            node_instance_ids=[],
+            type_names=[],
+            operation=u'a.b.c',
+            node_field_path=node_field_path,
+            node_field_value=node_field_value)
+        compiled_time = time.time() - start_time
+
+        _ctx.logger.debug("100000 instances filtered in {} seconds, "
+                          "previously {} seconds"
+                          .format(compiled_time, recursive_time))
+        # every 10th instance matched
+        self.assertEqual(len(filtered), 10000)
+        self.assertEqual(filtered, expected)
+
     def test_filter_node_instances(self):
         # everything empty
         _ctx = self._gen_ctx()
@@ -13,16 +13,20 @@
 # limitations under the License.
 
 import time
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from cloudify.workflows import api
 from cloudify.workflows import tasks
 from cloudify.plugins import lifecycle
 from cloudify.decorators import workflow
 from cloudify.manager import get_rest_client
+from cloudify_rest_client.exceptions import CloudifyClientError
 
 from cloudify_common_sdk._compat import text_type
-from cloudify_common_sdk.filters import (get_field_value_recursive,
-                                         obfuscate_passwords, )
+from cloudify_common_sdk.filters import obfuscate_passwords
 
 
 IGNORED_STATES = ['uninitialized', 'stopped', 'deleting', 'deleted']
@@ -33,40 +37,191 @@ IGNORED_OPS = [
     'cloudify.interfaces.lifecycle.delete',
     'cloudify.interfaces.lifecycle.postdelete'
 ]
+# parallel node instances updates
+UPDATE_WORKERS = 10
+VERSION_CONFLICT_RETRIES = 5
+# wait for sent tasks with backoff, graph event wakes up wait on results
+WAIT_TASKS_MIN_DELAY = 0.1
+WAIT_TASKS_MAX_DELAY = 2
+INSTANCES_PAGE_SIZE = 1000
+# instance ids sent in one list request, all ids are part of query string
+INSTANCES_IDS_CHUNK_SIZE = 100
+# task state updates: sent, started, terminated
+REST_CALLS_PER_TASK = 3
+# operations called for each instance, used for estimate of scale in plan
+INSTALL_OPERATIONS = [
+    'cloudify.interfaces.validation.create',
+    'cloudify.interfaces.lifecycle.precreate',
+    'cloudify.interfaces.lifecycle.create',
+    'cloudify.interfaces.lifecycle.configure',
+    'cloudify.interfaces.lifecycle.start',
+    'cloudify.interfaces.lifecycle.poststart',
+]
+INSTALL_RELATIONSHIP_OPERATIONS = [
+    'cloudify.interfaces.relationship_lifecycle.preconfigure',
+    'cloudify.interfaces.relationship_lifecycle.postconfigure',
+    'cloudify.interfaces.relationship_lifecycle.establish',
+]
+UNINSTALL_OPERATIONS = [
+    'cloudify.interfaces.validation.delete',
+    'cloudify.interfaces.lifecycle.prestop',
+    'cloudify.interfaces.lifecycle.stop',
+    'cloudify.interfaces.lifecycle.delete',
+    'cloudify.interfaces.lifecycle.postdelete',
+]
+UNINSTALL_RELATIONSHIP_OPERATIONS = [
+    'cloudify.interfaces.relationship_lifecycle.unlink',
+]
+
+
+def _is_version_conflict(ex):
+    return isinstance(ex, CloudifyClientError) and ex.status_code == 409
+
+
+def _get_node_instances_by_ids(ctx, client, instance_ids, include,
+                               chunk_size=INSTANCES_IDS_CHUNK_SIZE):
+    # one list call for each chunk of ids instead of get for each instance,
+    # chunks keep query string short enough for manager and proxies
+    instance_ids = list(instance_ids)
+    instances = {}
+    for start in range(0, len(instance_ids), chunk_size):
+        for instance in client.node_instances.list(
+                deployment_id=ctx.deployment.id,
+                id=instance_ids[start:start + chunk_size],
+                _include=include,
+                _get_all_results=True):
+            instances[instance.id] = instance
+    return instances
+
+
+def _iter_node_instances(client, page_size=INSTANCES_PAGE_SIZE,
+                         all_results=True, **list_kwargs):
+    # yield instances page by page, so only one page of instances is kept
+    # in memory, without all_results only first page is returned
+    offset = 0
+    while True:
+        page = client.node_instances.list(_offset=offset, _size=page_size,
+                                          sort='id', **list_kwargs)
+        page_items = len(page)
+        for instance in page:
+            yield instance
+        # release page before request for next one
+        del page
+        offset += page_items
+        if not all_results or page_items < page_size:
+            return
+
+
+def _run_in_pool(func, items, workers):
+    # run func for each item, results are returned in items order
+    items = list(items)
+    if not items:
+        return []
+    workers = max(1, min(int(workers or 1), len(items)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
+
+
+def _update_node_instance(ctx, manager, instance_id, resulted_state,
+                          get_update_kwargs, debug_states=False):
+    # resulted_state - prefetched instance state, can be None
+    # get_update_kwargs - callback with changes for current state of instance
+    for retry in range(VERSION_CONFLICT_RETRIES):
+        # instance is not in list or has been changed by someone else
+        if not resulted_state:
+            resulted_state = manager.node_instances.get(instance_id)
+        if debug_states:
+            ctx.logger.debug(
+                'State before update: {}'
+                .format(repr(obfuscate_passwords(resulted_state))))
+        try:
+            manager.node_instances.update(
+                node_instance_id=instance_id,
+                version=resulted_state.version + 1,
+                **get_update_kwargs(resulted_state))
+        except CloudifyClientError as ex:
+            if not _is_version_conflict(ex) or \
+                    retry + 1 >= VERSION_CONFLICT_RETRIES:
+                raise
+            ctx.logger.debug('Version conflict on {}, retry: {}'
+                             .format(instance_id, retry))
+            resulted_state = None
+        else:
+            break
+    if debug_states:
+        resulted_state = manager.node_instances.get(instance_id)
+        ctx.logger.debug(
+            'State after update: {}'
+            .format(repr(obfuscate_passwords(resulted_state))))
 
 
-def _update_runtime_properties(ctx, instance_id, properties_updates):
+def _update_runtime_properties(ctx, properties_updates,
+                               workers=UPDATE_WORKERS):
+    # properties_updates - dictionary with such structure:
+    # {
+    #   instance_id: {runtime_properties updates}
+    # }
+    if not properties_updates:
+        return
     manager = get_rest_client()
+    debug_states = ctx.logger.isEnabledFor(logging.DEBUG)
+
+    resulted_states = _get_node_instances_by_ids(
+        ctx, manager, properties_updates,
+        ['id', 'version', 'runtime_properties'])
 
-    resulted_state = manager.node_instances.get(instance_id)
-    ctx.logger.debug('State before update: {}'
-                     .format(repr(obfuscate_passwords(resulted_state))))
-    ctx.logger.info("Update node: {}".format(instance_id))
-    runtime_properties = resulted_state.runtime_properties or {}
-    runtime_properties.update(properties_updates)
-    manager.node_instances.update(node_instance_id=instance_id,
-                                  runtime_properties=runtime_properties,
-                                  version=resulted_state.version + 1)
-    resulted_state = manager.node_instances.get(instance_id)
-    ctx.logger.debug('State after update: {}'
-                     .format(repr(obfuscate_passwords(resulted_state))))
-
-
-def _cleanup_instances(ctx, instance_ids):
+    def _update_instance(instance_id):
+        def _get_update_kwargs(resulted_state):
+            runtime_properties = resulted_state.runtime_properties or {}
+            runtime_properties.update(properties_updates[instance_id])
+            return {'runtime_properties': runtime_properties}
+
+        ctx.logger.info("Update node: {}".format(instance_id))
+        _update_node_instance(ctx, manager, instance_id,
+                              resulted_states.get(instance_id),
+                              _get_update_kwargs, debug_states)
+
+    _run_in_pool(_update_instance, properties_updates, workers)
+
+
+def _cleanup_instances(ctx, instance_ids, workers=UPDATE_WORKERS):
+    # failed cleanup does not stop cleanup of other instances, error with
+    # all failed instances is raised after cleanup of all instances
+    if not instance_ids:
+        return
     manager = get_rest_client()
+    debug_states = ctx.logger.isEnabledFor(logging.DEBUG)
 
-    for instance_id in instance_ids:
-        resulted_state = manager.node_instances.get(instance_id)
-        ctx.logger.debug('State before update: {}'
-                         .format(repr(obfuscate_passwords(resulted_state))))
+    include = ['id', 'version']
+    if debug_states:
+        include += ['state', 'runtime_properties']
+    resulted_states = _get_node_instances_by_ids(
+        ctx, manager, instance_ids, include)
+
+    def _cleanup_instance(instance_id):
         ctx.logger.info("Cleanup node: {}".format(instance_id))
-        manager.node_instances.update(node_instance_id=instance_id,
-                                      runtime_properties={},
-                                      state='uninitialized',
-                                      version=resulted_state.version + 1)
-        resulted_state = manager.node_instances.get(instance_id)
-        ctx.logger.debug('State after update: {}'
-                         .format(repr(obfuscate_passwords(resulted_state))))
+        try:
+            _update_node_instance(
+                ctx, manager, instance_id, resulted_states.get(instance_id),
+                lambda _: {'runtime_properties': {},
+                           'state': 'uninitialized'},
+                debug_states)
+        except Exception as ex:
+            ctx.logger.error('Cleanup node {} failed: {}'
+                             .format(instance_id, repr(ex)))
+            return instance_id, repr(ex)
+        return instance_id, None
+
+    failed = {
+        instance_id: error
+        for instance_id, error in _run_in_pool(
+            _cleanup_instance, instance_ids, workers)
+        if error
+    }
+    if failed:
+        raise Exception('Cleanup failed for {} of {} instances: {}'
+                        .format(len(failed), len(instance_ids),
+                                repr(failed)))
 
 
 def _deployments_get_groups(ctx):
@@ -76,52 +231,137 @@ def _deployments_get_groups(ctx):
     return deployment['groups']
 
 
+def _compile_field_path(field_path):
+    # returns getter for value by path in runtime properties, same rules as
+    # get_field_value_recursive, but path is parsed only once
+    path = []
+    for key in field_path or []:
+        try:
+            index = int(key)
+        except (TypeError, ValueError):
+            index = None
+        path.append((key, index))
+
+    def _get_value(properties):
+        for key, index in path:
+            if isinstance(properties, list):
+                if index is None:
+                    return None
+                try:
+                    properties = properties[index]
+                except IndexError:
+                    return None
+            elif isinstance(properties, dict):
+                try:
+                    properties = properties[key]
+                except (KeyError, TypeError):
+                    return None
+            else:
+                return None
+        return properties
+
+    return _get_value
+
+
+def _compile_values_matcher(values):
+    # returns check for value in list of values, hashable values are checked
+    # by set, unhashable (dict, list) by compare with each value
+    hashable_values = set()
+    unhashable_values = []
+    for value in values or []:
+        try:
+            hashable_values.add(value)
+        except TypeError:
+            unhashable_values.append(value)
+
+    def _match(value):
+        try:
+            if value in hashable_values:
+                return True
+        except TypeError:
+            pass
+        return value in unhashable_values
+
+    return _match
+
+
+def _get_scaling_groups_index(ctx):
+    # node name -> scaling group, built once for all scaled nodes
+    scaling_groups = ctx.deployment.scaling_groups
+    groups = _deployments_get_groups(ctx)
+    index = {}
+    for scalegroup in groups:
+        # check that we really have such scalling group
+        if scalegroup not in scaling_groups:
+            continue
+        # first group with node is used for scale
+        for node_name in groups[scalegroup]['members']:
+            index.setdefault(node_name, scalegroup)
+    return index
+
+
 def _get_transaction_instances(ctx, scale_transaction_field,
                                scale_node_names, scale_node_field_path,
-                               scale_node_field_values, all_results=False):
+                               scale_node_field_values, all_results=False,
+                               page_size=INSTANCES_PAGE_SIZE):
     client = get_rest_client()
-    # search transaction ids
-    list_kwargs = {
-        'deployment_id': ctx.deployment.id,
-        '_include': ['runtime_properties', 'node_id', 'id']
-    }
-    if all_results:
-        list_kwargs['_get_all_results'] = True
-    instances = client.node_instances.list(**list_kwargs)
-    transaction_ids = []
+    # search transaction ids, runtime properties are dropped after check of
+    # each page
+    instances = _iter_node_instances(
+        client,
+        page_size=page_size,
+        all_results=all_results,
+        deployment_id=ctx.deployment.id,
+        _include=['runtime_properties', 'node_id', 'id'])
+    # transaction id -> [(node_id, instance_id)], filled in the same pass
+    # as the filter, so peers are resolved without a second list call
+    transaction_index = {}
+    # ordered set of matched transactions
+    transaction_ids = {}
     node_instances = {}
     instance_ids = []
+    # seen values for check membership without scan of result lists
+    node_instance_pairs = set()
+    instance_ids_set = set()
+    get_field_value = _compile_field_path(scale_node_field_path)
+    match_field_value = _compile_values_matcher(scale_node_field_values)
+
+    def _save_instance(node_id, instance_id):
+        # save node type
+        if (node_id, instance_id) not in node_instance_pairs:
+            node_instance_pairs.add((node_id, instance_id))
+            node_instances.setdefault(node_id, []).append(instance_id)
+        # save exact instance id
+        if instance_id not in instance_ids_set:
+            instance_ids_set.add(instance_id)
+            instance_ids.append(instance_id)
 
     for instance in instances:
-        runtime_properties = instance.runtime_properties
+        runtime_properties = instance.runtime_properties or {}
+        transaction_id = None
+        if scale_transaction_field:
+            transaction_id = runtime_properties.get(scale_transaction_field)
+        # index all instances with transaction
+        if transaction_id:
+            try:
+                transaction_index.setdefault(transaction_id, []).append(
+                    (instance.node_id, instance.id))
+            except TypeError:
+                ctx.logger.debug("Unhashable transaction id: {}"
+                                 .format(repr(transaction_id)))
+                transaction_id = None
         # check that we have correct node name
         if scale_node_names and instance.node_id not in scale_node_names:
             continue
         # check that we have such values in properties
-        value = get_field_value_recursive(ctx.logger,
-                                          runtime_properties,
-                                          scale_node_field_path)
-        if value not in scale_node_field_values:
+        if not match_field_value(get_field_value(runtime_properties)):
             continue
         # save instances to scale "settings", for case when instances created
         # without transaction
-        if not node_instances.get(instance.node_id):
-            node_instances[instance.node_id] = []
-        # save node type (instances without transaction)
-        if instance.id not in node_instances[instance.node_id]:
-            node_instances[instance.node_id].append(instance.id)
-        # save exact instance id (instances without transaction)
-        if instance.id not in instance_ids:
-            instance_ids.append(instance.id)
-        # ignore transaction
-        if not scale_transaction_field:
-            continue
-        # check transactions
-        if not runtime_properties.get(scale_transaction_field):
-            continue
+        _save_instance(instance.node_id, instance.id)
         # save transaction to list
-        transaction_ids.append(
-            runtime_properties.get(scale_transaction_field))
+        if transaction_id:
+            transaction_ids[transaction_id] = True
 
     # list will be empty if no scale_transaction_field
     if not transaction_ids:
@@ -129,26 +369,13 @@ def _get_transaction_instances(ctx, scale_transaction_field,
         ctx.logger.debug("List instances: {}".format(repr(instance_ids)))
         return node_instances, instance_ids
 
-    ctx.logger.debug("Transaction ids: {}".format(repr(transaction_ids)))
+    ctx.logger.debug("Transaction ids: {}".format(
+        repr(list(transaction_ids))))
 
     # search instances for remove
-    instances = client.node_instances.list(**list_kwargs)
-
-    for instance in instances:
-        runtime_properties = instance.runtime_properties
-        transaction_id = runtime_properties.get(scale_transaction_field)
-        # not our transaction, skip
-        if transaction_id not in transaction_ids:
-            continue
-        # no such group yet
-        if not node_instances.get(instance.node_id):
-            node_instances[instance.node_id] = []
-        # maybe we already have such type
-        if instance.id not in node_instances[instance.node_id]:
-            node_instances[instance.node_id].append(instance.id)
-        # maybe we already have such instance
-        if instance.id not in instance_ids:
-            instance_ids.append(instance.id)
+    for transaction_id in transaction_ids:
+        for node_id, instance_id in transaction_index[transaction_id]:
+            _save_instance(node_id, instance_id)
 
     ctx.logger.debug("List nodes: {}".format(repr(node_instances)))
     ctx.logger.debug("List instances: {}".format(repr(instance_ids)))
@@ -162,8 +389,7 @@ def _get_scale_list(ctx, scalable_entity_properties, property_type):
     # }
     # property_type - kind of values inside list of node names(types).
     scalable_entity_dict = {}
-    scaling_groups = ctx.deployment.scaling_groups
-    groups = _deployments_get_groups(ctx)
+    scaling_groups_index = _get_scaling_groups_index(ctx)
 
     ctx.logger.debug("Scale entities: {}"
                      .format(repr(scalable_entity_properties)))
@@ -187,27 +413,22 @@ def _get_scale_list(ctx, scalable_entity_properties, property_type):
                     "You use wrong value for runtime properties item: {}"
                     .format(repr(scalable_entity_properties[node_name])))
         # get parent group
-        for scalegroup in groups:
-            # check that we really have such scalling group
-            if scalegroup not in scaling_groups:
-                continue
-            # check node in nodes group
-            if node_name in groups[scalegroup]['members']:
-                # not selected
-                if scalegroup not in scalable_entity_dict:
-                    scalable_entity_dict[scalegroup] = {
-                        'count': 0,
-                        'values': []
-                    }
-                # already have have such group, scale by max value
-                if scalable_entity_dict[scalegroup]['count'] < node_amount:
-                    scalable_entity_dict[scalegroup]['count'] = node_amount
-                # save instance id's for scale down workflow
-                # ignored for scale up
-                scalable_entity_dict[scalegroup]['values'] += (
-                    scalable_entity_properties[node_name]
-                )
-                break
+        scalegroup = scaling_groups_index.get(node_name)
+        if scalegroup:
+            # not selected
+            if scalegroup not in scalable_entity_dict:
+                scalable_entity_dict[scalegroup] = {
+                    'count': 0,
+                    'values': []
+                }
+            # already have have such group, scale by max value
+            if scalable_entity_dict[scalegroup]['count'] < node_amount:
+                scalable_entity_dict[scalegroup]['count'] = node_amount
+            # save instance id's for scale down workflow
+            # ignored for scale up
+            scalable_entity_dict[scalegroup]['values'] += (
+                scalable_entity_properties[node_name]
+            )
         else:
             # no such group
             if node_name not in scalable_entity_dict:
@@ -226,7 +447,8 @@ def _get_scale_list(ctx, scalable_entity_properties, property_type):
 
 
 def _process_node_instances(ctx, graph, node_instances, ignore_failure,
-                            node_instance_subgraph_func, node_sequence):
+                            node_instance_subgraph_func, node_sequence,
+                            execute=True):
     ctx.logger.info("Scale sequence: {}".format(repr(node_sequence)))
     subgraphs = {}
     node_graphs = {}
@@ -245,20 +467,43 @@ def _process_node_instances(ctx, graph, node_instances, ignore_failure,
         if not node_graphs.get(node_id, []):
             continue
         current_level_instances = node_graphs[node_id]
-        for target_instance in current_level_instances:
+        _add_level_dependencies(ctx, graph, subgraphs, node_id,
+                                previous_level, current_level_instances)
+        # replace previous with current instances
+        previous_level = current_level_instances
+    if execute:
+        graph.execute()
+
+
+def _add_level_dependencies(ctx, graph, subgraphs, node_id,
+                            previous_level, current_level):
+    if not previous_level:
+        return
+    if len(previous_level) * len(current_level) <= \
+            len(previous_level) + len(current_level):
+        for target_instance in current_level:
             for source_instance in previous_level:
                 ctx.logger.info("Scale dependency: {}->{}"
                                 .format(source_instance.id,
                                         target_instance.id))
                 graph.add_dependency(subgraphs[source_instance.id],
                                      subgraphs[target_instance.id])
-        # replace previous with current instances
-        previous_level = current_level_instances
-    graph.execute()
+        return
+    # add stub subgraph between levels, so we have N+M dependencies
+    # instead of N*M (same as in execute_operation with
+    # run_by_dependency_order)
+    ctx.logger.info("Scale dependency: {} instances->{}->{} instances"
+                    .format(len(previous_level), node_id,
+                            len(current_level)))
+    barrier = graph.subgraph("scale_level_{}".format(node_id))
+    for source_instance in previous_level:
+        graph.add_dependency(subgraphs[source_instance.id], barrier)
+    for target_instance in current_level:
+        graph.add_dependency(barrier, subgraphs[target_instance.id])
 
 
 def _uninstall_instances(ctx, graph, removed, related, ignore_failure,
-                         node_sequence):
+                         node_sequence, update_workers=UPDATE_WORKERS):
 
     # cleanup tasks
     for task in get_tasks_from_graph(graph):
@@ -284,7 +529,7 @@ def _uninstall_instances(ctx, graph, removed, related, ignore_failure,
         # clean up properties
         instance_ids = [node_instance._node_instance.id
                         for node_instance in removed]
-        _cleanup_instances(ctx, instance_ids)
+        _cleanup_instances(ctx, instance_ids, workers=update_workers)
 
 
 def _run_scale_settings(ctx, scale_settings, scalable_entity_properties,
@@ -294,7 +539,8 @@ def _run_scale_settings(ctx, scale_settings, scalable_entity_properties,
                         ignore_rollback_failure=True,
                         instances_remove_ids=None,
                         node_sequence=None,
-                        rollback_on_failure=True):
+                        rollback_on_failure=True,
+                        update_workers=UPDATE_WORKERS):
     modification = ctx.deployment.start_modification(scale_settings)
     ctx.refresh_node_instances()
     graph = ctx.graph_mode()
@@ -312,14 +558,15 @@ def _run_scale_settings(ctx, scale_settings, scalable_entity_properties,
                         if i.modification == 'added')
             related = added_and_related - added
             try:
+                properties_updates = {}
                 for node_instance in added:
-                    properties_updates = scalable_entity_properties.get(
+                    instance_updates = scalable_entity_properties.get(
                         node_instance._node_instance.node_id, {})
                     # save properties updates
                     properties = {}
-                    if properties_updates:
+                    if instance_updates:
                         # pop one dict for runtime properties
-                        properties.update(properties_updates.pop())
+                        properties.update(instance_updates.pop())
                     # save transaction list
                     if scale_transaction_field:
                         # save original set of instances in scale up.
@@ -339,8 +586,10 @@ def _run_scale_settings(ctx, scale_settings, scalable_entity_properties,
                                 node_instance._node_instance.node_id,
                                 node_instance._node_instance.id,
                                 repr(obfuscate_passwords(properties))))
-                        _update_runtime_properties(
-                            ctx, node_instance._node_instance.id, properties)
+                        properties_updates[
+                            node_instance._node_instance.id] = properties
+                _update_runtime_properties(ctx, properties_updates,
+                                           workers=update_workers)
                 if node_sequence:
                     subgraph_func = lifecycle.install_node_instance_subgraph
                     _process_node_instances(
@@ -366,7 +615,8 @@ def _run_scale_settings(ctx, scale_settings, scalable_entity_properties,
                         removed=added,
                         related=related,
                         ignore_failure=ignore_rollback_failure,
-                        node_sequence=node_sequence)
+                        node_sequence=node_sequence,
+                        update_workers=update_workers)
                 else:
                     ctx.logger.warn('Scale out failed, but '
                                     'rollback_on_failure is disabled. {}'
@@ -399,7 +649,8 @@ def _run_scale_settings(ctx, scale_settings, scalable_entity_properties,
                                  removed=removed,
                                  ignore_failure=ignore_failure,
                                  related=related,
-                                 node_sequence=node_sequence)
+                                 node_sequence=node_sequence,
+                                 update_workers=update_workers)
     except Exception as ex:
         if rollback_on_failure:
             ctx.logger.warn('Rolling back deployment modification. '
@@ -413,37 +664,281 @@ def _run_scale_settings(ctx, scale_settings, scalable_entity_properties,
     modification.finish()
 
 
+def _scale_units(ctx, scale_id):
+    # instances added or removed together by modification: instance of
+    # scaled node or all members of scaling group instance, with contained
+    # instances
+    units = {}
+    if scale_id in ctx.deployment.scaling_groups:
+        for node in ctx.nodes:
+            for instance in node.instances:
+                for group in instance.scaling_groups:
+                    if group.get('name') == scale_id:
+                        units.setdefault(group.get('id'), set()).update(
+                            instance.get_contained_subgraph())
+    else:
+        node = ctx.get_node(scale_id)
+        for instance in node.instances if node else []:
+            units[instance.id] = instance.get_contained_subgraph()
+    return units
+
+
+def _count_operations(node, operations, relationship_operations):
+    count = len([name for name in operations if node.has_operation(name)])
+    for relationship in node.relationships:
+        for name in relationship_operations:
+            for defined in [relationship.source_operations,
+                            relationship.target_operations]:
+                if (defined.get(name) or {}).get('operation'):
+                    count += 1
+    return count
+
+
+def _count_chunks(count, chunk_size=INSTANCES_IDS_CHUNK_SIZE):
+    return (count + chunk_size - 1) // chunk_size
+
+
+def _count_level_dependencies(node_sequence, level_sizes):
+    # same dependencies as added by _add_level_dependencies
+    dependencies = 0
+    barriers = 0
+    previous_level = 0
+    for node_id in node_sequence:
+        current_level = level_sizes.get(node_id, 0)
+        if not current_level:
+            continue
+        if previous_level:
+            if previous_level * current_level <= \
+                    previous_level + current_level:
+                dependencies += previous_level * current_level
+            else:
+                dependencies += previous_level + current_level
+                barriers += 1
+        previous_level = current_level
+    return dependencies, barriers
+
+
+def _plan_scale_settings(ctx, scale_settings, scalable_entity_properties,
+                         scale_transaction_field=None, node_sequence=None):
+    """Check scale settings with current node instances and scaling groups,
+    deployment is not changed"""
+    start_time = time.time()
+    # node id -> count of new instances
+    added = {}
+    removed = set()
+    for scale_id, settings in scale_settings.items():
+        units = _scale_units(ctx, scale_id)
+        delta = settings['instances'] - len(units)
+        if delta > 0:
+            if units:
+                # new unit has same instances as first current unit
+                for instance in units[sorted(units)[0]]:
+                    added[instance.node_id] = (
+                        added.get(instance.node_id, 0) + delta)
+            elif scale_id in ctx.deployment.scaling_groups:
+                group = ctx.deployment.scaling_groups[scale_id]
+                for node_id in group.get('members', []):
+                    added[node_id] = added.get(node_id, 0) + delta
+            else:
+                added[scale_id] = added.get(scale_id, 0) + delta
+        elif delta < 0:
+            unit_ids = {}
+            for unit_id, instances in units.items():
+                for instance in instances:
+                    unit_ids[instance.id] = unit_id
+            # proposed instances first, other units only if not enough
+            selected = []
+            for instance_id in settings.get('removed_ids_include_hint', []):
+                unit_id = unit_ids.get(instance_id)
+                if unit_id is not None and unit_id not in selected:
+                    selected.append(unit_id)
+            for unit_id in sorted(units):
+                if unit_id not in selected:
+                    selected.append(unit_id)
+            for unit_id in selected[:-delta]:
+                removed.update(units[unit_id])
+
+    removed_ids = set(instance.id for instance in removed)
+    related = set()
+    # dependencies between subgraphs of removed and related instances
+    uninstall_relationships = 0
+    for node in ctx.nodes:
+        for instance in node.instances:
+            for relationship in instance.relationships:
+                if instance.id in removed_ids:
+                    uninstall_relationships += 1
+                    if relationship.target_id not in removed_ids:
+                        related.add(relationship.target_id)
+                elif relationship.target_id in removed_ids:
+                    uninstall_relationships += 1
+                    related.add(instance.id)
+
+    # new instances depend on new instance of target in same unit or on
+    # all instances of other target nodes
+    install_relationships = 0
+    install_related = set()
+    for node_id, count in added.items():
+        node = ctx.get_node(node_id)
+        for relationship in node.relationships if node else []:
+            if relationship.target_id in added:
+                install_relationships += count
+                continue
+            target = ctx.get_node(relationship.target_id)
+            targets = [instance.id for instance in
+                       (target.instances if target else [])]
+            install_related.update(targets)
+            install_relationships += count * len(targets)
+
+    if node_sequence:
+        # instances are installed by levels without relationship
+        # dependencies, instances of nodes out of sequence are skipped
+        removed_sizes = {}
+        for instance in removed:
+            removed_sizes[instance.node_id] = (
+                removed_sizes.get(instance.node_id, 0) + 1)
+        install_levels, install_barriers = _count_level_dependencies(
+            node_sequence, added)
+        uninstall_levels, uninstall_barriers = _count_level_dependencies(
+            node_sequence[::-1], removed_sizes)
+        graph = {
+            'subgraphs': (
+                sum(count for node_id, count in added.items()
+                    if node_id in node_sequence) +
+                sum(count for node_id, count in removed_sizes.items()
+                    if node_id in node_sequence) +
+                install_barriers + uninstall_barriers),
+            'dependencies': {
+                'levels': install_levels + uninstall_levels,
+                'relationships': 0,
+            },
+        }
+    else:
+        # lifecycle adds stub subgraph for each related instance
+        graph = {
+            'subgraphs': (
+                sum(added.values()) + len(install_related) +
+                len(removed) + len(related)),
+            'dependencies': {
+                'levels': 0,
+                'relationships': (
+                    install_relationships + uninstall_relationships),
+            },
+        }
+
+    # same as in _run_scale_settings, one properties dict for each
+    # new instance while dicts are left
+    properties_updates = 0
+    for node_id, count in added.items():
+        with_properties = min(
+            count, len(scalable_entity_properties.get(node_id, [])))
+        properties_updates += with_properties
+        if scale_transaction_field:
+            properties_updates += count - with_properties
+
+    install_operations = 0
+    for node_id, count in added.items():
+        node = ctx.get_node(node_id)
+        if node:
+            install_operations += count * _count_operations(
+                node, INSTALL_OPERATIONS, INSTALL_RELATIONSHIP_OPERATIONS)
+    uninstall_operations = 0
+    for instance in removed:
+        uninstall_operations += _count_operations(
+            instance.node, UNINSTALL_OPERATIONS,
+            UNINSTALL_RELATIONSHIP_OPERATIONS)
+
+    return {
+        'scale_settings': scale_settings,
+        'instances': {
+            'added': added,
+            'removed': sorted(removed_ids),
+            'related': len(related),
+        },
+        'operations': {
+            'install': install_operations,
+            'uninstall': uninstall_operations,
+        },
+        'graph': graph,
+        'rest_calls': {
+            # start, refresh instances, finish
+            'modification': 3,
+            # prefetch by chunks of ids and update for each instance
+            'runtime_properties': (
+                properties_updates + _count_chunks(properties_updates)),
+            'cleanup': len(removed) + _count_chunks(len(removed)),
+            'operations': REST_CALLS_PER_TASK * (install_operations +
+                                                 uninstall_operations),
+        },
+        'timings': {'plan': time.time() - start_time},
+    }
+
+
+def _emit_scale_plan(ctx, plan):
+    plan['rest_calls']['total'] = sum(plan['rest_calls'].values())
+    ctx.logger.info('Scale plan: {}'.format(
+        json.dumps(obfuscate_passwords(plan), sort_keys=True)))
+    return plan
+
+
 def _wait_for_sent_tasks(ctx, graph):
     """Wait for tasks that are in the SENT state to return"""
+    # check states only once, later track only sent tasks
+    sent_tasks = set()
     for task in get_tasks_from_graph(graph):
         # Check type.
+        task_state = task.get_state()
         ctx.logger.debug(
             'Parallel task to failed task: {0}. State: {1}'.format(
-                task.id, task.get_state()))
+                task.id, task_state))
+        if task_state == tasks.TASK_SENT:
+            sent_tasks.add(task)
     try:
         deadline = time.time() + ctx.wait_after_fail
     except AttributeError:
         deadline = time.time() + 1800
-    while deadline > time.time():
-        try:
-            cancelled = api.has_cancel_request()
-        except AttributeError:
-            cancelled = graph._is_execution_cancelled()
-        if cancelled:
-            raise api.ExecutionCancelled()
-
-        finished_tasks = graph._finished_tasks
-        while finished_tasks:
-            task, result = finished_tasks.popitem()
+
+    # graph sets event on each task result and on cancel request
+    tasks_wait = getattr(graph, '_tasks_wait', None)
+    if not isinstance(tasks_wait, threading.Event):
+        tasks_wait = None
+    cancel_callbacks = getattr(api, 'cancel_callbacks', None)
+    if tasks_wait and cancel_callbacks is not None:
+        cancel_callbacks.add(tasks_wait.set)
+
+    delay = WAIT_TASKS_MIN_DELAY
+    try:
+        while deadline > time.time():
             try:
-                graph._handle_terminated_task(result, task)
-            except RuntimeError:
-                ctx.logger.error('Unhandled Failed task: {0}'.format(task))
-        if not any(task.get_state() == tasks.TASK_SENT
-                   for task in get_tasks_from_graph(graph)):
-            break
-        else:
-            time.sleep(0.1)
+                cancelled = api.has_cancel_request()
+            except AttributeError:
+                cancelled = graph._is_execution_cancelled()
+            if cancelled:
+                raise api.ExecutionCancelled()
+
+            if tasks_wait:
+                tasks_wait.clear()
+            finished_tasks = graph._finished_tasks
+            while finished_tasks:
+                task, result = finished_tasks.popitem()
+                sent_tasks.discard(task)
+                try:
+                    graph._handle_terminated_task(result, task)
+                except RuntimeError:
+                    ctx.logger.error(
+                        'Unhandled Failed task: {0}'.format(task))
+            sent_tasks = set(task for task in sent_tasks
+                             if task.get_state() == tasks.TASK_SENT)
+            if not sent_tasks:
+                break
+            timeout = max(0, min(delay, deadline - time.time()))
+            if tasks_wait:
+                tasks_wait.wait(timeout)
+            else:
+                time.sleep(timeout)
+            delay = min(delay * 2, WAIT_TASKS_MAX_DELAY)
+    finally:
+        if tasks_wait and cancel_callbacks is not None:
+            cancel_callbacks.discard(tasks_wait.set)
 
 
 def _scaledown_group_to_settings(ctx, list_scale_groups, scale_compute):
@@ -499,11 +994,18 @@ def scaledownlist(ctx, scale_compute=False,
                   node_sequence=None,
                   force_remove=True,
                   rollback_on_failure=True,
+                  update_workers=UPDATE_WORKERS,
+                  dry_run=False,
+                  page_size=INSTANCES_PAGE_SIZE,
                   **_):
     if not scale_node_field:
         raise ValueError('You should provide `scale_node_field` for correct'
                          'downscale.')
 
+    if page_size < 1:
+        raise ValueError('You should provide positive `page_size`, '
+                         'got {}.'.format(repr(page_size)))
+
     if isinstance(scale_node_field_value, text_type):
         scale_node_field_value = [scale_node_field_value]
 
@@ -520,13 +1022,15 @@ def scaledownlist(ctx, scale_compute=False,
     if isinstance(scale_node_field, text_type):
         scale_node_field = [scale_node_field]
 
+    start_time = time.time()
     instances, instance_ids = _get_transaction_instances(
         ctx=ctx,
         scale_transaction_field=scale_transaction_field,
         scale_node_names=scale_node_name,
         scale_node_field_path=scale_node_field,
         scale_node_field_values=scale_node_field_value,
-        all_results=all_results)
+        all_results=all_results,
+        page_size=page_size)
 
     if not instance_ids:
         ctx.logger.info("Empty list for instances for remove.")
@@ -536,12 +1040,25 @@ def scaledownlist(ctx, scale_compute=False,
     scale_settings = _scaledown_group_to_settings(
         ctx, _get_scale_list(ctx, instances, text_type), scale_compute)
 
+    if dry_run:
+        scale_list_time = time.time() - start_time
+        plan = _plan_scale_settings(ctx, scale_settings, {},
+                                    node_sequence=node_sequence)
+        plan['timings']['scale_list'] = scale_list_time
+        # scaling groups and pages of instances for filter
+        instances_count = sum(
+            len(list(node.instances)) for node in ctx.nodes)
+        plan['rest_calls']['scale_list'] = 1 + (
+            instances_count // page_size + 1 if all_results else 1)
+        return _emit_scale_plan(ctx, plan)
+
     try:
         _run_scale_settings(ctx, scale_settings, {},
                             instances_remove_ids=instance_ids,
                             ignore_failure=ignore_failure,
                             node_sequence=node_sequence,
-                            rollback_on_failure=rollback_on_failure)
+                            rollback_on_failure=rollback_on_failure,
+                            update_workers=update_workers)
     except Exception as e:
         ctx.logger.info('Scale down based on transaction failed: {}'
                         .format(repr(e)))
@@ -558,7 +1075,8 @@ def scaledownlist(ctx, scale_compute=False,
                                  removed=removed,
                                  related=[],
                                  ignore_failure=ignore_failure,
-                                 node_sequence=node_sequence)
+                                 node_sequence=node_sequence,
+                                 update_workers=update_workers)
 
         # remove from DB
         if force_db_cleanup:
@@ -604,6 +1122,29 @@ def _scaleup_group_to_settings(ctx, scalable_entity_dict, scale_compute):
     return scale_settings
 
 
+def _scaleup_waves_to_settings(ctx, scalable_entity_dict, scale_compute,
+                               wave_size):
+    # split scale to waves with up to wave_size new instances for each
+    # scalable entity, settings for all waves are calculated before first
+    # modification so all waves use same current instances counts
+    waves_settings = []
+    wave = 0
+    while True:
+        wave += 1
+        wave_entity_dict = {}
+        for scalable_entity_name in scalable_entity_dict:
+            count = scalable_entity_dict[scalable_entity_name]['count']
+            wave_entity_dict[scalable_entity_name] = {
+                'count': min(count, wave_size * wave),
+                'values': scalable_entity_dict[scalable_entity_name]['values']
+            }
+        ctx.logger.info('Scale wave {}'.format(wave))
+        waves_settings.append(_scaleup_group_to_settings(
+            ctx, wave_entity_dict, scale_compute))
+        if wave_entity_dict == scalable_entity_dict:
+            return waves_settings
+
+
 @workflow
 def scaleuplist(ctx, scalable_entity_properties,
                 scale_compute=False,
@@ -613,6 +1154,9 @@ def scaleuplist(ctx, scalable_entity_properties,
                 scale_transaction_value="",
                 node_sequence=None,
                 rollback_on_failure=True,
+                update_workers=UPDATE_WORKERS,
+                wave_size=0,
+                dry_run=False,
                 **kwargs):
 
     if not scalable_entity_properties:
@@ -620,20 +1164,67 @@ def scaleuplist(ctx, scalable_entity_properties,
 
     # we have list of dictionaries with runtime properties for new instances as
     # part of scale dictionary
-    scale_settings = _scaleup_group_to_settings(
-        ctx, _get_scale_list(ctx, scalable_entity_properties, dict),
-        scale_compute)
+    start_time = time.time()
+    scalable_entity_dict = _get_scale_list(
+        ctx, scalable_entity_properties, dict)
+
+    if dry_run:
+        scale_list_time = time.time() - start_time
+        # plan full scale, waves are only split of same instances
+        scale_settings = _scaleup_group_to_settings(
+            ctx, scalable_entity_dict, scale_compute)
+        plan = _plan_scale_settings(ctx, scale_settings,
+                                    scalable_entity_properties,
+                                    scale_transaction_field,
+                                    node_sequence=node_sequence)
+        plan['timings']['scale_list'] = scale_list_time
+        # scaling groups
+        plan['rest_calls']['scale_list'] = 1
+        if wave_size and wave_size > 0:
+            plan['waves'] = _scaleup_waves_to_settings(
+                ctx, scalable_entity_dict, scale_compute, wave_size)
+            # modification for each wave
+            plan['rest_calls']['modification'] *= len(plan['waves'])
+        return _emit_scale_plan(ctx, plan)
+
+    if not wave_size or wave_size < 0:
+        scale_settings = _scaleup_group_to_settings(
+            ctx, scalable_entity_dict, scale_compute)
+
+        _run_scale_settings(ctx, scale_settings, scalable_entity_properties,
+                            scale_transaction_field, scale_transaction_value,
+                            ignore_failure, ignore_rollback_failure,
+                            node_sequence=node_sequence,
+                            rollback_on_failure=rollback_on_failure,
+                            update_workers=update_workers)
+        return
 
-    _run_scale_settings(ctx, scale_settings, scalable_entity_properties,
-                        scale_transaction_field, scale_transaction_value,
-                        ignore_failure, ignore_rollback_failure,
-                        node_sequence=node_sequence,
-                        rollback_on_failure=rollback_on_failure)
+    waves_settings = _scaleup_waves_to_settings(
+        ctx, scalable_entity_dict, scale_compute, wave_size)
+    # all waves are part of same transaction
+    if scale_transaction_field and not scale_transaction_value:
+        scale_transaction_value = ctx.execution_id
+
+    for wave, scale_settings in enumerate(waves_settings):
+        ctx.logger.info('Scale up wave {} of {}.'
+                        .format(wave + 1, len(waves_settings)))
+        # only current wave is rolled back on failure, instances from
+        # previous waves are already installed
+        _run_scale_settings(ctx, scale_settings, scalable_entity_properties,
+                            scale_transaction_field, scale_transaction_value,
+                            ignore_failure, ignore_rollback_failure,
+                            node_sequence=node_sequence,
+                            rollback_on_failure=rollback_on_failure,
+                            update_workers=update_workers)
 
 
 def _filter_node_instances(ctx, node_ids, node_instance_ids, type_names,
                            operation, node_field_path, node_field_value):
     filtered_node_instances = []
+    node_ids = set(node_ids or [])
+    node_instance_ids = set(node_instance_ids or [])
+    get_field_value = _compile_field_path(node_field_path)
+    match_field_value = _compile_values_matcher(node_field_value)
     for node in ctx.nodes:
         # no such action skip it
         if operation not in node.operations:
@@ -657,10 +1248,7 @@ def _filter_node_instances(ctx, node_ids, node_instance_ids, type_names,
             if node_field_path:
                 # check that we have such values in properties
                 runtime_properties = instance._node_instance.runtime_properties
-                value = get_field_value_recursive(ctx.logger,
-                                                  runtime_properties,
-                                                  node_field_path)
-                if value not in node_field_value:
+                if not match_field_value(get_field_value(runtime_properties)):
                     continue
             # looks as good instance
             filtered_node_instances.append(instance)
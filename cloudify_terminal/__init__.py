@@ -12,7 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from jinja2 import Environment
 
 from cloudify import context
 from cloudify.decorators import operation
@@ -20,6 +26,7 @@ from cloudify import exceptions as cfy_exc
 from cloudify import ctx as CloudifyContext
 
 from cloudify_common_sdk import exceptions
+from cloudify_common_sdk.filters import _toxml
 
 # Cloudify delete node action
 START_NODE_ACTION = "cloudify.interfaces.lifecycle.start"
@@ -29,6 +36,9 @@ DELETE_NODE_ACTION = "cloudify.interfaces.lifecycle.delete"
 # operation flags
 FINISHED_OPERATIONS = '_finished_operations'
 
+# max count of parsed templates and resources kept by process
+TEMPLATE_CACHE_SIZE = 256
+
 
 def rerun(ctx, func, args, kwargs, retry_count=10, retry_sleep=15):
     while retry_count > 0:
@@ -100,6 +110,67 @@ def operation_cleanup(func, force=False):
     return operation(func=wrapper, resumable=True)
 
 
-def workflow_get_resource(file_name):
+class TemplateCache(object):
+    """Thread safe LRU cache shared by all operations in process."""
+
+    def __init__(self, size=TEMPLATE_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key, create):
+        with self._lock:
+            if key in self._items:
+                value = self._items.pop(key)
+                # move to the end as most recently used
+                self._items[key] = value
+                return value
+        # create outside of lock, same value can be created twice in
+        # parallel but will be stored only once
+        value = create()
+        with self._lock:
+            self._items[key] = value
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+templates_cache = TemplateCache()
+
+_template_environment = Environment()
+_template_environment.filters["toxml"] = _toxml
+
+
+def render_cached_template(template_name, template_txt, params):
+    """Render Jinja template, compiled template is reused by content"""
+    content_hash = hashlib.sha256(
+        template_txt.encode('utf-8')).hexdigest()
+    template = templates_cache.get(
+        ('template', template_name, content_hash),
+        lambda: _template_environment.from_string(template_txt))
+    return template.render(params)
+
+
+def _read_resource(file_name):
     with open(file_name, 'r') as f:
         return f.read()
+
+
+def workflow_get_resource(file_name):
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        # let open report real issue
+        return _read_resource(file_name)
+    # file changes are detected by modification time and size
+    return templates_cache.get(
+        ('resource', os.path.abspath(file_name), stat.st_mtime,
+         stat.st_size),
+        lambda: _read_resource(file_name))
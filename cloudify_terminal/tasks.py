@@ -21,12 +21,12 @@ from cloudify import exceptions as cfy_exc
 from cloudify import ctx as CloudifyContext
 
 from cloudify_common_sdk.filters import (obfuscate_passwords,
-                                         shorted_text,
-                                         render_template, )
+                                         shorted_text, )
 from cloudify_common_sdk._compat import text_type
 import cloudify_terminal_sdk.terminal_connection as terminal_connection
 
-from . import rerun, operation_cleanup, workflow_get_resource
+from . import (rerun, operation_cleanup, workflow_get_resource,
+               render_cached_template)
 
 
 def _execute(ctx, properties, runtime_properties, get_resource, host_ip,
@@ -136,8 +136,9 @@ def _execute(ctx, properties, runtime_properties, get_resource, host_ip,
                 template_params = {}
             # save context for reuse in template
             template_params['ctx'] = ctx
-            operation = render_template(template.decode('utf-8'),
-                                        template_params)
+            operation = render_cached_template(template_name,
+                                               template.decode('utf-8'),
+                                               template_params)
 
         # incase of template_text
         if not operation and 'template_text' in call:
@@ -150,7 +151,8 @@ def _execute(ctx, properties, runtime_properties, get_resource, host_ip,
                 template_params = {}
             # save context for reuse in template
             template_params['ctx'] = ctx
-            operation = render_template(template, template_params)
+            operation = render_cached_template(None, template,
+                                               template_params)
 
         if not operation:
             continue
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import json
+import tempfile
 import unittest
 from mock import (
     Mock,
@@ -27,6 +28,7 @@ from cloudify.exceptions import (
 )
 from cloudify.manager import DirtyTrackingDict
 
+import cloudify_terminal
 from .. import tasks
 
 from cloudify_common_sdk import exceptions
@@ -423,6 +425,55 @@ class TestTasks(unittest.TestCase):
         self.assertIsNone(
             _ctx.instance.runtime_properties.get('place_for_save'))
 
+    def test_render_cached_template(self):
+        cloudify_terminal.templates_cache.clear()
+        with patch.object(
+            cloudify_terminal._template_environment, 'from_string',
+            Mock(wraps=cloudify_terminal._template_environment.from_string)
+        ) as from_string:
+            for _ in range(3):
+                self.assertEqual(
+                    cloudify_terminal.render_cached_template(
+                        'a.txt', "{{ aa }}", {'aa': 'gg'}), 'gg')
+            self.assertEqual(
+                cloudify_terminal.render_cached_template(
+                    'a.txt', "{{ aa }}", {'aa': 'bb'}), 'bb')
+            # same name with changed content is compiled again
+            self.assertEqual(
+                cloudify_terminal.render_cached_template(
+                    'a.txt', "<{{ aa }}>", {'aa': 'bb'}), '<bb>')
+        self.assertEqual(from_string.call_count, 2)
+
+    def test_templates_cache_evict(self):
+        cache = cloudify_terminal.TemplateCache(size=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        # use 'a' so 'b' is least recently used
+        self.assertEqual(cache.get('a', lambda: 3), 1)
+        cache.get('c', lambda: 4)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a', lambda: 5), 1)
+        self.assertEqual(cache.get('b', lambda: 6), 6)
+
+    def test_workflow_get_resource_cached(self):
+        cloudify_terminal.templates_cache.clear()
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml') as f:
+            f.write("abc")
+            f.flush()
+            self.assertEqual(
+                cloudify_terminal.workflow_get_resource(f.name), "abc")
+            with patch.object(
+                cloudify_terminal, '_read_resource', Mock()
+            ) as read_resource:
+                self.assertEqual(
+                    cloudify_terminal.workflow_get_resource(f.name), "abc")
+            read_resource.assert_not_called()
+            # changed file is read again
+            f.write("def")
+            f.flush()
+            self.assertEqual(
+                cloudify_terminal.workflow_get_resource(f.name), "abcdef")
+
     @patch('time.sleep', Mock())
     def test_run_with_save(self):
         _ctx = self._gen_ctx()